@@ -1,8 +1,15 @@
-import duckdb
 import matplotlib.pyplot as plt
 import logging
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.csv as pa_csv
 from datetime import datetime
 
+import trip_store
+from db_config import connect
+from result_cache import ResultCache
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -10,31 +17,395 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def analyzing_cleandata():
+cab_types = ['yellow', 'green']
+
+#Time dimensions broken down per cab type; adding one here adds a grouping set, not a scan
+DIMENSIONS = ['hour_of_day', 'day_of_week', 'week_of_year', 'month_of_year']
+
+#Columns reported for the single largest-CO2 trip of each cab type
+LARGEST_TRIP_COLUMNS = ['cab_type', 'VendorID', 'pickup_datetime', 'dropoff_datetime',
+                        'trip_distance', 'total_amount', 'co2_emissions_kg']
+
+#Pre-aggregated dbt mart (see dbt/models/marts/co2_rollup_cube.sql)
+CUBE_TABLE = 'co2_rollup_cube'
+
+#Top-K trips per cab type, time bucket and metric (see dbt/models/marts/trip_leaderboard.sql)
+LEADERBOARD_TABLE = 'trip_leaderboard'
+
+#CO2 and trips per cab type, pickup month, hour and zone pair (see dbt/models/marts/zone_od_hourly.sql)
+OD_TABLE = 'zone_od_hourly'
+#TLC taxi zone IDs run 1..265 (264/265 are the 'Unknown' and outside-NYC zones)
+ZONES = 265
+
+def table_exists(con, table):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?;", [table]
+    ).fetchone()[0] > 0
+
+#Trip rows: the transformed layer of the Parquet store, read in place, when one is configured
+def trips_relation(row_numbers=False):
+    return trip_store.relation('transformed', row_numbers=row_numbers) if trip_store.enabled() else 'all_data_transformed'
+
+#Block of VECTOR_ROWS consecutive rows a trip belongs to (system sampling keeps or drops whole blocks)
+VECTOR_ROWS = 2048
+def trip_block():
+    if trip_store.enabled():
+        return f"hash(filename, file_row_number // {VECTOR_ROWS})"
+    return f"rowid // {VECTOR_ROWS}"
+
+#Rollup input: the cube's additive sums, or the trip rows themselves if the cube is not built yet
+CUBE_MEASURES = "SUM(trips) AS trips, SUM(co2_sum) AS co2_sum"
+TRIP_MEASURES = "COUNT(*) AS trips, SUM(co2_emissions_kg) AS co2_sum"
+
+#Run a query through the result cache when one is given; `tables` are the tables it reads
+def run_query(con, sql, tables, cache=None):
+    return cache.execute(con, sql, tables) if cache else con.execute(sql)
+
+#Quick-look mode: fraction of trip blocks sampled (PIPELINE_SAMPLE_RATE, e.g. 0.01) and the fixed seed
+SAMPLE_SEED = 42
+#Widest 95% interval, relative to the estimate, accepted before falling back to the exact rollups
+MAX_RELATIVE_ERROR = 0.05
+Z_95 = 1.96
+SAMPLE_QUANTILES = [0.5, 0.9, 0.99]
+
+# ------------------------------
+# Function: compute_rollups
+# Purpose: Compute every breakdown the report and the plot need in ONE query,
+# using GROUPING SETS over cab_type and each time dimension. The query reads the
+# few-thousand-row co2_rollup_cube; averages are re-derived from its sums and counts.
+# Returns {dimension: {cab: {'bucket', 'co2_kg', 'co2_tons', 'trips', 'avg_co2': NumPy arrays}}}
+# plus 'largest' -> {cab: {column: value}} for the heaviest trip (from trip_leaderboard).
+# With a ResultCache, unchanged data is answered from the cached results.
+# ------------------------------
+def compute_rollups(con, cache=None):
+    grouping_sets = ", ".join(["(cab_type)"] + [f"(cab_type, {dim})" for dim in DIMENSIONS])
+    dimension = " ".join(f"WHEN GROUPING({dim}) = 0 THEN '{dim}'" for dim in DIMENSIONS)
+
+    if table_exists(con, CUBE_TABLE):
+        source = f"SELECT cab_type, {', '.join(DIMENSIONS)}, trips, co2_sum FROM {CUBE_TABLE}"
+        measures = CUBE_MEASURES
+        tables = [CUBE_TABLE]
+    else:
+        logger.warning(f"{CUBE_TABLE} not found, aggregating trip rows (run transform.py)")
+        source = f"SELECT cab_type, {', '.join(DIMENSIONS)}, co2_emissions_kg FROM {trips_relation()}"
+        measures = TRIP_MEASURES
+        tables = ['all_data_transformed']
+
+    #Columns come back as NumPy arrays; each breakdown is a boolean-mask slice of them
+    result = run_query(con, f"""
+        WITH rollup AS (
+            SELECT
+                CASE {dimension} ELSE 'total' END AS dimension,
+                cab_type,
+                COALESCE({', '.join(DIMENSIONS)}) AS bucket,
+                {measures}
+            FROM ({source})
+            GROUP BY GROUPING SETS ({grouping_sets})
+        )
+        SELECT
+            dimension,
+            CAST(cab_type AS VARCHAR) AS cab_type,
+            COALESCE(bucket, 0) AS bucket,
+            ROUND(co2_sum, 2) AS total_co2_kg,
+            CAST(trips AS BIGINT) AS trips,
+            ROUND(co2_sum / trips, 4) AS avg_co2_per_trip
+        FROM rollup
+        ORDER BY dimension, cab_type, bucket;
+    """, tables, cache).fetchnumpy()
+
+    rollups = split_breakdowns(result)
+    rollups['largest'] = largest_trips(con, cache)
+    return rollups
+
+#Slice the one-query result into {dimension: {cab: {column: NumPy array}}}
+def split_breakdowns(result):
+    rollups = {}
+    for dim in DIMENSIONS + ['total']:
+        rollups[dim] = {}
+        for cab in cab_types:
+            mask = (result['dimension'] == dim) & (result['cab_type'] == cab)
+            rollups[dim][cab] = {
+                'bucket': np.asarray(result['bucket'][mask]),
+                'co2_kg': np.asarray(result['total_co2_kg'][mask]),
+                'co2_tons': np.asarray(result['total_co2_kg'][mask]) / 1000,
+                'trips': np.asarray(result['trips'][mask]),
+                'avg_co2': np.asarray(result['avg_co2_per_trip'][mask]),
+            }
+            #Sampled rollups also carry the 95% interval half-widths of the scaled-up totals
+            if 'co2_kg_ci' in result:
+                rollups[dim][cab]['co2_tons_ci'] = np.asarray(result['co2_kg_ci'][mask]) / 1000
+                rollups[dim][cab]['trips_ci'] = np.asarray(result['trips_ci'][mask])
+    return rollups
+
+#The heaviest single trip is rank 1 of the CO2 leaderboard (or one arg_max scan of the trips)
+def largest_trips(con, cache=None):
+    largest = ", ".join(f"{column} := {column}" for column in LARGEST_TRIP_COLUMNS)
+    if table_exists(con, LEADERBOARD_TABLE):
+        largest_sql = f"""
+            SELECT CAST(cab_type AS VARCHAR), struct_pack({largest})
+            FROM {LEADERBOARD_TABLE}
+            WHERE grain = 'all' AND metric = 'co2_emissions_kg' AND rank = 1;
+        """
+        tables = [LEADERBOARD_TABLE]
+    else:
+        largest_sql = f"""
+            SELECT CAST(cab_type AS VARCHAR), arg_max(struct_pack({largest}), co2_emissions_kg)
+            FROM {trips_relation()}
+            GROUP BY cab_type;
+        """
+        tables = ['all_data_transformed']
+    return dict(run_query(con, largest_sql, tables, cache).fetchall())
+
+# ------------------------------
+# Function: compute_rollups_sampled
+# Purpose: Quick-look version of compute_rollups. Trips are read through DuckDB's system
+# sample (fraction `rate` of 2048-row blocks, fixed `seed`). The scan skips unsampled
+# blocks, so a 1% sample reads about 1% of all_data_transformed. When co2_rollup_cube
+# exists, the breakdowns come exactly from the cube, which is cheaper than any sample, and
+# the sample only feeds the distribution stats the cube cannot give ('distribution').
+# Without the cube, counts and CO2 sums are scaled up by 1/rate (Horvitz-Thompson over
+# blocks), with 95% interval half-widths from the per-block sums y_b:
+#   total ~ sum / p,   half-width = 1.96 * sqrt((1 - p) * sum(y_b^2)) / p
+# Returns the compute_rollups structure (plus 'co2_tons_ci'/'trips_ci' arrays when sampled).
+# ------------------------------
+def compute_rollups_sampled(con, rate, seed=SAMPLE_SEED, cache=None):
+    if not 0 < rate <= 1:
+        raise ValueError(f"Sample rate must be in (0, 1], got {rate}")
+    sample = f"""
+        SELECT cab_type, {', '.join(DIMENSIONS)}, co2_emissions_kg, trip_distance, pickup_datetime,
+               {trip_block()} AS block
+        FROM {trips_relation(row_numbers=True)}
+        USING SAMPLE {rate * 100}% (system, {seed})
+    """
+
+    if table_exists(con, CUBE_TABLE):
+        rollups = compute_rollups(con, cache)
+    else:
+        logger.warning(f"{CUBE_TABLE} not found, estimating the breakdowns from the sample")
+        rollups = sampled_breakdowns(con, sample, rate, cache)
+        rollups['largest'] = largest_trips(con, cache)
+
+    #Approximate distribution stats per cab type: these need trip rows, not the cube's sums
+    result = run_query(con, f"""
+        SELECT
+            CAST(cab_type AS VARCHAR) AS cab_type,
+            COUNT(*) AS sampled,
+            approx_quantile(co2_emissions_kg, {SAMPLE_QUANTILES}) AS co2_quantiles,
+            approx_quantile(trip_distance, {SAMPLE_QUANTILES}) AS distance_quantiles,
+            approx_count_distinct(CAST(pickup_datetime AS DATE)) AS service_days
+        FROM ({sample})
+        GROUP BY cab_type
+        ORDER BY cab_type;
+    """, ['all_data_transformed'], cache).fetchnumpy()
+
+    rollups['distribution'] = {}
+    for i, cab in enumerate(result['cab_type']):
+        rollups['distribution'][cab] = {
+            'sampled': int(result['sampled'][i]),
+            'co2_quantiles': list(result['co2_quantiles'][i]),
+            'distance_quantiles': list(result['distance_quantiles'][i]),
+            'service_days': int(result['service_days'][i]),
+        }
+    rollups['sample_rate'] = rate
+    return rollups
+
+#Breakdowns estimated from the sampled blocks: sums per block first, then per bucket
+def sampled_breakdowns(con, sample, rate, cache=None):
+    grouping_sets = ", ".join(["(cab_type, block)"] + [f"(cab_type, {dim}, block)" for dim in DIMENSIONS])
+    dimension = " ".join(f"WHEN GROUPING({dim}) = 0 THEN '{dim}'" for dim in DIMENSIONS)
+
+    result = run_query(con, f"""
+        WITH blocks AS (
+            SELECT
+                CASE {dimension} ELSE 'total' END AS dimension,
+                cab_type,
+                COALESCE({', '.join(DIMENSIONS)}) AS bucket,
+                COUNT(*) AS sampled,
+                SUM(co2_emissions_kg) AS co2_sum
+            FROM ({sample})
+            GROUP BY GROUPING SETS ({grouping_sets})
+        ),
+        rollup AS (
+            SELECT
+                dimension,
+                cab_type,
+                bucket,
+                SUM(sampled) AS sampled,
+                SUM(co2_sum) AS co2_sum,
+                SUM(co2_sum * co2_sum) AS co2_squares,
+                SUM(sampled * sampled) AS trip_squares
+            FROM blocks
+            GROUP BY dimension, cab_type, bucket
+        )
+        SELECT
+            dimension,
+            CAST(cab_type AS VARCHAR) AS cab_type,
+            COALESCE(bucket, 0) AS bucket,
+            ROUND(co2_sum / {rate}, 2) AS total_co2_kg,
+            ROUND({Z_95} * sqrt((1 - {rate}) * co2_squares) / {rate}, 2) AS co2_kg_ci,
+            CAST(ROUND(sampled / {rate}) AS BIGINT) AS trips,
+            CAST(ROUND({Z_95} * sqrt((1 - {rate}) * trip_squares) / {rate}) AS BIGINT) AS trips_ci,
+            ROUND(co2_sum / sampled, 4) AS avg_co2_per_trip
+        FROM rollup
+        ORDER BY dimension, cab_type, bucket;
+    """, ['all_data_transformed'], cache).fetchnumpy()
+    return split_breakdowns(result)
+
+#Widest 95% interval of any CO2 figure in a sampled rollup, relative to its estimate
+#(0 when the breakdowns are exact, infinite when the sample drew no block at all)
+def relative_error(rollups):
+    if not any(len(breakdown['trips']) for breakdown in rollups['total'].values()):
+        return float('inf')
+    widest = 0.0
+    for dim in DIMENSIONS + ['total']:
+        for breakdown in rollups[dim].values():
+            if len(breakdown['co2_tons']) == 0 or 'co2_tons_ci' not in breakdown:
+                continue
+            estimate = np.maximum(breakdown['co2_tons'], 1e-9)
+            widest = max(widest, float(np.max(breakdown['co2_tons_ci'] / estimate)))
+    return widest
+
+#" ± <half-width>" after a sampled figure; exact figures get nothing
+def margin(breakdown, field, i, fmt):
+    if f"{field}_ci" not in breakdown:
+        return ""
+    return f" ± {breakdown[f'{field}_ci'][i]:{fmt}}"
+
+# ------------------------------
+# Function: top_trips
+# Purpose: Read the top-K trips by a metric ('co2_emissions_kg', 'trip_distance',
+# 'avg_mph' or 'total_amount') from trip_leaderboard, overall (grain='all') or per
+# pickup month (grain='month', year + bucket = month) or hour of day (grain='hour'),
+# for outlier review. Returns one NumPy array per column.
+# ------------------------------
+def top_trips(con, metric='co2_emissions_kg', cab=None, grain='all', bucket=None, k=None, year=None):
+    filters = ["metric = ?", "grain = ?"]
+    params = [metric, grain]
+    for column, value in (('cab_type', cab), ('pickup_year', year), ('bucket', bucket)):
+        if value is not None:
+            filters.append(f"{column} = ?")
+            params.append(value)
+    if k is not None:
+        filters.append("rank <= ?")
+        params.append(k)
+    return con.execute(f"""
+        SELECT * FROM {LEADERBOARD_TABLE}
+        WHERE {' AND '.join(filters)}
+        ORDER BY cab_type, pickup_year, bucket, rank;
+    """, params).fetchnumpy()
+
+# ------------------------------
+# Function: od_matrix
+# Purpose: Expand one cab type and pickup month of the sparse zone_od_hourly into a dense
+# (ZONES + 1) x (ZONES + 1) matrix of CO2 kg (or trips with value='trips') indexed by
+# [PULocationID, DOLocationID], optionally for one pickup hour; absent pairs are 0.
+# ------------------------------
+def od_matrix(con, cab, year, month, hour=None, value='co2_kg'):
+    if value not in ('co2_kg', 'trips'):
+        raise ValueError(f"Unknown od_matrix value {value!r}, expected 'co2_kg' or 'trips'")
+    filters = ["cab_type = ?", "pickup_year = ?", "month_of_year = ?"]
+    params = [cab, year, month]
+    if hour is not None:
+        filters.append("hour_of_day = ?")
+        params.append(hour)
+    cells = con.execute(f"""
+        SELECT PULocationID, DOLocationID, SUM(trips) AS trips, SUM(co2_sum) AS co2_kg
+        FROM {OD_TABLE}
+        WHERE {' AND '.join(filters)}
+        GROUP BY PULocationID, DOLocationID;
+    """, params).fetchnumpy()
+    pickup, dropoff = cells['PULocationID'].astype(int), cells['DOLocationID'].astype(int)
+    #IDs past ZONES (not in the lookup) widen the matrix rather than being dropped
+    size = max([ZONES] + [int(ids.max()) for ids in (pickup, dropoff) if len(ids)]) + 1
+    matrix = np.zeros((size, size))
+    matrix[pickup, dropoff] = cells[value]
+    return matrix
+
+# ------------------------------
+# Function: top_corridors
+# Purpose: Read the K pickup -> dropoff zone pairs with the most CO2 from zone_od_hourly,
+# optionally for one cab type, pickup hour (hour=18 for 6pm), year and month, with zone
+# names from taxi_zones when it is loaded. Returns one NumPy array per column.
+# A month is always within a year (month_of_year alone would add up every year's March).
+# ------------------------------
+def top_corridors(con, cab=None, hour=None, year=None, month=None, k=10):
+    if month is not None and year is None:
+        raise ValueError("top_corridors: month needs a year")
+    filters = ["PULocationID IS NOT NULL"]
+    params = []
+    for column, value in (('cab_type', cab), ('hour_of_day', hour), ('pickup_year', year), ('month_of_year', month)):
+        if value is not None:
+            filters.append(f"{column} = ?")
+            params.append(value)
+    names, joins = "", ""
+    if table_exists(con, 'taxi_zones'):
+        names = ", pickup.Zone AS pickup_zone, dropoff.Zone AS dropoff_zone"
+        joins = ("LEFT JOIN taxi_zones pickup ON pickup.LocationID = c.PULocationID "
+                 "LEFT JOIN taxi_zones dropoff ON dropoff.LocationID = c.DOLocationID")
+    return con.execute(f"""
+        WITH c AS (
+            SELECT PULocationID, DOLocationID, CAST(SUM(trips) AS BIGINT) AS trips, SUM(co2_sum) AS co2_kg
+            FROM {OD_TABLE}
+            WHERE {' AND '.join(filters)}
+            GROUP BY PULocationID, DOLocationID
+            ORDER BY co2_kg DESC
+            LIMIT {int(k)}
+        )
+        SELECT c.*{names}
+        FROM c {joins}
+        ORDER BY co2_kg DESC;
+    """, params).fetchnumpy()
+
+# ------------------------------
+# Function: export_query
+# Purpose: Stream a query result to CSV one Arrow record batch at a time, so large
+# breakdowns never become Python objects or one in-memory table
+# ------------------------------
+def export_query(con, sql, path, batch_rows=1_000_000):
+    reader = con.execute(sql).to_arrow_reader(batch_rows)
+    rows = 0
+    with pa_csv.CSVWriter(path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    logger.info(f"Exported {rows:,} rows to {path}")
+    return rows
+
+#Positions of the lowest and highest average CO2 per trip in a breakdown
+def extremes(breakdown):
+    return int(np.argmin(breakdown['avg_co2'])), int(np.argmax(breakdown['avg_co2']))
+
+# ------------------------------
+# Function: analyzing_cleandata
+# Purpose: Log the CO2 report. With `sample_rate` the trip distributions come from a
+# sample, and so do the breakdowns if co2_rollup_cube is not built (figures shown as
+# estimate ± 95% interval); if any interval is wider than MAX_RELATIVE_ERROR of its
+# estimate, the exact rollups are computed instead.
+# ------------------------------
+def analyzing_cleandata(con, cache=None, sample_rate=None):
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        logger.info("Connected to DuckDB")
+        rollups = None
+        if sample_rate:
+            logger.info(f"Computing sampled rollups ({sample_rate:.2%} of trip blocks, seed {SAMPLE_SEED})")
+            rollups = compute_rollups_sampled(con, sample_rate, SAMPLE_SEED, cache)
+            error = relative_error(rollups)
+            if error > MAX_RELATIVE_ERROR:
+                logger.warning(f"Sampled 95% interval reaches ±{error:.1%} (limit ±{MAX_RELATIVE_ERROR:.0%}), using exact rollups")
+                rollups = None
+            elif 'co2_tons_ci' not in rollups['total'][cab_types[0]]:
+                logger.info(f"Breakdowns are exact from {CUBE_TABLE}; the sample only feeds the distributions")
+            else:
+                logger.info(f"Sampled estimates within ±{error:.1%} at 95% confidence")
+        if rollups is None:
+            logger.info(f"Computing all rollups from {CUBE_TABLE}")
+            rollups = compute_rollups(con, cache)
 
         logger.info("1. SINGLE LARGEST CARBON TRIPS (Yellow & Green)")
         logger.info("-" * 30)
 
-        cab_types = ['yellow', 'green']
-
         for cab in cab_types:
-            largest_trip = con.execute(f"""
-                SELECT 
-                    cab_type,
-                    VendorID,
-                    pickup_datetime,
-                    dropoff_datetime,
-                    trip_distance,
-                    total_amount,
-                    co2_emissions_kg
-                FROM all_data_transformed
-                WHERE cab_type = '{cab}'
-                ORDER BY co2_emissions_kg DESC
-                LIMIT 1;
-            """).fetchdf()
+            largest = rollups['largest'].get(cab)
+            largest_trip = pd.DataFrame([largest] if largest else [], columns=LARGEST_TRIP_COLUMNS)
 
             logger.info(f"Largest {cab.upper()} trip:\n{largest_trip.to_string(index=False)}")
 
@@ -44,125 +415,98 @@ def analyzing_cleandata():
         for cab in cab_types:
             logger.info(f"--- {cab.upper()} Taxi ---")
 
-            hourly_analysis = con.execute(f"""
-                SELECT
-                hour_of_day + 1 AS hour_of_day,  -- Shift 0-23 to 1-24
-                ROUND(SUM(co2_emissions_kg), 2) AS total_co2_kg,
-                COUNT(*) AS trips,
-                ROUND(AVG(co2_emissions_kg), 4) AS avg_co2_per_trip
-                FROM all_data_transformed
-                WHERE cab_type = '{cab}'
-                GROUP BY hour_of_day
-                ORDER BY hour_of_day;
-            """).fetchall()
+            hourly_analysis = rollups['hour_of_day'][cab]
+            hours = hourly_analysis['bucket'] + 1  # Shift 0-23 to 1-24
 
     # Find lightest and heaviest average CO2 hours
-            min_hour = min(hourly_analysis, key=lambda x: x[3])
-            max_hour = max(hourly_analysis, key=lambda x: x[3])
+            min_hour, max_hour = extremes(hourly_analysis)
 
-            for hour, co2_kg, trips, avg_co2 in hourly_analysis:
-                co2_tons = co2_kg / 1000
+            for i, (hour, trips, co2_tons) in enumerate(zip(hours, hourly_analysis['trips'], hourly_analysis['co2_tons'])):
                 time_str = f"{hour:02d}:00"
-                logger.info(f"   {time_str}: {trips:>12,} trips, {co2_tons:>10,.1f} metric tons")
+                logger.info(f"   {time_str}: {trips:>12,}{margin(hourly_analysis, 'trips', i, ',')} trips, "
+                            f"{co2_tons:>10,.1f}{margin(hourly_analysis, 'co2_tons', i, ',.1f')} metric tons")
+
+            logger.info(f"Most carbon-heavy hour: {hours[max_hour]:02d}:00 with avg {hourly_analysis['avg_co2'][max_hour]:.4f} kg CO2")
+            logger.info(f"Least carbon-heavy hour: {hours[min_hour]:02d}:00 with avg {hourly_analysis['avg_co2'][min_hour]:.4f} kg CO2")
 
-            logger.info(f"Most carbon-heavy hour: {max_hour[0]:02d}:00 with avg {max_hour[3]:.4f} kg CO2")
-            logger.info(f"Least carbon-heavy hour: {min_hour[0]:02d}:00 with avg {min_hour[3]:.4f} kg CO2")
-    
         logger.info("3. WEEKLY CO2 PATTERNS (Sun-Sat by cab type)")
         logger.info("-" * 30)
 
-        days = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+        days = np.array(['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'])
 
         for cab in cab_types:
             logger.info(f"--- {cab.upper()} Taxi ---")
 
-            weekly_analysis = con.execute(f"""
-                SELECT
-                day_of_week,
-                ROUND(SUM(co2_emissions_kg), 2) AS total_co2_kg,
-                COUNT(*) AS trips,
-                ROUND(AVG(co2_emissions_kg), 4) AS avg_co2_per_trip
-                FROM all_data_transformed
-                WHERE cab_type = '{cab}'
-                GROUP BY day_of_week
-                ORDER BY day_of_week;
-            """).fetchall()
+            weekly_analysis = rollups['day_of_week'][cab]
+            day_names = days[weekly_analysis['bucket']]
 
     # Find lightest and heaviest average CO2 days
-            min_day = min(weekly_analysis, key=lambda x: x[3])
-            max_day = max(weekly_analysis, key=lambda x: x[3])
+            min_day, max_day = extremes(weekly_analysis)
 
-            for dow, co2_kg, trips, avg_co2 in weekly_analysis:
-                co2_tons = co2_kg / 1000
-                day_name = days[dow]
-                logger.info(f"   {day_name}: {trips:>12,} trips, {co2_tons:>10,.1f} metric tons")
+            for i, (day_name, trips, co2_tons) in enumerate(zip(day_names, weekly_analysis['trips'], weekly_analysis['co2_tons'])):
+                logger.info(f"   {day_name}: {trips:>12,}{margin(weekly_analysis, 'trips', i, ',')} trips, "
+                            f"{co2_tons:>10,.1f}{margin(weekly_analysis, 'co2_tons', i, ',.1f')} metric tons")
 
-            logger.info(f"Most carbon-heavy day: {days[max_day[0]]} with avg {max_day[3]:.4f} kg CO2")
-            logger.info(f"Least carbon-heavy day: {days[min_day[0]]} with avg {min_day[3]:.4f} kg CO2")
+            logger.info(f"Most carbon-heavy day: {day_names[max_day]} with avg {weekly_analysis['avg_co2'][max_day]:.4f} kg CO2")
+            logger.info(f"Least carbon-heavy day: {day_names[min_day]} with avg {weekly_analysis['avg_co2'][min_day]:.4f} kg CO2")
 
-            logger.info("4. WEEKLY CO2 PATTERNS (Weeks 1-52 by cab type)")
+        logger.info("4. WEEKLY CO2 PATTERNS (Weeks 1-52 by cab type)")
         logger.info("-" * 30)
 
         for cab in cab_types:
             logger.info(f"--- {cab.upper()} Taxi ---")
 
-            weekly_analysis = con.execute(f"""
-                SELECT
-                week_of_year,
-                ROUND(SUM(co2_emissions_kg), 2) AS total_co2_kg,
-                COUNT(*) AS trips,
-                ROUND(AVG(co2_emissions_kg), 4) AS avg_co2_per_trip
-                FROM all_data_transformed
-                WHERE cab_type = '{cab}'
-                GROUP BY week_of_year
-                ORDER BY week_of_year;
-            """).fetchall()
+            weekly_analysis = rollups['week_of_year'][cab]
+            weeks = weekly_analysis['bucket']
 
     # Find the lightest and heaviest average CO2 weeks
-            min_week = min(weekly_analysis, key=lambda x: x[3])
-            max_week = max(weekly_analysis, key=lambda x: x[3])
+            min_week, max_week = extremes(weekly_analysis)
 
-            for week, co2_kg, trips, avg_co2 in weekly_analysis:
-                co2_tons = co2_kg / 1000
-                logger.info(f"   Week {week:02d}: {trips:>12,} trips, {co2_tons:>10,.1f} metric tons")
+            for i, (week, trips, co2_tons) in enumerate(zip(weeks, weekly_analysis['trips'], weekly_analysis['co2_tons'])):
+                logger.info(f"   Week {week:02d}: {trips:>12,}{margin(weekly_analysis, 'trips', i, ',')} trips, "
+                            f"{co2_tons:>10,.1f}{margin(weekly_analysis, 'co2_tons', i, ',.1f')} metric tons")
 
-            logger.info(f"Most carbon-heavy week: Week {max_week[0]} with avg {max_week[3]:.4f} kg CO2")
-            logger.info(f"Least carbon-heavy week: Week {min_week[0]} with avg {min_week[3]:.4f} kg CO2")
+            logger.info(f"Most carbon-heavy week: Week {weeks[max_week]} with avg {weekly_analysis['avg_co2'][max_week]:.4f} kg CO2")
+            logger.info(f"Least carbon-heavy week: Week {weeks[min_week]} with avg {weekly_analysis['avg_co2'][min_week]:.4f} kg CO2")
 
         logger.info("5. MONTHLY CO2 PATTERNS (Jan-Dec by cab type)")
         logger.info("-" * 30)
 
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        months = np.array(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
 
         for cab in cab_types:
             logger.info(f"--- {cab.upper()} Taxi ---")
 
-            monthly_analysis = con.execute(f"""
-                SELECT
-                month_of_year,
-                ROUND(SUM(co2_emissions_kg), 2) AS total_co2_kg,
-                COUNT(*) AS trips,
-                ROUND(AVG(co2_emissions_kg), 4) AS avg_co2_per_trip
-                FROM all_data_transformed
-                WHERE cab_type = '{cab}'
-                GROUP BY month_of_year
-                ORDER BY month_of_year;
-            """).fetchall()
+            monthly_analysis = rollups['month_of_year'][cab]
+            month_names = months[monthly_analysis['bucket'] - 1]  # Convert 1-12 to Jan-Dec
 
     # Find the lightest and heaviest average CO2 months
-            min_month = min(monthly_analysis, key=lambda x: x[3])
-            max_month = max(monthly_analysis, key=lambda x: x[3])
+            min_month, max_month = extremes(monthly_analysis)
 
-            for month, co2_kg, trips, avg_co2 in monthly_analysis:
-                co2_tons = co2_kg / 1000
-                month_name = months[month - 1]  # Convert 1-12 to Jan-Dec
-                logger.info(f"   {month_name}: {trips:>12,} trips, {co2_tons:>10,.1f} metric tons")
+            for i, (month_name, trips, co2_tons) in enumerate(zip(month_names, monthly_analysis['trips'], monthly_analysis['co2_tons'])):
+                logger.info(f"   {month_name}: {trips:>12,}{margin(monthly_analysis, 'trips', i, ',')} trips, "
+                            f"{co2_tons:>10,.1f}{margin(monthly_analysis, 'co2_tons', i, ',.1f')} metric tons")
 
-            logger.info(f"Most carbon-heavy month: {months[max_month[0]-1]} with avg {max_month[3]:.4f} kg CO2")
-            logger.info(f"Least carbon-heavy month: {months[min_month[0]-1]} with avg {min_month[3]:.4f} kg CO2")
+            logger.info(f"Most carbon-heavy month: {month_names[max_month]} with avg {monthly_analysis['avg_co2'][max_month]:.4f} kg CO2")
+            logger.info(f"Least carbon-heavy month: {month_names[min_month]} with avg {monthly_analysis['avg_co2'][min_month]:.4f} kg CO2")
 
-        return con
+        if 'distribution' in rollups:
+            logger.info(f"6. TRIP DISTRIBUTIONS (approximate, {rollups['sample_rate']:.2%} sample)")
+            logger.info("-" * 30)
+
+            percentiles = "/".join(f"p{int(q * 100)}" for q in SAMPLE_QUANTILES)
+            for cab in cab_types:
+                stats = rollups['distribution'].get(cab)
+                if not stats:
+                    continue
+                co2 = ", ".join(f"{v:.4f}" for v in stats['co2_quantiles'])
+                distance = ", ".join(f"{v:.2f}" for v in stats['distance_quantiles'])
+                logger.info(f"--- {cab.upper()} Taxi --- {stats['sampled']:,} sampled trips over ~{stats['service_days']:,} days")
+                logger.info(f"   CO2 per trip {percentiles}: {co2} kg")
+                logger.info(f"   Distance {percentiles}: {distance} miles")
+
+        return rollups
 
     except Exception as e:
         error_msg = f"Analysis failed: {e}"
@@ -170,33 +514,21 @@ def analyzing_cleandata():
         logger.error(error_msg)
         return False
 
-def plot_monthly_co2(con):
+def plot_monthly_co2(con, rollups=None, cache=None):
     try:
-        cab_types = ['yellow', 'green']
         monthly_data = {}
 
-        # Fetch monthly CO2 totals for each cab type
+        #Monthly totals come from the same one-scan rollup as the report
+        if rollups is None:
+            rollups = compute_rollups(con, cache)
+
         for cab in cab_types:
-            monthly_analysis = con.execute(f"""
-                SELECT
-                    CAST(month_of_year AS INTEGER) AS month_num,
-                    SUM(co2_emissions_kg) AS total_co2_kg
-                FROM all_data_transformed
-                WHERE cab_type = '{cab}'
-                GROUP BY month_num
-                ORDER BY month_num;
-            """).fetchall()
-
-            if not monthly_analysis:
-                # Default to zero if no data found
-                monthly_data[cab] = [0]*12
-            else:
-                # Fill in CO2 totals per month (metric tons)
-                co2_by_month = [0]*12
-                for row in monthly_analysis:
-                    month_idx = row[0] - 1  # convert 1–12 to 0–11 index
-                    co2_by_month[month_idx] = row[1] / 1000  # kg → metric tons
-                monthly_data[cab] = co2_by_month
+            monthly_analysis = rollups['month_of_year'][cab]
+
+            # Fill in CO2 totals per month (metric tons); months without data stay zero
+            co2_by_month = np.zeros(12)
+            co2_by_month[monthly_analysis['bucket'] - 1] = monthly_analysis['co2_tons']  # 1–12 to 0–11 index
+            monthly_data[cab] = co2_by_month
 
         # Plotting
         plt.figure(figsize=(12, 6))
@@ -220,8 +552,32 @@ def plot_monthly_co2(con):
         logger.error(f"Monthly CO2 plotting failed: {e}")
         print(f"Error plotting monthly CO2: {e}")
 
+# ------------------------------
+# Function: run_analysis
+# Purpose: Report, plot and (with export_dir) export the rollup cube on an open connection.
+# Repeated runs on unchanged data are served from data/result_cache
+# ------------------------------
+def run_analysis(con, sample_rate=None, export_dir=None):
+    cache = ResultCache()
+    rollups = analyzing_cleandata(con, cache, sample_rate)
+    if rollups:
+        plot_monthly_co2(con, rollups, cache)
+    #Optional CSV export of the rollup cube for dashboards
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+        export_query(
+            con,
+            f"SELECT * REPLACE (CAST(cab_type AS VARCHAR) AS cab_type) FROM {CUBE_TABLE}",
+            os.path.join(export_dir, f"{CUBE_TABLE}.csv")
+        )
+    cache.log_stats()
+    return rollups
+
 # -----------------------------
 if __name__ == "__main__":
-    con = analyzing_cleandata()
-    if con:
-        plot_monthly_co2(con)
+    con = connect(stage='analysis')
+    logger.info("Connected to DuckDB")
+    #PIPELINE_SAMPLE_RATE=0.01 gives a quick look from a 1% sample
+    sample_rate = float(os.environ.get('PIPELINE_SAMPLE_RATE', 0)) or None
+    run_analysis(con, sample_rate, os.environ.get('PIPELINE_EXPORT_DIR'))
+    con.close()
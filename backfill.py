@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import os
+from datetime import date
+
+from cache import CACHE_DIR, CACHE_MAX_BYTES, ParquetCache
+from db_config import connect
+from fetch import fetch_all, is_permanent
+from load import BASE_URL, create_urls, load_taxi_zones, load_vehicle_emissions, parse_source, prepare_tables, replace_months
+from profiling import REPORT_DIR, RUN_ID
+
+#Logs go to load.log (backfill is a mode of the load stage)
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Resumable multi-year backfill of the raw trip tables
+# Months are loaded oldest first, each in its own transaction (replace_months), and the
+# outcome of every month is checkpointed in backfill_checkpoint right after it commits.
+# A rerun after a crash or a failed month skips the months already committed (checkpoint
+# or load_manifest) and retries the rest; nothing is dropped. Historical column names and
+# types are mapped onto the unified schema at scan time (see load.source_columns).
+#   python backfill.py --start 2015
+# ------------------------------
+
+#First year of green cab files is 2013; the default backfill covers 2015 to the present
+BACKFILL_START_YEAR = 2015
+
+CHECKPOINT_COLUMNS = """
+    cab_type VARCHAR,
+    source_month DATE,
+    status VARCHAR,
+    attempts INTEGER,
+    row_count BIGINT,
+    error VARCHAR,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (cab_type, source_month)
+"""
+
+
+#Record the outcome of one month ('loaded', 'missing' or 'failed')
+def checkpoint(con, cab, ym, status, row_count=None, error=None):
+    con.execute("""
+        INSERT INTO backfill_checkpoint VALUES (?, CAST(? AS DATE), ?, 1, ?, ?, current_timestamp)
+        ON CONFLICT (cab_type, source_month) DO UPDATE SET
+            status = excluded.status,
+            attempts = backfill_checkpoint.attempts + 1,
+            row_count = excluded.row_count,
+            error = excluded.error,
+            updated_at = excluded.updated_at;
+    """, [cab, f"{ym}-01", status, row_count, error])
+
+
+#Months already committed: loaded by an earlier backfill run or by load.py
+def committed_months(con):
+    rows = con.execute("""
+        SELECT cab_type, strftime(source_month, '%Y-%m') FROM backfill_checkpoint WHERE status = 'loaded'
+        UNION
+        SELECT cab_type, strftime(source_month, '%Y-%m') FROM load_manifest;
+    """).fetchall()
+    return set(rows)
+
+
+#Load one downloaded (or cached) month in its own transaction and checkpoint the outcome
+#A file that fails to load is dropped from the cache so the next run downloads it again
+def load_month(con, cache, cab, f):
+    try:
+        rows = replace_months(con, cab, [f])
+        checkpoint(con, cab, f['ym'], 'loaded', row_count=rows)
+        return rows
+    except Exception as e:
+        logger.warning(f"Backfill {cab} {f['ym']} failed: {e}")
+        checkpoint(con, cab, f['ym'], 'failed', error=str(e))
+        cache.forget(f['url'])
+        return 0
+
+
+# ------------------------------
+# Function: backfill_report
+# Purpose: Summarize the checkpoint for a year range: months loaded, and the months still
+# missing upstream or failed (with their last error). Written to reports/backfill_<run id>.json
+# ------------------------------
+def backfill_report(con, start_year, end_year):
+    rows = con.execute("""
+        SELECT cab_type, strftime(source_month, '%Y-%m'), status, attempts, row_count, error
+        FROM backfill_checkpoint
+        WHERE year(source_month) BETWEEN ? AND ?
+        ORDER BY cab_type, source_month;
+    """, [start_year, end_year]).fetchall()
+    report = {'run_id': RUN_ID, 'start_year': start_year, 'end_year': end_year, 'cabs': {}}
+    for cab, ym, status, attempts, row_count, error in rows:
+        cab_report = report['cabs'].setdefault(cab, {'loaded': 0, 'rows': 0, 'missing': [], 'failed': []})
+        if status == 'loaded':
+            cab_report['loaded'] += 1
+            cab_report['rows'] += row_count or 0
+        elif status == 'missing':
+            cab_report['missing'].append(ym)
+        else:
+            cab_report['failed'].append({'month': ym, 'attempts': attempts, 'error': error})
+
+    for cab, cab_report in report['cabs'].items():
+        logger.info(f"Backfill {cab}: {cab_report['loaded']} months loaded ({cab_report['rows']:,} rows)")
+        if cab_report['missing']:
+            logger.warning(f"Backfill {cab}: {len(cab_report['missing'])} months missing upstream: {', '.join(cab_report['missing'])}")
+        for failed in cab_report['failed']:
+            logger.warning(f"Backfill {cab} {failed['month']}: failed after {failed['attempts']} attempts: {failed['error']}")
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    report_path = os.path.join(REPORT_DIR, f"backfill_{RUN_ID}.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    logger.info(f"Backfill report written to {report_path}")
+    return report
+
+
+# ------------------------------
+# Function: backfill
+# Purpose: Load every month from start_year through end_year (default: this year) that is
+# not committed yet, one year of downloads at a time so the cache never holds the whole
+# history. Months not published yet are skipped; permanent HTTP errors are 'missing',
+# anything else 'failed' and retried on the next run. Returns the backfill report.
+# ------------------------------
+def backfill(start_year=BACKFILL_START_YEAR, end_year=None, base_url=BASE_URL, max_workers=4, per_host=4,
+             cache_dir=CACHE_DIR, cache_bytes=CACHE_MAX_BYTES):
+    #Same bound as clean.MAX_YEAR, so every loaded year survives the out_of_range_year rule
+    end_year = end_year or date.today().year
+    latest = f"{date.today():%Y-%m}"
+    con = connect(stage='backfill')
+    prepare_tables(con)
+    con.execute(f"CREATE TABLE IF NOT EXISTS backfill_checkpoint ({CHECKPOINT_COLUMNS});")
+    load_vehicle_emissions(con)
+    load_taxi_zones(con)
+    cache = ParquetCache(cache_dir, cache_bytes)
+
+    try:
+        for year in range(start_year, end_year + 1):
+            done = committed_months(con)
+            urls = create_urls(year, year, base_url)
+            pending = [url for url in urls['yellow'] + urls['green']
+                       if parse_source(url) not in done and parse_source(url)[1] < latest]
+            if not pending:
+                logger.info(f"Backfill {year}: already complete")
+                continue
+            logger.info(f"Backfill {year}: {len(pending)} months to load")
+
+            #Months still in the cache from an interrupted run need no download
+            to_fetch = []
+            for url in sorted(pending, key=lambda url: parse_source(url)[::-1]):
+                cab, ym = parse_source(url)
+                entry = cache.lookup(url)
+                if entry:
+                    load_month(con, cache, cab, {'url': url, 'ym': ym, 'file_size': entry['size'], 'etag': entry['etag'],
+                                                 'checksum': entry['checksum'], 'path': entry['path']})
+                else:
+                    to_fetch.append(url)
+
+            for url, result, error in fetch_all(to_fetch, cache.tmp_dir, max_workers, per_host):
+                cab, ym = parse_source(url)
+                if error:
+                    status = 'missing' if is_permanent(error) else 'failed'
+                    logger.warning(f"Backfill {cab} {ym}: {status} ({error})")
+                    checkpoint(con, cab, ym, status, error=str(error))
+                    continue
+                entry = cache.store(url, result[0], result[1])
+                cache.save()
+                load_month(con, cache, cab, {'url': url, 'ym': ym, 'file_size': entry['size'], 'etag': None,
+                                             'checksum': entry['checksum'], 'path': entry['path']})
+                #Loaded months can be evicted right away, so a long backfill never outgrows the budget
+                cache.enforce_budget()
+            cache.save()
+            cache.enforce_budget()
+            cache.save()
+
+        return backfill_report(con, start_year, end_year)
+    finally:
+        cache.log_stats()
+        con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable backfill of historical TLC trip data")
+    parser.add_argument('--start', type=int, default=BACKFILL_START_YEAR, help="first year to load")
+    parser.add_argument('--end', type=int, default=None, help="last year to load (default: this year)")
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    report = backfill(args.start, args.end, args.base_url, args.workers)
+    for cab, cab_report in report['cabs'].items():
+        print(f"{cab}: {cab_report['loaded']} months loaded, "
+              f"{len(cab_report['missing'])} missing, {len(cab_report['failed'])} failed")
@@ -0,0 +1,158 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import duckdb
+
+import synth
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='benchmark.log'
+)
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = "bench"
+REPORT_DIR = "reports"
+SCALES = [1_000_000, 10_000_000, 100_000_000]
+
+#Each stage runs as its own process from the scratch directory, exactly as it would by hand
+STAGES = {
+    'load': [sys.executable, '-c',
+             "import load; con = load.load_parquet_files(2024, 2024, base_url='{base_url}', full_refresh=True); con and con.close()"],
+    'clean': [sys.executable, os.path.join(REPO_DIR, 'clean.py')],
+    'transform': [sys.executable, os.path.join(REPO_DIR, 'transform.py')],
+    'analysis': [sys.executable, os.path.join(REPO_DIR, 'analysis.py')],
+}
+
+#Rows each stage works through, read back from the database once the stage is done
+STAGE_ROWS = {
+    'load': "SELECT (SELECT COUNT(*) FROM yellow_tripdata) + (SELECT COUNT(*) FROM green_tripdata)",
+    'clean': "SELECT SUM(row_count) FROM clean_stats WHERE rule = 'input_rows'",
+    'transform': "SELECT COUNT(*) FROM all_data_transformed",
+    'analysis': "SELECT COUNT(*) FROM all_data_transformed",
+}
+
+
+#Parse 1M / 10M / 250k style row counts
+def parse_scale(value):
+    units = {'k': 1_000, 'm': 1_000_000, 'b': 1_000_000_000}
+    value = value.strip().lower()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+#Scratch directory with the inputs the stages read relative to their working directory
+def prepare_workdir(workdir):
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(os.path.join(workdir, 'data'))
+    shutil.copy(os.path.join(REPO_DIR, 'data', 'vehicle_emissions.csv'), os.path.join(workdir, 'data'))
+    shutil.copytree(os.path.join(REPO_DIR, 'dbt'), os.path.join(workdir, 'dbt'),
+                    ignore=shutil.ignore_patterns('target', 'logs', 'dbt_packages'))
+
+# ------------------------------
+# Function: run_stage
+# Purpose: Run one stage as a child process and measure wall time and its own peak RSS
+# (os.wait4 returns the resource usage of exactly that child)
+# ------------------------------
+def run_stage(name, command, workdir, env):
+    start = time.perf_counter()
+    with open(os.path.join(workdir, f"{name}.out"), 'w') as out:
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=out, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    return {
+        'wall_seconds': round(wall, 3),
+        'exit_code': os.waitstatus_to_exitcode(status),
+        #ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+    }
+
+# ------------------------------
+# Function: benchmark_scale
+# Purpose: Generate a year of synthetic trips totalling `rows`, then run
+# load -> clean -> transform -> analysis on it and record rows/s, peak RSS and output size
+# ------------------------------
+def benchmark_scale(rows, seed=42, keep=False, **rates):
+    workdir = os.path.abspath(os.path.join(BENCH_DIR, f"rows_{rows}"))
+    prepare_workdir(workdir)
+    database = os.path.join(workdir, 'emissions.duckdb')
+
+    #24 files: yellow and green for every month of 2024
+    start = time.perf_counter()
+    synth_dir = os.path.join(workdir, 'synthetic')
+    synth.generate(2024, 2024, rows // 24, synth_dir, seed, **rates)
+    results = {'rows': rows, 'generate_seconds': round(time.perf_counter() - start, 3), 'stages': {}}
+    logger.info(f"Generated {rows:,} synthetic trips in {results['generate_seconds']}s")
+
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.pathsep.join(filter(None, [REPO_DIR, env.get('PYTHONPATH')])),
+        'PIPELINE_DB': database,
+        'PIPELINE_RUN_ID': f"bench_{rows}",
+        'MPLBACKEND': 'Agg',
+    })
+
+    for name, command in STAGES.items():
+        command = [part.format(base_url=f"file://{synth_dir}") for part in command]
+        stage = run_stage(name, command, workdir, env)
+        try:
+            con = duckdb.connect(database, read_only=True)
+            stage['rows'] = con.execute(STAGE_ROWS[name]).fetchone()[0]
+            con.close()
+        except duckdb.Error as e:
+            logger.error(f"{name} at {rows:,} rows left no output: {e}")
+            stage['rows'] = None
+        stage['rows_per_second'] = round(stage['rows'] / stage['wall_seconds']) if stage['rows'] else None
+        stage['output_mb'] = round(os.path.getsize(database) / 1024 ** 2, 1) if os.path.exists(database) else None
+        results['stages'][name] = stage
+        logger.info(f"{name} at {rows:,} rows: {stage}")
+
+        if stage['exit_code'] != 0 or not stage['rows']:
+            print(f"{name} failed at {rows:,} rows, see {os.path.join(workdir, name + '.out')}")
+            break
+
+    if not keep:
+        shutil.rmtree(synth_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(workdir, 'data', 'cache'), ignore_errors=True)
+    return results
+
+def print_results(all_results):
+    print(f"{'rows':>12} {'stage':<10} {'seconds':>9} {'rows/s':>12} {'peak RSS MB':>12} {'DB MB':>9}")
+    for results in all_results:
+        for name, stage in results['stages'].items():
+            print(
+                f"{results['rows']:>12,} {name:<10} {stage['wall_seconds']:>9,.1f} "
+                f"{stage['rows_per_second'] or 0:>12,} {stage['peak_rss_mb']:>12,.1f} {stage['output_mb'] or 0:>9,.1f}"
+            )
+
+def benchmark(scales=SCALES, seed=42, keep=False, **rates):
+    all_results = [benchmark_scale(rows, seed, keep, **rates) for rows in scales]
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    report_path = os.path.join(REPORT_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_path, 'w') as f:
+        json.dump(all_results, f, indent=1)
+    print_results(all_results)
+    print(f"Benchmark report written to {report_path}")
+    logger.info(f"Benchmark report written to {report_path}")
+    return all_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the whole pipeline on synthetic data at several scales")
+    parser.add_argument('--scales', nargs='+', default=['1M', '10M', '100M'], help="total trips per run, e.g. 1M 10M")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help="keep the generated parquet files")
+    for name, value in synth.DEFAULT_RATES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=value)
+    args = vars(parser.parse_args())
+    benchmark([parse_scale(s) for s in args.pop('scales')], args.pop('seed'), args.pop('keep'), **args)
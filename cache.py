@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "data/cache"
+#Default disk budget for cached parquet files (20 GB)
+CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+
+#sha256 of a local file, memory-mapped so large parquet files are not copied into Python
+def sha256_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+
+# ------------------------------
+# Class: ParquetCache
+# Purpose: Content-addressed on-disk cache of downloaded TLC parquet files
+# Files live under objects/<sha[:2]>/<sha>.parquet; index.json maps each source URL to its
+# checksum, size, ETag and last use. Entries are checked by size (or by checksum with
+# verify=True) before they are trusted, and the least recently used URLs are evicted
+# once the cache grows past max_bytes.
+# ------------------------------
+class ParquetCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, verify=False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.index_path = os.path.join(root, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def object_path(self, checksum):
+        return os.path.join(self.root, "objects", checksum[:2], f"{checksum}.parquet")
+
+    #Return the cache entry for url if its file is present and intact, otherwise None
+    def lookup(self, url):
+        entry = self.index.get(url)
+        if entry is None:
+            self.misses += 1
+            return None
+        path = self.object_path(entry['checksum'])
+        valid = os.path.exists(path) and os.path.getsize(path) == entry['size']
+        if valid and self.verify:
+            valid = sha256_file(path) == entry['checksum']
+        if not valid:
+            logger.warning(f"Cache entry for {url} failed its integrity check, refetching")
+            self.forget(url)
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['last_used'] = time.time()
+        return dict(entry, path=path)
+
+    #Move a freshly downloaded file into the cache under its content hash
+    def store(self, url, path, checksum, etag=None):
+        target = self.object_path(checksum)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.replace(path, target)
+        self.index[url] = {
+            'checksum': checksum,
+            'size': os.path.getsize(target),
+            'etag': etag,
+            'last_used': time.time(),
+        }
+        return dict(self.index[url], path=target)
+
+    #Drop a URL from the index, deleting its object unless another URL shares the same content
+    def forget(self, url):
+        entry = self.index.pop(url, None)
+        if entry is None:
+            return
+        if not any(e['checksum'] == entry['checksum'] for e in self.index.values()):
+            path = self.object_path(entry['checksum'])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def total_bytes(self):
+        return sum(size for size in {e['checksum']: e['size'] for e in self.index.values()}.values())
+
+    #Evict least recently used URLs until the cache fits in max_bytes
+    #URLs in `keep` (e.g. downloaded but not loaded yet) are never evicted
+    def enforce_budget(self, keep=()):
+        for url in sorted(self.index, key=lambda u: self.index[u]['last_used']):
+            if self.total_bytes() <= self.max_bytes:
+                break
+            if url in keep:
+                continue
+            self.forget(url)
+            self.evictions += 1
+            logger.info(f"Cache evicted {url}")
+
+    def save(self):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+    def log_stats(self):
+        logger.info(
+            f"Cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+            f"{self.total_bytes() / 1024 ** 2:,.1f} MB in {self.root}"
+        )
@@ -1,5 +1,10 @@
 import duckdb
 import logging
+from datetime import date
+
+import trip_store
+from data_profile import detect_drift, profile_table, totals
+from db_config import connect, unordered
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
@@ -7,222 +12,319 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def cleaning_trips():
+#Pickup years kept in the cleaned tables: up to the current year, the last one backfill.py loads
+MIN_YEAR = 2015
+MAX_YEAR = date.today().year
+
+#Trip columns compared when removing duplicates (source_month is provenance, not trip data)
+TRIP_COLUMNS = ['VendorID', 'pickup_datetime', 'dropoff_datetime', 'passenger_count', 'trip_distance', 'total_amount',
+                'PULocationID', 'DOLocationID']
+
+#Cleaning rules: name -> SQL condition that rejects a row
+#A NULL condition does not reject (matches the old DELETE ... WHERE behaviour)
+RULES = {
+    'zero_passengers': "passenger_count = 0",
+    'bad_distance': "trip_distance <= 0 OR trip_distance > 100",
+    'over_24_hours': "DATEDIFF('second', pickup_datetime, dropoff_datetime) > 86400",
+    'bad_timestamps': """pickup_datetime IS NULL
+        OR dropoff_datetime IS NULL
+        OR pickup_datetime >= dropoff_datetime
+        OR DATEDIFF('second', pickup_datetime, dropoff_datetime) <= 0""",
+    'negative_amount': "total_amount < 0",
+    'out_of_range_year': f"EXTRACT(YEAR FROM pickup_datetime) NOT BETWEEN {MIN_YEAR} AND {MAX_YEAR}",
+}
+
+#Columns of clean_stats: one row per cab type, source month and rule (plus input_rows,
+#duplicates and output_rows), so an incremental run replaces just the months it rewrote
+STATS_COLUMNS = """
+    cab_type VARCHAR,
+    source_month DATE,
+    rule VARCHAR,
+    row_count BIGINT,
+    cleaned_at TIMESTAMP
+"""
+
+#A row is kept when it breaks no rule; a NULL condition does not reject, as in the old
+#DELETE ... WHERE behaviour (FILTER (WHERE NULL) does not count a row either)
+def keep_condition():
+    return " AND ".join(f"NOT COALESCE({condition}, false)" for condition in RULES.values())
+
+#Fixed-width (UBIGINT) fingerprint of a trip's columns
+def fingerprint(alias=None):
+    prefix = f"{alias}." if alias else ""
+    return f"hash({', '.join(prefix + column for column in TRIP_COLUMNS)})"
+
+# ------------------------------
+# Function: month_counts
+# Purpose: Count every rule's rejections for the given source months of the raw table in
+# one aggregate (COUNT(*) FILTER per rule), reading only the columns the rules look at.
+# The clean table is then written straight from the raw table with keep_condition(), so
+# no month is copied to a temp table first. Returns {month: {'input_rows', 'passed', <rule>: n}}.
+# ------------------------------
+def month_counts(con, raw, months):
+    empty = {'input_rows': 0, 'passed': 0, **dict.fromkeys(RULES, 0)}
+    counts = {month: dict(empty) for month in months}
+    if not months:
+        return counts
+    rows = con.execute(f"""
+        SELECT source_month, COUNT(*), COUNT(*) FILTER (WHERE {keep_condition()}),
+               {', '.join(f"COUNT(*) FILTER (WHERE {condition})" for condition in RULES.values())}
+        FROM {raw}
+        WHERE source_month IN ({', '.join('?' for _ in months)})
+        GROUP BY source_month;
+    """, list(months)).fetchall()
+    for month, input_rows, passed, *rejected in rows:
+        counts[month] = {'input_rows': input_rows, 'passed': passed, **dict(zip(RULES, rejected))}
+    return counts
+
+#Per-month stats from the rule counts and the rows the month kept after dedup
+def month_stats(counts, output_rows):
+    stats = {'input_rows': counts['input_rows']}
+    stats.update({rule: counts[rule] for rule in RULES})
+    stats['duplicates'] = counts['passed'] - output_rows
+    stats['output_rows'] = output_rows
+    return stats
+
+#Source months present in a raw table (one DATE column read)
+def raw_months(con, raw):
+    return [month for (month,) in con.execute(f"SELECT DISTINCT source_month FROM {raw} ORDER BY 1;").fetchall()]
+
+# ------------------------------
+# Function: dedup_global
+# Purpose: Write the clean table with duplicates removed across the whole table: one
+# GROUP BY over the trip columns of the raw rows that pass every rule, each trip kept in
+# its earliest source month. Returns {month: stats}.
+# ------------------------------
+def dedup_global(con, raw, clean, months):
+    columns = ", ".join(TRIP_COLUMNS)
+    counts = month_counts(con, raw, months)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {clean} AS
+        SELECT {columns}, MIN(source_month) AS source_month
+        FROM {raw}
+        WHERE {keep_condition()}
+        GROUP BY {columns};
+    """)
+    output = dict(con.execute(f"SELECT source_month, COUNT(*) FROM {clean} GROUP BY source_month;").fetchall())
+    return {month: month_stats(counts[month], output.get(month, 0)) for month in months}
+
+# ------------------------------
+# Function: dedup_partitioned
+# Purpose: Write the clean table one source month at a time so the dedup hash tables only
+# ever hold one month of data. Within a month, rows are first grouped on their 8-byte
+# fingerprint alone; rows with a unique fingerprint are kept as-is, and only rows sharing
+# a fingerprint are compared on every column (so hash collisions are never merged).
+# With boundary_hours set, trips picked up within that many hours of a month edge are
+# then checked for copies in other months' files (TLC exports overlap at month edges).
+# replace=True rewrites only `months` in an existing clean table (incremental cleaning).
+# Returns ({month: stats} for `months`, {month: rows} the boundary pass removed from
+# months outside `months`).
+# ------------------------------
+def dedup_partitioned(con, raw, clean, months, boundary_hours=None, replace=False):
+    columns = ", ".join(TRIP_COLUMNS)
+    if replace:
+        con.execute(f"DELETE FROM {clean} WHERE source_month IN ({', '.join('?' for _ in months)});", list(months))
+    else:
+        con.execute(f"CREATE OR REPLACE TABLE {clean} AS SELECT {columns}, source_month FROM {raw} LIMIT 0;")
+
+    counts = month_counts(con, raw, months)
+    stats = {}
+    for month in months:
+        output_rows = con.execute(f"""
+            INSERT INTO {clean}
+            WITH part AS (
+                SELECT {columns}, source_month, {fingerprint()} AS row_fp
+                FROM {raw}
+                WHERE source_month = ? AND {keep_condition()}
+            ),
+            repeated AS (
+                SELECT row_fp FROM part GROUP BY row_fp HAVING COUNT(*) > 1
+            )
+            SELECT {columns}, source_month FROM part ANTI JOIN repeated USING (row_fp)
+            UNION ALL
+            SELECT {columns}, ANY_VALUE(source_month) FROM part SEMI JOIN repeated USING (row_fp)
+            GROUP BY {columns};
+        """, [month]).fetchone()[0]
+        stats[month] = month_stats(counts[month], output_rows)
+
+    other_months = {}
+    if boundary_hours:
+        #Duplicates share a pickup time, so both copies of a trip fall inside the same window
+        removed = con.execute(f"""
+            DELETE FROM {clean}
+            WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, row_number() OVER (
+                        PARTITION BY {fingerprint()}, {columns} ORDER BY source_month
+                    ) AS copy_number
+                    FROM {clean}
+                    WHERE pickup_datetime < date_trunc('month', pickup_datetime) + INTERVAL {int(boundary_hours)} HOUR
+                       OR pickup_datetime >= date_trunc('month', pickup_datetime) + INTERVAL 1 MONTH - INTERVAL {int(boundary_hours)} HOUR
+                )
+                WHERE copy_number > 1
+            )
+            RETURNING source_month;
+        """).fetchall()
+        for (month,) in removed:
+            if month in stats:
+                stats[month]['duplicates'] += 1
+                stats[month]['output_rows'] -= 1
+            else:
+                other_months[month] = other_months.get(month, 0) + 1
+    return stats, other_months
+
+#Create clean_stats, replacing one left by an older version (no source_month column)
+#Returns True when the table was (re)created empty, i.e. every month needs its stats
+def prepare_stats(con):
+    columns = [name for (name,) in con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'clean_stats';"
+    ).fetchall()]
+    if columns and 'source_month' in columns:
+        return False
+    con.execute("DROP TABLE IF EXISTS clean_stats;")
+    con.execute(f"CREATE TABLE clean_stats ({STATS_COLUMNS});")
+    return True
+
+#Replace the clean_stats rows of a cab type's months ({month: stats}); replace_all=True replaces every month
+def write_stats(con, cab, stats, replace_all=False):
+    if replace_all:
+        con.execute("DELETE FROM clean_stats WHERE cab_type = ?;", [cab])
+    elif stats:
+        con.execute(f"DELETE FROM clean_stats WHERE cab_type = ? AND source_month IN ({', '.join('?' for _ in stats)});",
+                    [cab] + list(stats))
+    con.executemany(
+        "INSERT INTO clean_stats VALUES (?, ?, ?, ?, current_timestamp);",
+        [[cab, month, rule, count] for month, month_stats in stats.items() for rule, count in month_stats.items()]
+    )
+
+#Whole-table stats of a cab type, summed over its months in clean_stats
+def table_stats(con, cab):
+    return {rule: int(count) for rule, count in con.execute(
+        "SELECT rule, SUM(row_count) FROM clean_stats WHERE cab_type = ? GROUP BY rule;", [cab]
+    ).fetchall()}
 
-    con = None
+# ------------------------------
+# Function: clean_cab
+# Purpose: Build {cab}_tripdata_clean from {cab}_tripdata and record per-month, per-rule
+# rejection counts in clean_stats (see month_counts), in one transaction. Counts are
+# independent, so a row broken in two ways is counted under both.
+# dedup='global' removes duplicates across the whole table in a single GROUP BY;
+# dedup='partition' works one source month at a time (see dedup_partitioned).
+# With `months` (partition dedup only) just those source months of an existing clean
+# table are rewritten and re-counted; the returned stats still cover the whole table.
+# ------------------------------
+def clean_cab(con, cab, dedup='global', boundary_hours=None, months=None):
+    raw, clean = f"{cab}_tripdata", f"{cab}_tripdata_clean"
+    incremental = months is not None and dedup == 'partition'
+    if not incremental:
+        months = raw_months(con, raw)
+
+    #The table swap (or month rewrite) and its stats commit together
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        #Filtering and dedup do not depend on row order
+        with unordered(con):
+            if dedup == 'partition':
+                stats, other_months = dedup_partitioned(con, raw, clean, months, boundary_hours, replace=incremental)
+            else:
+                stats, other_months = dedup_global(con, raw, clean, months), {}
+
+        write_stats(con, cab, stats, replace_all=not incremental)
+        #Boundary copies removed from months this run did not rewrite
+        for month, removed in other_months.items():
+            con.execute("""
+                UPDATE clean_stats
+                SET row_count = row_count + CASE rule WHEN 'duplicates' THEN ? ELSE -? END, cleaned_at = current_timestamp
+                WHERE cab_type = ? AND source_month = ? AND rule IN ('duplicates', 'output_rows');
+            """, [removed, removed, cab, month])
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+
+    #Verification: profile the clean table with the same rules (every count should be 0);
+    #an incremental run re-profiles only the months it rewrote
+    clean_totals = totals(profile_table(con, clean, rules=RULES, months=months if incremental else None))
+    detect_drift(con, clean)
+    stats = table_stats(con, cab)
+    stats['remaining'] = {rule: int(clean_totals.get((rule, 'violations'), 0)) for rule in RULES}
+    return stats
+
+# ------------------------------
+# Function: cleaning_trips
+# Purpose: Clean both cab types and log the rule and dedup counts. Runs on `con` when
+# one is given (the caller keeps it open), else on its own connection. `months` maps
+# cab type -> source months to rewrite (see clean_cab); cab types absent from it are left
+# untouched. Returns {cab: stats}, or None when there is nothing to clean.
+# ------------------------------
+def cleaning_trips(dedup='global', boundary_hours=None, con=None, months=None):
+
+    owns_connection = con is None
 
     try:
         # Connect to local DuckDB instance
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        if owns_connection:
+            con = connect(stage='clean')
 
         logger.info("Connected to DuckDB instance")
 
-        #Standardize Yellow columns
-        con.execute("""
-            #ALTER TABLE yellow_tripdata RENAME COLUMN pickup_datetime TO tpep_pickup_datetime;
-        #""")
-        con.execute("""
-            ALTER TABLE yellow_tripdata RENAME COLUMN dropoff_datetime TO tpep_dropoff_datetime;
-        """)
-        logger.info("Yellow columns standardized")
-
-        # Standardize Green columns
-        con.execute("""
-            ALTER TABLE green_tripdata RENAME COLUMN pickup_datetime TO lpep_pickup_datetime;
-        """)
-        con.execute("""
-            ALTER TABLE green_tripdata RENAME COLUMN dropoff_datetime TO lpep_dropoff_datetime;
-        """)
-        logger.info("Green columns standardized")
-
-        con.execute("DROP TABLE IF EXISTS yellow_tripdata_clean;")
-        con.execute("DROP TABLE IF EXISTS green_tripdata_clean;")
-        logger.info("Existing tables dropped.")
-
-        #Initial Data counts
-        try:
-            yellow_preclean = con.execute("SELECT COUNT(*) FROM yellow_tripdata").fetchone()[0]
-            logger.info(f" Yellow taxis: {yellow_preclean:,} trips")
-        except:
-            yellow_preclean = 0
-            logger.info(" Yellow taxis: No data found")
-            
-        try:
-            green_preclean = con.execute("SELECT COUNT(*) FROM green_tripdata").fetchone()[0] 
-            logger.info(f"   Green taxis:  {green_preclean:,} trips")
-        except:
-            green_preclean = 0
-            logger.info("   Green taxis: No data found")
-        
-        total_pc = yellow_preclean + green_preclean
+        #Stats from an older version cannot be updated per month, so every month is recleaned
+        if prepare_stats(con) and months is not None:
+            logger.info("clean_stats has no per-month rows yet, cleaning every month")
+            months = None
+
+        results = {}
+        for cab in ('yellow', 'green'):
+            if months is not None and cab not in months:
+                continue
+            try:
+                results[cab] = clean_cab(con, cab, dedup, boundary_hours, months.get(cab) if months else None)
+            except duckdb.CatalogException:
+                logger.info(f"{cab.capitalize()} taxis: No data found")
+
+        total_pc = sum(stats['input_rows'] for stats in results.values())
         logger.info(f"   Total before cleaning: {total_pc:,} trips")
-        
-        if total_pc== 0:
+
+        if total_pc == 0:
             logger.error("No data to clean! Run load.py first.")
             return None
-            
-        logger.info(f"Initial counts - Yellow: {yellow_preclean:,}, Green: {green_preclean:,}")
-
-
-        #Removing Duplicates
-        con.execute(f"""
-            CREATE TABLE yellow_tripdata_clean AS
-            SELECT DISTINCT * FROM yellow_tripdata;
-        """)
-        logger.info("Yellow duplicates removed")
-
-        #Removing Duplicates
-        con.execute(f"""
-            -- Create a new table with unique rows
-            CREATE TABLE green_tripdata_clean AS 
-            SELECT DISTINCT * FROM green_tripdata;
-        """)
-        logger.info("Green duplicates removed")
-
-        #Remove Trips with 0 Passengers
-        con.execute(f"""
-            -- Deleting passengers = 0
-            DELETE FROM yellow_tripdata_clean
-            WHERE passenger_count = 0;
-        """)
-        logger.info("Deleting yellow trips with 0 passengers")
-
-        #Remove Trips with 0 Passengers
-        con.execute(f"""
-            -- Deleting passengers = 0
-            DELETE FROM green_tripdata_clean
-            WHERE passenger_count = 0;
-        """)
-        logger.info("Deleting green trips with 0 passengers")
-
-        #Deleting Trips with No Length
-        con.execute(f"""
-            -- Deleting trips 0 miles in length
-            DELETE FROM yellow_tripdata_clean
-            WHERE trip_distance <= 0;
-        """)
-        logger.info("Deleting yellow trips 0 miles in length")
-
-        con.execute(f"""
-            -- Deleting trips 0 miles in length
-            DELETE FROM green_tripdata_clean
-            WHERE trip_distance <= 0;
-        """)
-        logger.info("Deleting green trips 0 miles in length")
-
-        #Deleting Trips with Long Lengths
-        con.execute(f"""
-            -- Deleting trips greater than 100 miles in length
-            DELETE FROM yellow_tripdata_clean
-            WHERE trip_distance > 100;
-        """)
-        logger.info("Deleting yellow trips greater than 100 miles in length")
-
-        con.execute(f"""
-            -- Deleting passengers = 0
-            DELETE FROM green_tripdata_clean
-            WHERE trip_distance > 100;
-        """)
-        logger.info("Deleting green trips greater than 100 miles in length")
-        
-        #Delete trips longer than 24 hours 
-        con.execute("""
-                DELETE FROM yellow_tripdata_clean
-                WHERE tpep_pickup_datetime IS NULL 
-                   OR tpep_dropoff_datetime IS NULL
-                   OR tpep_pickup_datetime >= tpep_dropoff_datetime
-                   OR DATEDIFF('second', tpep_pickup_datetime, tpep_dropoff_datetime) <= 0
-                   OR DATEDIFF('second', tpep_pickup_datetime, tpep_dropoff_datetime) > 86400
-                   OR EXTRACT(YEAR FROM tpep_pickup_datetime) NOT BETWEEN 2015 AND 2024
-                   OR total_amount < 0;
-            """)
-        logger.info("Performing remaining cleaning activities on yellow data.")
-        
-        con.execute("""
-                DELETE FROM green_tripdata_clean
-                WHERE lpep_pickup_datetime IS NULL 
-                   OR lpep_dropoff_datetime IS NULL
-                   OR lpep_pickup_datetime >= lpep_dropoff_datetime
-                   OR DATEDIFF('second', lpep_pickup_datetime, lpep_dropoff_datetime) <= 0
-                   OR DATEDIFF('second', lpep_pickup_datetime, lpep_dropoff_datetime) > 86400
-                   OR EXTRACT(YEAR FROM lpep_pickup_datetime) NOT BETWEEN 2015 AND 2024
-                   OR total_amount < 0;
-            """)
-        logger.info("Performing remaining cleaning activities on green data.")
-
-
-        #Zero Passenger Check
-        yellow_passenger = con.execute("SELECT COUNT(*) FROM yellow_tripdata_clean WHERE passenger_count = 0;").fetchone()[0]
-        green_passenger = con.execute("SELECT COUNT(*) FROM green_tripdata_clean WHERE passenger_count = 0;").fetchone()[0]
-        print(f"Yellow trips with 0 passengers: {yellow_passenger}")
-        print(f"Green trips with 0 passengers: {green_passenger}")
-        logger.info(f"Yellow trips with 0 passengers: {yellow_passenger}")
-        logger.info(f"Green trips with 0 passengers: {green_passenger}")
-
-        #Invalid Trip Length Check
-        yellow_bad_length = con.execute("SELECT COUNT(*) FROM yellow_tripdata_clean WHERE trip_distance <= 0 OR trip_distance > 100;").fetchone()[0]
-        green_bad_length = con.execute("SELECT COUNT(*) FROM green_tripdata_clean WHERE trip_distance <= 0 OR trip_distance > 100;").fetchone()[0]
-        print(f"Yellow trips with invalid distances: {yellow_bad_length}")
-        print(f"Green trips with invalid distances: {green_bad_length}")
-        logger.info(f"Yellow trips with invalid distances: {yellow_bad_length}")
-        logger.info(f"Green trips with invalid distances: {green_bad_length}")
-
-        #24 hr time Check
-        yellow_day = con.execute("""
-            SELECT COUNT(*) FROM yellow_tripdata_clean
-            WHERE DATEDIFF('second', tpep_pickup_datetime, tpep_dropoff_datetime) > 86400;
-        """).fetchone()[0]
-
-        green_day = con.execute("""
-            SELECT COUNT(*) FROM green_tripdata_clean
-            WHERE DATEDIFF('second', lpep_pickup_datetime, lpep_dropoff_datetime) > 86400;
-        """).fetchone()[0]
-        print(f"Yellow trips longer than 24 hr: {yellow_day}")
-        print(f"Green trips longer than 24 hr: {green_day}")
-        logger.info(f"Yellow trips longer than 24 hr: {yellow_day}")
-        logger.info(f"Green trips longer than 24 hr: {green_day}")
-
-        #Yellow Post Cleaning Numbers Summary
-        yellow_postclean = con.execute("SELECT COUNT(*) FROM yellow_tripdata_clean").fetchone()[0]
-        yellow_removed = yellow_preclean - yellow_postclean
-        yellow_pct = (yellow_removed / yellow_preclean * 100) if yellow_preclean > 0 else 0
-            
-        logger.info(f"Yellow taxi results: {yellow_postclean:,} trips remaining ({yellow_removed:,} removed)")
-            
-        #replace original table
-        logger.info("Step 4: Replacing original yellow data table with cleaned version")
-        con.execute("DROP TABLE yellow_tripdata; ALTER TABLE yellow_tripdata_clean RENAME TO yellow_tripdata;")
-            
-        logger.info("Yellow cleaning complete:")
-        logger.info(f"      Before: {yellow_preclean:,} trips")
-        logger.info(f"      After:  {yellow_postclean:,} trips") 
-        logger.info(f"      Removed: {yellow_removed:,} trips ({yellow_pct:.1f}%)")
-            
-        logger.info(f"Yellow cleaned: {yellow_preclean:,} → {yellow_postclean:,} (removed {yellow_removed:,}, {yellow_pct:.1f}%)")
-        print(f"Yellow cleaned: {yellow_preclean:,} → {yellow_postclean:,} (removed {yellow_removed:,}, {yellow_pct:.1f}%)")
-
-        #Green Post Cleaning Numbers Summary
-        green_postclean = con.execute("SELECT COUNT(*) FROM green_tripdata_clean").fetchone()[0]
-        green_removed = green_preclean - green_postclean
-        green_pct = (green_removed / green_preclean * 100) if green_preclean > 0 else 0
-            
-        logger.info(f"Green taxi results: {green_postclean:,} trips remaining ({green_removed:,} removed)")
-            
-        #replace original table
-        logger.info("Step 4: Replacing original green data table with cleaned version")
-        con.execute("DROP TABLE green_tripdata; ALTER TABLE green_tripdata_clean RENAME TO green_tripdata;")
-            
-        logger.info("Green cleaning complete:")
-        logger.info(f"      Before: {green_preclean:,} trips")
-        logger.info(f"      After:  {green_postclean:,} trips") 
-        logger.info(f"      Removed: {green_removed:,} trips ({green_pct:.1f}%)")
-            
-        logger.info(f"Green cleaned: {green_preclean:,} → {green_postclean:,} (removed {green_removed:,}, {green_pct:.1f}%)")
-        print(f"Green cleaned: {green_preclean:,} → {green_postclean:,} (removed {green_removed:,}, {green_pct:.1f}%)")
+
+        for cab, stats in results.items():
+            label = cab.capitalize()
+
+            #Removal counts come from the cleaning pass itself, verification from the clean table's profile
+            for rule in RULES:
+                print(f"{label} trips removed by {rule}: {stats[rule]:,}")
+                logger.info(f"{label} trips removed by {rule}: {stats[rule]:,}")
+                if stats['remaining'][rule]:
+                    logger.error(f"{label} clean table still has {stats['remaining'][rule]:,} trips failing {rule}")
+            logger.info(f"{label} duplicate trips removed: {stats['duplicates']:,}")
+
+            preclean, postclean = stats['input_rows'], stats['output_rows']
+            removed = preclean - postclean
+            pct = (removed / preclean * 100) if preclean > 0 else 0
+
+            logger.info(f"{label} cleaning complete:")
+            logger.info(f"      Before: {preclean:,} trips")
+            logger.info(f"      After:  {postclean:,} trips")
+            logger.info(f"      Removed: {removed:,} trips ({pct:.1f}%)")
+            print(f"{label} cleaned: {preclean:,} → {postclean:,} (removed {removed:,}, {pct:.1f}%)")
+
+        #Publish the cleaned trips to the Parquet store when one is configured
+        if trip_store.enabled():
+            for cab in results:
+                trip_store.export_clean(con, cab)
+            logger.info(f"Cleaned trips exported to trip store {trip_store.TRIP_STORE}")
+
+        return results
 
     except Exception as e:
         print(f"An error occurred: {e}")
         logger.error(f"An error occurred: {e}")
 
+    finally:
+        if con and owns_connection:
+            con.close()
+
 if __name__ == "__main__":
     cleaning_trips()
@@ -0,0 +1,167 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Single-pass data profiling for the trip tables
+# profile_table() computes, per source month and in ONE aggregate scan: null counts,
+# sums, min/max, approximate quantiles and fixed-bin histograms of the trip measures,
+# plus rule-violation counts. Results are stored long-format in data_profile
+# (table_name, month, column_name, metric, value), so month-over-month drift is a
+# window query over data_profile and never rescans the trips.
+# ------------------------------
+
+PROFILE_COLUMNS = """
+    table_name VARCHAR,
+    month DATE,
+    column_name VARCHAR,
+    metric VARCHAR,
+    value DOUBLE,
+    profiled_at TIMESTAMP
+"""
+
+#Columns whose NULLs are counted
+NULL_COLUMNS = ['VendorID', 'pickup_datetime', 'dropoff_datetime', 'passenger_count', 'trip_distance', 'total_amount',
+                'PULocationID', 'DOLocationID']
+
+#Numeric measures: name -> SQL expression
+MEASURES = {
+    'passenger_count': "passenger_count",
+    'trip_distance': "trip_distance",
+    'total_amount': "total_amount",
+    'duration_minutes': "DATE_DIFF('second', pickup_datetime, dropoff_datetime) / 60.0",
+}
+
+#Fixed-width histogram bins per measure: (bin width, number of bins)
+#Bin -1 holds values below zero and bin <number of bins> everything above the last bin
+HISTOGRAMS = {
+    'passenger_count': (1, 10),
+    'trip_distance': (1, 50),
+    'total_amount': (5, 40),
+    'duration_minutes': (5, 36),
+}
+
+QUANTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+
+#Metrics compared month over month by detect_drift (null and rule counts are compared as rates)
+DRIFT_METRICS = ['row_count', 'nulls', 'p50', 'p99', 'violations']
+
+
+#One aggregate expression per (column, metric); every one is evaluated in the same scan
+def profile_expressions(rules):
+    expressions = {('all', 'row_count'): "COUNT(*)"}
+    for column in NULL_COLUMNS:
+        expressions[(column, 'nulls')] = f"COUNT(*) - COUNT({column})"
+    for name, expr in MEASURES.items():
+        width, bins = HISTOGRAMS[name]
+        expressions[(name, 'sum')] = f"SUM({expr})"
+        expressions[(name, 'min')] = f"MIN({expr})"
+        expressions[(name, 'max')] = f"MAX({expr})"
+        expressions[(name, 'quantiles')] = f"approx_quantile({expr}, {QUANTILES})"
+        expressions[(name, 'histogram')] = f"histogram(LEAST(GREATEST(FLOOR({expr} / {width}), -1), {bins}))"
+    for rule, condition in (rules or {}).items():
+        expressions[(rule, 'violations')] = f"COUNT(*) FILTER (WHERE {condition})"
+    return expressions
+
+#Flatten one month's aggregates into (column, metric, value) rows
+def flatten(column, metric, value):
+    if value is None:
+        return [(column, metric, None)]
+    if metric == 'quantiles':
+        return [(column, f"p{int(q * 100):02d}", v) for q, v in zip(QUANTILES, value)]
+    if metric == 'histogram':
+        width = HISTOGRAMS[column][0]
+        return [(column, f"bin_{int(b) * width}", count) for b, count in sorted(value.items())]
+    return [(column, metric, float(value))]
+
+# ------------------------------
+# Function: profile_table
+# Purpose: Profile a trip table per source_month in one scan and replace its rows in
+# data_profile. `rules` maps rule name -> SQL condition that flags a bad row;
+# `months` restricts the scan (and the replacement) to those source months.
+# Returns {month: {(column, metric): value}}.
+# ------------------------------
+def profile_table(con, table, rules=None, months=None):
+    expressions = profile_expressions(rules)
+    where = ""
+    params = []
+    if months:
+        where = f"WHERE source_month IN ({', '.join('?' for _ in months)})"
+        params = list(months)
+
+    result = con.execute(f"""
+        SELECT source_month, {', '.join(expressions.values())}
+        FROM {table}
+        {where}
+        GROUP BY source_month
+        ORDER BY source_month;
+    """, params).fetchall()
+
+    profile = {}
+    rows = []
+    for record in result:
+        month, values = record[0], record[1:]
+        profile[month] = {}
+        for (column, metric), value in zip(expressions, values):
+            for column_name, metric_name, flat_value in flatten(column, metric, value):
+                profile[month][(column_name, metric_name)] = flat_value
+                rows.append((month, column_name, metric_name, flat_value))
+
+    con.execute(f"CREATE TABLE IF NOT EXISTS data_profile ({PROFILE_COLUMNS});")
+    if months:
+        con.execute(f"DELETE FROM data_profile WHERE table_name = ? AND month IN ({', '.join('?' for _ in months)});",
+                    [table] + list(months))
+    else:
+        con.execute("DELETE FROM data_profile WHERE table_name = ?;", [table])
+    if rows:
+        #One INSERT of unnested lists instead of a round trip per profile value
+        month_list, column_list, metric_list, value_list = (list(column) for column in zip(*rows))
+        con.execute("""
+            INSERT INTO data_profile
+            SELECT ?, UNNEST(?::DATE[]), UNNEST(?::VARCHAR[]), UNNEST(?::VARCHAR[]), UNNEST(?::DOUBLE[]), current_timestamp;
+        """, [table, month_list, column_list, metric_list, value_list])
+    logger.info(f"Profiled {table}: {len(profile)} months, {len(rows):,} profile values")
+    return profile
+
+#Add up the additive metrics (counts and sums) of a profile over all its months
+def totals(profile):
+    summed = {}
+    for values in profile.values():
+        for key, value in values.items():
+            if key[1] in ('row_count', 'nulls', 'sum', 'violations') and value is not None:
+                summed[key] = summed.get(key, 0) + value
+    return summed
+
+# ------------------------------
+# Function: detect_drift
+# Purpose: Flag month-over-month changes larger than `threshold` (relative) in row counts,
+# null and violation rates and median/p99 measures, using only data_profile
+# ------------------------------
+def detect_drift(con, table, threshold=0.5):
+    metric_list = ", ".join(f"'{metric}'" for metric in DRIFT_METRICS)
+    drift = con.execute(f"""
+        WITH base AS (
+            SELECT p.month, p.column_name, p.metric,
+                   CASE WHEN p.metric IN ('nulls', 'violations') THEN p.value / NULLIF(n.value, 0)
+                        ELSE p.value END AS value
+            FROM data_profile p
+            JOIN data_profile n
+              ON n.table_name = p.table_name AND n.month = p.month AND n.metric = 'row_count'
+            WHERE p.table_name = ? AND p.metric IN ({metric_list})
+        ),
+        changes AS (
+            SELECT month, column_name, metric, value,
+                   lag(value) OVER (PARTITION BY column_name, metric ORDER BY month) AS previous
+            FROM base
+        )
+        SELECT month, column_name, metric, previous, value
+        FROM changes
+        WHERE previous IS NOT NULL
+          AND abs(value - previous) > ? * GREATEST(abs(previous), 1e-9)
+          AND NOT (metric IN ('nulls', 'violations') AND abs(value - previous) < 0.001)
+        ORDER BY month, column_name, metric;
+    """, [table, threshold]).fetchall()
+
+    for month, column, metric, previous, value in drift:
+        logger.warning(f"Drift in {table} {month:%Y-%m}: {column} {metric} {previous:.4g} -> {value:.4g}")
+    return drift
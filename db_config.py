@@ -0,0 +1,99 @@
+import contextlib
+import logging
+import os
+import shlex
+
+import duckdb
+
+from profiling import ProfiledConnection
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Shared DuckDB execution profile for load.py, clean.py, analysis.py and dbt
+# Every value can be overridden with an environment variable, e.g. on a 16 GB box:
+#   PIPELINE_MEMORY_LIMIT=10GB PIPELINE_THREADS=4 python load.py
+# dbt/profiles.yml reads the same variables (transform.py exports them before running dbt;
+# for a bare dbt command, eval "$(python db_config.py)" exports them in the shell)
+# ------------------------------
+
+DATABASE = os.environ.get('PIPELINE_DB', 'emissions.duckdb')
+
+#Default to 75% of physical memory, leaving room for Python, the OS page cache and dbt
+def default_memory_limit():
+    try:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        return f"{int(total * 0.75 / 1024 ** 2)}MiB"
+    except (ValueError, OSError, AttributeError):
+        return '8GB'
+
+MEMORY_LIMIT = os.environ.get('PIPELINE_MEMORY_LIMIT') or default_memory_limit()
+#Where DuckDB spills hash tables and sorts that do not fit in MEMORY_LIMIT
+TEMP_DIRECTORY = os.environ.get('PIPELINE_TEMP_DIR', 'duckdb_tmp')
+THREADS = int(os.environ.get('PIPELINE_THREADS') or os.cpu_count() or 4)
+PRESERVE_INSERTION_ORDER = os.environ.get('PIPELINE_PRESERVE_ORDER', 'true').lower() == 'true'
+#Optional Parquet trip store directory (see trip_store.py); unset keeps trips in DuckDB only
+TRIP_STORE = os.environ.get('PIPELINE_TRIP_STORE') or None
+
+
+def settings():
+    return {
+        'memory_limit': MEMORY_LIMIT,
+        'temp_directory': TEMP_DIRECTORY,
+        'threads': THREADS,
+        'preserve_insertion_order': PRESERVE_INSERTION_ORDER,
+    }
+
+
+#Environment for a dbt subprocess so dbt/profiles.yml uses the same profile
+def dbt_env():
+    env = dict(os.environ)
+    env.update({
+        'PIPELINE_DB_PATH': os.path.abspath(DATABASE),
+        'PIPELINE_DB_NAME': os.path.splitext(os.path.basename(DATABASE))[0],
+        'PIPELINE_MEMORY_LIMIT': MEMORY_LIMIT,
+        'PIPELINE_TEMP_DIR': os.path.abspath(TEMP_DIRECTORY),
+        'PIPELINE_THREADS': str(THREADS),
+    })
+    if TRIP_STORE:
+        env['PIPELINE_TRIP_STORE'] = os.path.abspath(TRIP_STORE)
+    return env
+
+
+# ------------------------------
+# Function: connect
+# Purpose: Open the pipeline database with the shared execution profile applied
+# With a stage name every query is timed and profiled (see profiling.py) and the
+# run report is written when the connection is closed
+# ------------------------------
+def connect(read_only=False, database=None, stage=None):
+    os.makedirs(TEMP_DIRECTORY, exist_ok=True)
+    con = duckdb.connect(database=database or DATABASE, read_only=read_only, config=settings())
+    logger.info(
+        f"DuckDB profile: memory_limit={MEMORY_LIMIT}, threads={THREADS}, "
+        f"temp_directory={TEMP_DIRECTORY}, preserve_insertion_order={PRESERVE_INSERTION_ORDER}"
+    )
+    return ProfiledConnection(con, stage) if stage else con
+
+
+# ------------------------------
+# Function: unordered
+# Purpose: Turn off insertion-order preservation for an order-insensitive stage
+# (dedup, filtering, unions), then restore the previous setting.
+# Without the guarantee DuckDB can stream results out of order and buffer far less.
+# ------------------------------
+@contextlib.contextmanager
+def unordered(con):
+    previous = con.execute("SELECT current_setting('preserve_insertion_order');").fetchone()[0]
+    con.execute("SET preserve_insertion_order = false;")
+    try:
+        yield con
+    finally:
+        con.execute(f"SET preserve_insertion_order = {str(previous).lower()};")
+
+
+if __name__ == "__main__":
+    #Shell exports of the dbt profile variables, for running dbt without transform.py
+    for name, value in dbt_env().items():
+        if name.startswith('PIPELINE_'):
+            print(f"export {name}={shlex.quote(value)}")
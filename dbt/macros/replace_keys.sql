@@ -0,0 +1,19 @@
+-- incremental_strategy='replace_keys': delete+insert for a composite unique_key such as
+-- ['cab_type', 'source_month']. dbt-duckdb's delete+insert joins the target to every new
+-- row on each key column (DELETE ... USING), which is quadratic in the rows per month;
+-- this deletes the rows whose key tuple is IN the few DISTINCT keys of the new batch.
+{% macro get_incremental_replace_keys_sql(arg_dict) %}
+  {%- set unique_key = arg_dict['unique_key'] -%}
+  {%- set keys = [unique_key] if unique_key is string else unique_key -%}
+  {%- set dest_cols_csv = get_quoted_csv(arg_dict['dest_columns'] | map(attribute='name')) -%}
+
+  delete from {{ arg_dict['target_relation'] }}
+  where ({{ keys | join(', ') }}) in (
+      select distinct {{ keys | join(', ') }}
+      from {{ arg_dict['temp_relation'] }}
+  );
+
+  insert into {{ arg_dict['target_relation'] }} ({{ dest_cols_csv }})
+  select {{ dest_cols_csv }}
+  from {{ arg_dict['temp_relation'] }}
+{% endmacro %}
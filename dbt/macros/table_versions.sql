@@ -0,0 +1,6 @@
+-- Stamp a model with this dbt invocation in table_versions whenever it is (re)built, so
+-- readers such as the analysis result cache can tell a table changed without scanning it
+-- (see result_cache.py; shards.py stamps the tables its merge rewrites the same way)
+{% macro record_table_version() %}
+  INSERT OR REPLACE INTO table_versions VALUES ('{{ this.identifier }}', '{{ invocation_id }}', current_timestamp)
+{% endmacro %}
@@ -0,0 +1,10 @@
+-- Cleaned trips for one cab type: read in place from the Parquet trip store when
+-- PIPELINE_TRIP_STORE is set (see trip_store.py), otherwise the *_tripdata_clean table
+{% macro clean_trips(cab) %}
+  {%- set store = env_var('PIPELINE_TRIP_STORE', '') -%}
+  {%- if store -%}
+    read_parquet('{{ store }}/clean/cab_type={{ cab }}/**/*.parquet', hive_partitioning = true, hive_types = {'year': INTEGER, 'month': INTEGER})
+  {%- else -%}
+    {{ source('raw_data', cab ~ '_tripdata_clean') }}
+  {%- endif -%}
+{% endmacro %}
@@ -1,4 +1,9 @@
-{{ config(materialized='table') }} -- Materialize this model as a table (not a view) for efficiency in downstream queries
+{{ config(
+    materialized='incremental',
+    incremental_strategy='replace_keys',
+    unique_key=['cab_type', 'source_month'],
+    on_schema_change='append_new_columns'
+) }} -- Materialize this model as a table, replacing only the source months the staging models just rebuilt
 
 SELECT -- Select relevant, cleaned, and engineered columns
     cab_type,
@@ -8,6 +13,8 @@ SELECT -- Select relevant, cleaned, and engineered columns
     passenger_count,
     trip_distance,
     total_amount,
+    PULocationID,
+    DOLocationID,
     pickup_year,
     hour_of_day,        
     day_of_week,      
@@ -15,9 +22,15 @@ SELECT -- Select relevant, cleaned, and engineered columns
     month_of_year,     
     trip_duration_minutes,
     avg_mph,      
-    co2_emissions_kg  
+    co2_emissions_kg,
+    factor_version,
+    source_month,
+    transformed_at
 
 FROM {{ ref('yellow_data') }} -- reference the cleaned yellow taxi dataset
+{% if is_incremental() %}
+WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), TIMESTAMP '1970-01-01') FROM {{ this }})
+{% endif %}
 
 -- Combine the yellow taxi data with the green taxi data
 UNION ALL
@@ -30,6 +43,8 @@ SELECT -- Select relevant, cleaned, and engineered columns
     passenger_count,
     trip_distance,
     total_amount,
+    PULocationID,
+    DOLocationID,
     pickup_year,
     hour_of_day,        
     day_of_week,      
@@ -37,6 +52,12 @@ SELECT -- Select relevant, cleaned, and engineered columns
     month_of_year,     
     trip_duration_minutes,
     avg_mph,      
-    co2_emissions_kg
+    co2_emissions_kg,
+    factor_version,
+    source_month,
+    transformed_at
 
-FROM {{ ref('green_data') }} -- reference the cleaned green taxi dataset
\ No newline at end of file
+FROM {{ ref('green_data') }} -- reference the cleaned green taxi dataset
+{% if is_incremental() %}
+WHERE transformed_at > (SELECT COALESCE(MAX(transformed_at), TIMESTAMP '1970-01-01') FROM {{ this }})
+{% endif %}
\ No newline at end of file
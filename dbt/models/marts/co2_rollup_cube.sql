@@ -0,0 +1,50 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='replace_keys',
+    unique_key=['cab_type', 'pickup_year', 'month_of_year']
+) }} -- Pre-aggregated CO2 cube, rebuilt one pickup month at a time
+
+-- One row per cab type and pickup hour slot (year, month, week, day of week, hour).
+-- Sums, counts and sums of squares are additive, so any coarser rollup is exact:
+--   mean     = sum / trips
+--   variance = (sum_sq - sum * sum / trips) / (trips - 1)
+
+WITH trips AS (
+    SELECT *
+    FROM {{ ref('all_data_transformed') }}
+
+{% if is_incremental() %}
+    -- Only the pickup months holding trips transformed since the last build
+    WHERE (cab_type, pickup_year, month_of_year) IN (
+        SELECT DISTINCT cab_type, pickup_year, month_of_year
+        FROM {{ ref('all_data_transformed') }}
+        WHERE transformed_at > (SELECT COALESCE(MAX(refreshed_at), TIMESTAMP '1970-01-01') FROM {{ this }})
+    )
+{% endif %}
+)
+
+SELECT
+    cab_type,
+    pickup_year,
+    month_of_year,
+    week_of_year,
+    day_of_week,
+    hour_of_day,
+    COUNT(*) AS trips,
+
+    -- === CO2 (kg) ===
+    SUM(co2_emissions_kg) AS co2_sum,
+    SUM(co2_emissions_kg * co2_emissions_kg) AS co2_sum_sq,
+
+    -- === Distance (miles) ===
+    SUM(trip_distance) AS distance_sum,
+    SUM(trip_distance * trip_distance) AS distance_sum_sq,
+
+    -- === Speed (mph) ===
+    SUM(avg_mph) AS mph_sum,
+    SUM(avg_mph * avg_mph) AS mph_sum_sq,
+
+    CAST(current_timestamp AS TIMESTAMP) AS refreshed_at
+
+FROM trips
+GROUP BY cab_type, pickup_year, month_of_year, week_of_year, day_of_week, hour_of_day
@@ -0,0 +1,64 @@
+{{ config(materialized='table') }} -- Small table: K trips per cab type, time bucket and metric
+
+-- Top-K extreme trips by CO2, distance, speed and fare, per cab type overall ('all'),
+-- per pickup month (pickup_year + bucket = month_of_year, as in co2_rollup_cube) and per
+-- pickup hour of day (pickup_year is NULL for the 'all' and 'hour' grains). One scan of
+-- all_data_transformed: every grouping set keeps a bounded heap per metric (max_by with N)
+-- instead of sorting trips.
+-- K is the dbt var leaderboard_k (dbt run --vars '{leaderboard_k: 25}').
+
+{% set k = var('leaderboard_k', 10) %}
+{% set metrics = ['co2_emissions_kg', 'trip_distance', 'avg_mph', 'total_amount'] %}
+
+WITH trips AS (
+    SELECT
+        cab_type,
+        pickup_year,
+        month_of_year,
+        hour_of_day,
+        co2_emissions_kg,
+        trip_distance,
+        avg_mph,
+        total_amount,
+        struct_pack(
+            VendorID := VendorID,
+            pickup_datetime := pickup_datetime,
+            dropoff_datetime := dropoff_datetime,
+            trip_distance := trip_distance,
+            total_amount := total_amount,
+            avg_mph := avg_mph,
+            co2_emissions_kg := co2_emissions_kg
+        ) AS trip
+    FROM {{ ref('all_data_transformed') }}
+),
+
+heaps AS (
+    SELECT
+        cab_type,
+        CASE
+            WHEN GROUPING(month_of_year) = 0 THEN 'month'
+            WHEN GROUPING(hour_of_day) = 0 THEN 'hour'
+            ELSE 'all'
+        END AS grain,
+        pickup_year,
+        COALESCE(month_of_year, hour_of_day) AS bucket,
+        {% for metric in metrics %}
+        max_by(trip, {{ metric }}, {{ k }}) AS top_{{ metric }}{{ ',' if not loop.last }}
+        {% endfor %}
+    FROM trips
+    GROUP BY GROUPING SETS ((cab_type), (cab_type, pickup_year, month_of_year), (cab_type, hour_of_day))
+)
+
+-- === One row per trip on a leaderboard, ranked 1..K within (cab_type, grain, pickup_year, bucket, metric) ===
+{% for metric in metrics %}
+SELECT
+    cab_type,
+    grain,
+    pickup_year,
+    bucket,
+    '{{ metric }}' AS metric,
+    CAST(current_timestamp AS TIMESTAMP) AS built_at,
+    UNNEST(list_transform(top_{{ metric }}, (trip, position) -> struct_insert(trip, rank := position)), recursive := true)
+FROM heaps
+{{ 'UNION ALL' if not loop.last }}
+{% endfor %}
@@ -0,0 +1,52 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='replace_keys',
+    unique_key=['cab_type', 'pickup_year', 'month_of_year']
+) }} -- Zone-to-zone CO2 matrix, rebuilt one pickup month at a time
+
+-- One row per cab type, pickup month, pickup hour and (pickup zone, dropoff zone) pair that
+-- had trips. The matrix is stored sparse, not as the dense 265 x 265 x 24 grid per month:
+-- most cells of the grid are empty, and a missing row means zero trips and zero CO2
+-- (analysis.od_matrix expands one month back to a dense array when a caller needs the grid).
+-- Zone IDs stay 2-byte codes (names are in taxi_zones), and each month is written
+-- sorted by hour and zone pair, so "top corridors at 18:00" reads a narrow slice of the table.
+-- Sums are additive like co2_rollup_cube: any coarser rollup (all hours, a whole year) is exact.
+-- Trips without zone IDs (files before mid-2016) are left out.
+
+WITH trips AS (
+    SELECT *
+    FROM {{ ref('all_data_transformed') }}
+    WHERE PULocationID IS NOT NULL
+      AND DOLocationID IS NOT NULL
+
+{% if is_incremental() %}
+    -- Only the pickup months holding trips transformed since the last build
+      AND (cab_type, pickup_year, month_of_year) IN (
+        SELECT DISTINCT cab_type, pickup_year, month_of_year
+        FROM {{ ref('all_data_transformed') }}
+        WHERE transformed_at > (SELECT COALESCE(MAX(refreshed_at), TIMESTAMP '1970-01-01') FROM {{ this }})
+    )
+{% endif %}
+)
+
+SELECT
+    cab_type,
+    pickup_year,
+    month_of_year,
+    hour_of_day,
+    PULocationID,
+    DOLocationID,
+    COUNT(*) AS trips,
+
+    -- === CO2 (kg) ===
+    SUM(co2_emissions_kg) AS co2_sum,
+    SUM(co2_emissions_kg * co2_emissions_kg) AS co2_sum_sq,
+
+    -- === Distance (miles) ===
+    SUM(trip_distance) AS distance_sum,
+
+    CAST(current_timestamp AS TIMESTAMP) AS refreshed_at
+
+FROM trips
+GROUP BY cab_type, pickup_year, month_of_year, hour_of_day, PULocationID, DOLocationID
+ORDER BY cab_type, pickup_year, month_of_year, hour_of_day, PULocationID, DOLocationID
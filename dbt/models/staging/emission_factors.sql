@@ -0,0 +1,16 @@
+{{ config(materialized='table') }} -- Small versioned dimension, rebuilt on every run
+
+-- Emission factors per cab type with effective-date ranges [valid_from, valid_to)
+-- A factor change is a new row in data/vehicle_emissions.csv with a later valid_from;
+-- trips pick their factor up with an ASOF join on pickup time (see yellow_data/green_data)
+SELECT
+    CAST(replace(vehicle_type, '_taxi', '') AS cab_type_enum) as cab_type,
+    co2_grams_per_mile / 1000.0 as co2_kg_per_mile,
+    CAST(valid_from AS TIMESTAMP) as valid_from,
+    CAST(lead(valid_from) OVER (PARTITION BY vehicle_type ORDER BY valid_from) AS TIMESTAMP) as valid_to,
+
+    -- Identifies one factor version; trips store it so a changed factor can be found later
+    md5(concat_ws('|', vehicle_type, valid_from, co2_grams_per_mile)) as factor_version
+
+FROM {{ source('raw_data', 'vehicle_emissions') }}
+WHERE vehicle_type IN ('yellow_taxi', 'green_taxi')
@@ -1,22 +1,25 @@
 -- Transform and clean Green Taxi trip data
 SELECT 
-    'green' as cab_type,
+    CAST('green' AS cab_type_enum) as cab_type,  -- 1-byte ENUM created by load.py
     VendorID,
-    lpep_pickup_datetime as pickup_datetime,
-    lpep_dropoff_datetime as dropoff_datetime,
+    pickup_datetime,
+    dropoff_datetime,
     passenger_count,
     trip_distance,
     total_amount,
+    PULocationID,       -- taxi zone IDs (USMALLINT, see taxi_zones); NULL before mid-2016
+    DOLocationID,
+    source_month,
     
     -- Extract time features
-    EXTRACT(hour FROM lpep_pickup_datetime) as hour_of_day,
-    EXTRACT(dow FROM lpep_pickup_datetime) as day_of_week,
-    EXTRACT(week FROM lpep_pickup_datetime) as week_of_year,
-    EXTRACT(month FROM lpep_pickup_datetime) as month_of_year,
-    EXTRACT(year FROM lpep_pickup_datetime) as pickup_year,
+    EXTRACT(hour FROM pickup_datetime) as hour_of_day,
+    EXTRACT(dow FROM pickup_datetime) as day_of_week,
+    EXTRACT(week FROM pickup_datetime) as week_of_year,
+    EXTRACT(month FROM pickup_datetime) as month_of_year,
+    EXTRACT(year FROM pickup_datetime) as pickup_year,
     
     -- Calculate trip duration in minutes
-    ROUND(EXTRACT(epoch FROM (lpep_dropoff_datetime - lpep_pickup_datetime)) / 60.0, 2) as trip_duration_minutes,
+    ROUND(EXTRACT(epoch FROM (dropoff_datetime - pickup_datetime)) / 60.0, 2) as trip_duration_minutes,
     
     -- Calculate average speed in mph
     CASE 
@@ -26,18 +29,69 @@ SELECT
     END as avg_mph,
 
     -- === Carbon emissions estimate ===
-    -- Multiplies distance by emission factor (grams CO2 per mile) from lookup table
-    -- Converts grams → kilograms by dividing by 1000
-    ROUND(trip_distance * (
-      SELECT co2_grams_per_mile / 1000.0 
-      FROM {{ source('raw_data', 'vehicle_emissions') }} 
-      WHERE vehicle_type = 'green_taxi'
-    ), 4) as co2_emissions_kg
+    -- Multiplies distance by the emission factor in effect at pickup time (kg CO2 per mile)
+    ROUND(trip_distance * f.co2_kg_per_mile, 4) as co2_emissions_kg,
+    f.factor_version,
 
+    -- When this row was transformed; drives the incremental filters downstream
+    CAST(current_timestamp AS TIMESTAMP) as transformed_at
 
-FROM {{ source('raw_data', 'green_tripdata') }}
+
+FROM {{ clean_trips('green') }} t
+-- === Emission factor versions: the latest valid_from at or before pickup ===
+ASOF LEFT JOIN (
+    SELECT valid_from, co2_kg_per_mile, factor_version
+    FROM {{ ref('emission_factors') }}
+    WHERE cab_type = 'green'
+) f ON t.pickup_datetime >= f.valid_from
 -- === Data quality filters ===
-WHERE lpep_pickup_datetime IS NOT NULL
-  AND lpep_dropoff_datetime IS NOT NULL
+WHERE pickup_datetime IS NOT NULL
+  AND dropoff_datetime IS NOT NULL
   AND trip_distance > 0
-  AND total_amount > 0
\ No newline at end of file
+  AND total_amount > 0
+
+{% if is_incremental() %}
+-- === Incremental: only source months clean.py rewrote since this model last ran ===
+-- === (clean_stats.cleaned_at, which also marks months that lost boundary       ===
+-- === duplicates), or holding trips whose emission factor version has changed   ===
+  AND (
+    source_month IN (
+      SELECT DISTINCT source_month
+      FROM {{ source('raw_data', 'clean_stats') }}
+      WHERE cab_type = 'green'
+        AND cleaned_at > (SELECT COALESCE(MAX(transformed_at), TIMESTAMP '1970-01-01') FROM {{ this }})
+    )
+    OR source_month IN (
+      -- One aggregate over three columns of {{ this }} (no join against the trips), then
+      -- compared with the handful of factor rows: a month is stale when its trips carry a
+      -- version that no longer exists, or its pickup span overlaps a version none carries yet
+      WITH staged AS (
+        SELECT
+          source_month,
+          MIN(pickup_datetime) AS first_pickup,
+          MAX(pickup_datetime) AS last_pickup,
+          list(DISTINCT factor_version) FILTER (WHERE factor_version IS NOT NULL) AS versions
+        FROM {{ this }}
+        GROUP BY source_month
+      ),
+      factors AS (
+        SELECT valid_from, valid_to, factor_version
+        FROM {{ ref('emission_factors') }}
+        WHERE cab_type = 'green'
+      ),
+      new_factors AS (
+        SELECT valid_from, valid_to
+        FROM factors
+        WHERE factor_version NOT IN (SELECT UNNEST(versions) FROM staged)
+      )
+      SELECT s.source_month
+      FROM staged s
+      WHERE NOT list_has_all((SELECT list(factor_version) FROM factors), s.versions)
+         OR EXISTS (
+           SELECT 1 FROM new_factors n
+           WHERE n.valid_from <= s.last_pickup
+             AND (n.valid_to IS NULL OR n.valid_to > s.first_pickup)
+         )
+    )
+  )
+{% endif %}
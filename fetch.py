@@ -0,0 +1,143 @@
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+#HTTP errors that will not go away by retrying (month not published yet, access denied)
+PERMANENT_HTTP_ERRORS = {400, 401, 403, 404}
+
+
+#Caps the number of requests in flight against any single host
+class HostLimiter:
+    def __init__(self, per_host=4):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def slot(self, url):
+        host = urlparse(url).netloc or "local"
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._slots[host]
+
+
+#True for errors where another attempt cannot help
+def is_permanent(e):
+    return (
+        (isinstance(e, urllib.error.HTTPError) and e.code in PERMANENT_HTTP_ERRORS)
+        or isinstance(getattr(e, "reason", e), FileNotFoundError)
+    )
+
+
+#Run request(url) inside the host limiter, retrying transient failures with exponential backoff
+def with_retries(request, url, retries=4, backoff=2.0, limiter=None):
+    for attempt in range(1, retries + 1):
+        try:
+            slot = limiter.slot(url) if limiter else contextlib.nullcontext()
+            with slot:
+                return request(url)
+        except Exception as e:
+            if is_permanent(e) or attempt == retries:
+                raise
+            #Full jitter so parallel workers do not retry in lockstep
+            delay = random.uniform(0, backoff * 2 ** (attempt - 1))
+            logger.warning(f"Attempt {attempt}/{retries} for {url} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+# ------------------------------
+# Function: download
+# Purpose: Copy one http(s):// or file:// URL to a local path, hashing it on the way through
+# Returns (path, sha256 hex digest)
+# ------------------------------
+def download(url, dest, retries=4, backoff=2.0, timeout=120, limiter=None):
+    def request(url):
+        tmp = f"{dest}.part"
+        digest = hashlib.sha256()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response, open(tmp, "wb") as out:
+                while chunk := response.read(1024 * 1024):
+                    digest.update(chunk)
+                    out.write(chunk)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return dest, digest.hexdigest()
+
+    return with_retries(request, url, retries, backoff, limiter)
+
+
+# ------------------------------
+# Function: probe
+# Purpose: HEAD one URL and return (size, etag) without downloading the body
+# Servers without an ETag (file://, simple http servers) fall back to Last-Modified
+# ------------------------------
+def probe(url, retries=4, backoff=2.0, timeout=30, limiter=None):
+    def request(url):
+        with urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=timeout) as response:
+            size = response.headers.get("Content-Length")
+            etag = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            return (int(size) if size is not None else None), etag
+
+    return with_retries(request, url, retries, backoff, limiter)
+
+
+#Run work(url) for every URL on a bounded pool and yield (url, result, error) as each finishes
+#At most max_workers URLs are running or finished-but-not-yet-consumed at any time: the next
+#URL is only submitted once the caller has taken a result, so downloads never run ahead of
+#the caller moving files out of the download directory
+def run_pool(work, urls, max_workers=8):
+    pending = iter(urls)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+
+        def submit_next():
+            url = next(pending, None)
+            if url is not None:
+                futures[pool.submit(work, url)] = url
+
+        for _ in range(max_workers):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = futures.pop(future)
+                try:
+                    yield url, future.result(), None
+                except Exception as e:
+                    yield url, None, e
+                submit_next()
+
+
+# ------------------------------
+# Function: fetch_all
+# Purpose: Download many URLs on a bounded worker pool, yielding (url, (path, sha256), error)
+# as each one finishes. No more than max_workers files sit in dest_dir at once, so the
+# caller can bound disk use by storing (or evicting) each file before taking the next.
+# ------------------------------
+def fetch_all(urls, dest_dir, max_workers=8, per_host=4, retries=4, backoff=2.0):
+    os.makedirs(dest_dir, exist_ok=True)
+    limiter = HostLimiter(per_host)
+
+    def work(url):
+        dest = os.path.join(dest_dir, os.path.basename(urlparse(url).path))
+        return download(url, dest, retries, backoff, limiter=limiter)
+
+    yield from run_pool(work, urls, max_workers)
+
+
+#HEAD many URLs on a bounded worker pool, yielding (url, (size, etag), error)
+def probe_all(urls, max_workers=8, per_host=4, retries=4, backoff=2.0):
+    limiter = HostLimiter(per_host)
+    yield from run_pool(lambda url: probe(url, retries, backoff, limiter=limiter), urls, max_workers)
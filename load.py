@@ -1,6 +1,11 @@
-import duckdb
+import argparse
 import logging
-import time 
+import os
+
+from db_config import connect, unordered
+from cache import CACHE_DIR, CACHE_MAX_BYTES, ParquetCache
+from data_profile import detect_drift, profile_table, totals
+from fetch import download, fetch_all, is_permanent, probe_all
 
 logging.basicConfig(
     level=logging.INFO,
@@ -9,10 +14,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+
+#Yellow files use tpep_* datetime columns, green files use lpep_*
+DATETIME_PREFIX = {'yellow': 'tpep', 'green': 'lpep'}
+
+#Typed schema of the raw trip tables; numbers are narrowed on ingest to save disk and scan time
+TRIP_SCHEMA = {
+    'VendorID': 'UTINYINT',
+    'pickup_datetime': 'TIMESTAMP',
+    'dropoff_datetime': 'TIMESTAMP',
+    'passenger_count': 'UTINYINT',
+    'trip_distance': 'DECIMAL(9,2)',
+    'total_amount': 'DECIMAL(9,2)',
+    #Taxi zone IDs (1-265, see taxi_zones) kept as 2-byte codes; NULL in pre-2016 files
+    'PULocationID': 'USMALLINT',
+    'DOLocationID': 'USMALLINT',
+    'source_month': 'DATE',
+    #Bit flags of the narrowed values that overflowed or lost precision (see downcast_flags)
+    'downcast_flags': 'USMALLINT',
+}
+TRIP_COLUMNS = ",\n".join(f"    {column} {data_type}" for column, data_type in TRIP_SCHEMA.items())
+
+#Narrowed columns, with the condition that means a source value would lose precision
+#(values that do not fit at all are caught by TRY_CAST returning NULL)
+DOWNCAST_PRECISION = {
+    'VendorID': "VendorID <> trunc(VendorID)",
+    'passenger_count': "passenger_count <> trunc(passenger_count)",
+    'trip_distance': "trip_distance <> round(trip_distance, 2)",
+    'total_amount': "total_amount <> round(total_amount, 2)",
+    'PULocationID': "PULocationID <> trunc(PULocationID)",
+    'DOLocationID': "DOLocationID <> trunc(DOLocationID)",
+}
+
+#TLC taxi zone lookup (LocationID, Borough, Zone, service_zone), downloaded on the first
+#load (PIPELINE_TAXI_ZONES_URL points elsewhere, e.g. a file:// mirror) and kept in data/
+TAXI_ZONES_URL = os.environ.get('PIPELINE_TAXI_ZONES_URL', "https://d37ci6vzurychx.cloudfront.net/misc/taxi_zone_lookup.csv")
+TAXI_ZONES_CSV = os.path.join('data', 'taxi_zone_lookup.csv')
+
+#Cab types are stored as a 1-byte ENUM downstream instead of a repeated VARCHAR literal
+CAB_TYPE_ENUM = "CREATE TYPE IF NOT EXISTS cab_type_enum AS ENUM ('yellow', 'green');"
+
+#One row per cab type and month that has been loaded, so reruns only touch new or changed months
+MANIFEST_COLUMNS = """
+    cab_type VARCHAR,
+    source_month DATE,
+    source_url VARCHAR,
+    file_size BIGINT,
+    etag VARCHAR,
+    checksum VARCHAR,
+    row_count BIGINT,
+    loaded_at TIMESTAMP,
+    PRIMARY KEY (cab_type, source_month)
+"""
+
 #loading in the urls remotely 
-#start year would be 2015 for scaling purposes, but my script would terminate
-def create_urls(start_year=2024, end_year=2024):
-    base_url = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+#base_url can also point at a local http server or a file:// directory of parquet files
+def create_urls(start_year=2024, end_year=2024, base_url=BASE_URL):
     urls = {'yellow': [], 'green': []}
 
     for year in range(start_year, end_year + 1):
@@ -27,105 +85,332 @@ def create_urls(start_year=2024, end_year=2024):
     )
     return urls
 
+#Split a TLC file name like yellow_tripdata_2024-01.parquet into ('yellow', '2024-01')
+def parse_source(url):
+    name = os.path.basename(url).replace(".parquet", "")
+    return name.split("_")[0], name.split("_")[-1]
+
+#Create the trip tables, manifest and cab type ENUM if missing
+#Tables left by an older loader (no source_month column, or the wide source types)
+#cannot be updated per month, so they are rebuilt
+def prepare_tables(con, full_refresh=False):
+    con.execute(CAB_TYPE_ENUM)
+    con.execute(f"CREATE TABLE IF NOT EXISTS load_manifest ({MANIFEST_COLUMNS});")
+    if full_refresh:
+        con.execute("DELETE FROM load_manifest;")
+
+    for cab in ('yellow', 'green'):
+        columns = dict(con.execute(
+            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = ?",
+            [f"{cab}_tripdata"]
+        ).fetchall())
+        if full_refresh or (columns and columns != TRIP_SCHEMA):
+            con.execute(f"DROP TABLE IF EXISTS {cab}_tripdata;")
+            con.execute("DELETE FROM load_manifest WHERE cab_type = ?", [cab])
+            logger.info(f"Dropped {cab}_tripdata for a full reload")
+        con.execute(f"CREATE TABLE IF NOT EXISTS {cab}_tripdata (\n{TRIP_COLUMNS}\n);")
+
+#Manifest rows keyed by (cab_type, 'YYYY-MM')
+def read_manifest(con):
+    rows = con.execute("""
+        SELECT cab_type, strftime(source_month, '%Y-%m'), file_size, etag, checksum
+        FROM load_manifest;
+    """).fetchall()
+    return {(cab, ym): {'file_size': size, 'etag': etag, 'checksum': checksum}
+            for cab, ym, size, etag, checksum in rows}
+
+#Source column names of each kept column across the TLC file history, current name first
+#(names match case-insensitively, so Passenger_Count and Trip_Distance need no alias)
+#2009 yellow files: vendor_name, Trip_Pickup_DateTime, Total_Amt; 2010: vendor_id, pickup_datetime
+COLUMN_ALIASES = {
+    'VendorID': ['VendorID', 'vendor_id', 'vendor_name'],
+    'pickup_datetime': ['{prefix}_pickup_datetime', 'pickup_datetime', 'Trip_Pickup_DateTime'],
+    'dropoff_datetime': ['{prefix}_dropoff_datetime', 'dropoff_datetime', 'Trip_Dropoff_DateTime'],
+    'passenger_count': ['passenger_count'],
+    'trip_distance': ['trip_distance'],
+    'total_amount': ['total_amount', 'Total_Amt'],
+    #Files before mid-2016 have pickup/dropoff coordinates instead, so these stay NULL
+    'PULocationID': ['PULocationID'],
+    'DOLocationID': ['DOLocationID'],
+}
+
+#Before 2011 vendors were text codes; map them onto the numeric VendorID (others become NULL)
+LEGACY_VENDORS = {'CMT': 1, 'VTS': 2}
+LEGACY_VENDOR_COLUMNS = {'vendor_id', 'vendor_name'}
+
+#Common type for merging aliases when one batch mixes old and new files
+ALIAS_TYPES = {'pickup_datetime': 'TIMESTAMP', 'dropoff_datetime': 'TIMESTAMP'}
+
+#Column names present in any of the files (lower case), read from the parquet footers only
+def file_columns(con, files):
+    file_list = ", ".join(f"'{f['path']}'" for f in files)
+    return {name.lower() for (name,) in con.execute(
+        f"SELECT DISTINCT name FROM parquet_schema([{file_list}]);"
+    ).fetchall()}
+
+#Expression for one source column, translating legacy vendor codes
+def alias_expression(alias):
+    if alias.lower() not in LEGACY_VENDOR_COLUMNS:
+        return alias
+    cases = " ".join(f"WHEN '{code}' THEN '{vendor}'" for code, vendor in LEGACY_VENDORS.items())
+    return f"TRY_CAST(CASE upper(CAST({alias} AS VARCHAR)) {cases} ELSE CAST({alias} AS VARCHAR) END AS DOUBLE)"
+
+# ------------------------------
+# Function: source_columns
+# Purpose: Map each kept column to a SQL expression over the raw parquet columns.
+# Given the columns `present` in a batch of files, historical names are resolved at scan
+# time: one alias is used as is, several (a batch spanning a schema change) are merged
+# with COALESCE, and a column no file has becomes NULL. Without `present` the current
+# TLC names are assumed.
+# ------------------------------
+def source_columns(cab, present=None):
+    prefix = DATETIME_PREFIX[cab]
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        aliases = [alias.format(prefix=prefix) for alias in aliases]
+        if present is not None:
+            aliases = [alias for alias in aliases if alias.lower() in present]
+        else:
+            aliases = aliases[:1]
+        if not aliases:
+            columns[column] = "NULL"
+        elif len(aliases) == 1:
+            columns[column] = alias_expression(aliases[0])
+        else:
+            merge_type = ALIAS_TYPES.get(column, 'DOUBLE')
+            columns[column] = "COALESCE(" + ", ".join(
+                f"TRY_CAST({alias_expression(alias)} AS {merge_type})" for alias in aliases
+            ) + ")"
+    return columns
+
+def read_files_sql(files):
+    file_list = ", ".join(f"'{f['path']}'" for f in files)
+    return f"read_parquet([{file_list}], union_by_name = true, filename = true)"
+
+# ------------------------------
+# Function: downcast_flags
+# Purpose: Flag, per row and in the ingest SELECT itself, the source values that overflow
+# or lose precision in the typed schema. Narrowed column i sets bit 2*i when its value
+# does not fit (TRY_CAST stores NULL) and bit 2*i+1 when it is rounded.
+# ------------------------------
+def downcast_flags(columns):
+    flags = []
+    for i, (column, precision) in enumerate(DOWNCAST_PRECISION.items()):
+        source = f"({columns[column]})"
+        flags.append(f"CASE WHEN {source} IS NOT NULL AND TRY_CAST({source} AS {TRIP_SCHEMA[column]}) IS NULL THEN {1 << 2 * i} ELSE 0 END")
+        flags.append(f"CASE WHEN {precision.replace(column, source)} THEN {1 << (2 * i + 1)} ELSE 0 END")
+    return f"CAST({' + '.join(flags)} AS USMALLINT)"
+
+#Per-column counts of the flagged values, evaluated next to the other per-month aggregates
+def downcast_counts():
+    return ", ".join(
+        f"COUNT(*) FILTER (WHERE downcast_flags & {1 << bit} <> 0)"
+        for bit in range(2 * len(DOWNCAST_PRECISION))
+    )
+
+#Log the narrowed columns with overflowing or rounded values in a batch of months
+def check_downcast(cab, counts):
+    problems = {}
+    for i, column in enumerate(DOWNCAST_PRECISION):
+        overflow, precision = counts[2 * i], counts[2 * i + 1]
+        if overflow or precision:
+            problems[column] = {'overflow': overflow, 'precision': precision}
+            logger.warning(
+                f"{cab} {column} ({TRIP_SCHEMA[column]}): {overflow:,} values overflow and are stored as NULL, "
+                f"{precision:,} values lose precision"
+            )
+    return problems
+
+#Select the columns we keep from raw parquet files, cast to the typed schema
+#Each row is tagged with the month of the file it came from (source_month, a 4-byte DATE),
+#looked up from the file path since cached files are named by checksum, not by month
+#union_by_name lines up columns by name when TLC files drift in column order or extras
+def ingest_files(con, cab, files, columns=None):
+    columns = columns or source_columns(cab)
+    select_list = ",\n            ".join(
+        f"TRY_CAST({source} AS {TRIP_SCHEMA[column]}) AS {column}"
+        for column, source in columns.items()
+    )
+    month_map = ", ".join(f"('{f['path']}', DATE '{f['ym']}-01')" for f in files)
+    return con.execute(f"""
+        INSERT INTO {cab}_tripdata
+        SELECT 
+            {select_list},
+            m.source_month,
+            {downcast_flags(columns)} AS downcast_flags
+        FROM {read_files_sql(files)} AS r
+        JOIN (VALUES {month_map}) AS m(filename, source_month) USING (filename);
+    """).fetchone()[0]
+
+# ------------------------------
+# Function: replace_months
+# Purpose: Atomically swap the rows of the given months for freshly downloaded files
+# and record them in the manifest. Either every month in the batch commits or none does.
+# Per-month row counts and downcast counts come from one GROUP BY over just the replaced
+# months, so the files are scanned once, by the ingest.
+# ------------------------------
+def replace_months(con, cab, files):
+    month_list = ", ".join(f"DATE '{f['ym']}-01'" for f in files)
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        con.execute(f"DELETE FROM {cab}_tripdata WHERE source_month IN ({month_list});")
+        #Resolve the historical column names of exactly these files
+        columns = source_columns(cab, file_columns(con, files))
+        #Row order within the table is irrelevant (months are addressed by source_month)
+        with unordered(con):
+            inserted = ingest_files(con, cab, sorted(files, key=lambda f: f['ym']), columns)
+        result = con.execute(f"""
+            SELECT strftime(source_month, '%Y-%m'), COUNT(*), {downcast_counts()}
+            FROM {cab}_tripdata
+            WHERE source_month IN ({month_list})
+            GROUP BY source_month;
+        """).fetchall()
+        counts = {row[0]: row[1] for row in result}
+        check_downcast(cab, [sum(row[2 + i] for row in result) for i in range(2 * len(DOWNCAST_PRECISION))])
+        for f in files:
+            con.execute(
+                "INSERT OR REPLACE INTO load_manifest VALUES (?, CAST(? AS DATE), ?, ?, ?, ?, ?, current_timestamp);",
+                [cab, f"{f['ym']}-01", f['url'], f['file_size'], f['etag'], f['checksum'], counts.get(f['ym'], 0)]
+            )
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    for f in sorted(files, key=lambda f: f['ym']):
+        logger.info(f"{f['ym']}: Loaded {cab} cab data, {counts.get(f['ym'], 0):,} rows")
+    return inserted
+
+#Record a new size/etag for a month whose content turned out to be unchanged
+def touch_manifest(con, cab, f):
+    con.execute("""
+        UPDATE load_manifest SET file_size = ?, etag = ?
+        WHERE cab_type = ? AND source_month = CAST(? AS DATE);
+    """, [f['file_size'], f['etag'], cab, f"{f['ym']}-01"])
+
 # ------------------------------
 # Function: load_parquet_files
 # Purpose: Load Yellow/Green taxi parquet files into DuckDB, plus vehicle emissions CSV
+# Loading is incremental: each month's size/ETag is checked against load_manifest and only
+# new or changed months are downloaded (concurrently, with retry and backoff) and replaced.
+# Files are read through a local ParquetCache: a cached month costs one HEAD request (its
+# size/ETag or Last-Modified is compared with the cached copy), and is only downloaded again
+# when upstream changed. revalidate=False skips the HEADs and trusts the cache (offline runs).
+# bulk=True replaces every changed month of a cab type in one statement and transaction;
+# bulk=False replaces each month in its own transaction as soon as its download finishes.
+# full_refresh=True drops the trip tables and reloads everything.
+# Runs on `con` when one is given (e.g. the orchestrator's shared connection).
 # ------------------------------
-def load_parquet_files(start_year=2024, end_year=2024):
-    urls = create_urls(start_year, end_year)
-    con = duckdb.connect(database='emissions.duckdb', read_only=False)
-    logger.info("Connected to DuckDB")
-
-    # Drop existing tables if they exist
-    con.execute("DROP TABLE IF EXISTS yellow_tripdata;")
-    con.execute("DROP TABLE IF EXISTS green_tripdata;")
-    con.execute("DROP TABLE IF EXISTS vehicle_emissions;")
-    logger.info("Dropped old tables if existed")
-
-    # === Load YELLOW cabs ===
-    logger.info("Loading YELLOW cab data...")
-    first = True
-    yellow_rows = 0
-    for url in urls['yellow']:
-        ym = url.split("_")[-1].replace(".parquet", "")
-        try:
-            if first:
-                con.execute(f"""
-                    CREATE TABLE yellow_tripdata AS
-                    SELECT 
-                        VendorID,
-                        tpep_pickup_datetime AS pickup_datetime,
-                        tpep_dropoff_datetime AS dropoff_datetime,
-                        passenger_count,
-                        trip_distance,
-                        total_amount
-                    FROM read_parquet('{url}');
-                """)
-                first = False
-            else:
-                con.execute(f"""
-                    INSERT INTO yellow_tripdata
-                    SELECT 
-                        VendorID,
-                        tpep_pickup_datetime AS pickup_datetime,
-                        tpep_dropoff_datetime AS dropoff_datetime,
-                        passenger_count,
-                        trip_distance,
-                        total_amount
-                    FROM read_parquet('{url}');
-                """)
-            yellow_rows = con.execute("SELECT COUNT(*) FROM yellow_tripdata").fetchone()[0]
-            logger.info(f"{ym}: Loaded yellow cab data, total rows: {yellow_rows:,}")
-            time.sleep(60)
-        except Exception as e:
-            logger.warning(f"Skipped yellow {ym} due to error: {e}")
+def load_parquet_files(start_year=2024, end_year=2024, base_url=BASE_URL, max_workers=8, per_host=4,
+                       bulk=True, full_refresh=False, cache_dir=CACHE_DIR, cache_bytes=CACHE_MAX_BYTES,
+                       revalidate=True, con=None):
+    urls = create_urls(start_year, end_year, base_url)
+    if con is None:
+        con = connect(stage='load')
+        logger.info("Connected to DuckDB")
+
+    prepare_tables(con, full_refresh)
+    manifest = read_manifest(con)
+    logger.info(f"Manifest has {len(manifest)} loaded months")
+    cache = ParquetCache(cache_dir, cache_bytes)
+
+    # === Find new or changed months ===
+    ready = {'yellow': [], 'green': []}
+    cached = {}
+    for url in urls['yellow'] + urls['green']:
+        entry = cache.lookup(url)
+        if entry:
+            cab, ym = parse_source(url)
+            cached[url] = {'url': url, 'ym': ym, 'file_size': entry['size'], 'etag': entry['etag'],
+                           'checksum': entry['checksum'], 'path': entry['path']}
+
+    remote = {}
+    to_probe = [url for url in urls['yellow'] + urls['green'] if url not in cached or revalidate]
+    for url, meta, error in probe_all(to_probe, max_workers, per_host):
+        cab, ym = parse_source(url)
+        if error and is_permanent(error):
+            logger.warning(f"Skipped {cab} {ym}: not available ({error})")
+            cached.pop(url, None)
+            continue
+        #A failed HEAD is not fatal, the month is simply downloaded and checked by content
+        size, etag = meta if meta else (None, None)
+        if url in cached and (size is None or (cached[url]['file_size'], cached[url]['etag']) == (size, etag)):
             continue
+        cached.pop(url, None)
+        known = manifest.get((cab, ym))
+        if known and size is not None and (known['file_size'], known['etag']) == (size, etag):
+            continue
+        remote[url] = {'url': url, 'ym': ym, 'file_size': size, 'etag': etag}
+
+    for url, f in cached.items():
+        cab, ym = parse_source(url)
+        known = manifest.get((cab, ym))
+        if not known or known['checksum'] != f['checksum']:
+            ready[cab].append(f)
+
+    logger.info(
+        f"{len(remote)} new or changed months to fetch, "
+        f"{sum(len(files) for files in ready.values())} to load from cache"
+    )
+
+    # === Load YELLOW and GREEN cabs ===
+    rows = {'yellow': 0, 'green': 0}
 
-    # === Load GREEN cabs ===
-    logger.info("Loading GREEN cab data...")
-    first = True
-    green_rows = 0
-    for url in urls['green']:
-        ym = url.split("_")[-1].replace(".parquet", "")
+    def load_batch(cab, batch):
         try:
-            if first:
-                con.execute(f"""
-                    CREATE TABLE green_tripdata AS
-                    SELECT 
-                        VendorID,
-                        lpep_pickup_datetime AS pickup_datetime,
-                        lpep_dropoff_datetime AS dropoff_datetime,
-                        passenger_count,
-                        trip_distance,
-                        total_amount
-                    FROM read_parquet('{url}');
-                """)
-                first = False
-            else:
-                con.execute(f"""
-                    INSERT INTO green_tripdata
-                    SELECT 
-                        VendorID,
-                        lpep_pickup_datetime AS pickup_datetime,
-                        lpep_dropoff_datetime AS dropoff_datetime,
-                        passenger_count,
-                        trip_distance,
-                        total_amount
-                    FROM read_parquet('{url}');
-                """)
-            green_rows = con.execute("SELECT COUNT(*) FROM green_tripdata").fetchone()[0]
-            logger.info(f"{ym}: Loaded green cab data, total rows: {green_rows:,}")
-            time.sleep(60)
+            rows[cab] += replace_months(con, cab, batch)
         except Exception as e:
-            logger.warning(f"Skipped green {ym} due to error: {e}")
+            logger.warning(f"Skipped {cab} {', '.join(f['ym'] for f in batch)} due to error: {e}")
+
+    #Months already in the cache are loaded up front in per-month mode
+    if not bulk:
+        for cab in ('yellow', 'green'):
+            for f in sorted(ready.pop(cab), key=lambda f: f['ym']):
+                load_batch(cab, [f])
+            ready[cab] = []
+
+    # === Fetch YELLOW and GREEN cabs into the cache ===
+    logger.info(f"Fetching YELLOW and GREEN cab data with {max_workers} workers ({per_host} per host)...")
+    for url, result, error in fetch_all(sorted(remote), cache.tmp_dir, max_workers, per_host):
+        cab, ym = parse_source(url)
+        if error:
+            logger.warning(f"Skipped {cab} {ym} due to error: {error}")
             continue
+        entry = cache.store(url, result[0], result[1], remote[url]['etag'])
+        f = dict(remote[url], path=entry['path'], checksum=entry['checksum'], file_size=entry['size'])
+        known = manifest.get((cab, ym))
+        if known and known['checksum'] == f['checksum']:
+            logger.info(f"{ym}: {cab} file metadata changed but content is identical, not reloaded")
+            touch_manifest(con, cab, f)
+            continue
+        if bulk:
+            ready[cab].append(f)
+        else:
+            load_batch(cab, [f])
+        #Stay within the disk budget while downloading, not only at the end of the run
+        cache.enforce_budget(keep={f['url'] for files in ready.values() for f in files})
+    cache.save()
+
+    #Bulk mode: one scan per cab type over every changed month
+    for cab in ('yellow', 'green'):
+        if ready[cab]:
+            load_batch(cab, ready[cab])
+
+    logger.info(f"Finished loading YELLOW: {rows['yellow']:,} new rows, GREEN: {rows['green']:,} new rows")
+    cache.enforce_budget()
+    cache.save()
+    cache.log_stats()
+
+    # === Load vehicle emissions data and the taxi zone lookup ===
+    load_vehicle_emissions(con)
+    load_taxi_zones(con)
 
-    logger.info(f"Finished loading YELLOW: {yellow_rows:,} rows, GREEN: {green_rows:,} rows")
+    return con
 
-    # === Load vehicle emissions data ===
+#One row per emission-factor version: a changed factor is a new row with a later valid_from
+def load_vehicle_emissions(con):
     try:
         con.execute(f"""
-            CREATE TABLE vehicle_emissions AS
+            CREATE OR REPLACE TABLE vehicle_emissions AS
             SELECT *
             FROM read_csv_auto('data/vehicle_emissions.csv');
         """)
@@ -133,56 +418,63 @@ def load_parquet_files(start_year=2024, end_year=2024):
     except Exception as e:
         logger.error(f"Failed to load vehicle emissions data: {e}")
 
-    return con
+#One row per taxi zone (265 rows); trips reference it by PULocationID/DOLocationID
+def load_taxi_zones(con, path=TAXI_ZONES_CSV, url=TAXI_ZONES_URL):
+    if not os.path.exists(path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            download(url, path)
+            logger.info(f"Downloaded {url} to {path}")
+        except Exception as e:
+            logger.warning(f"Could not download {url} ({e}), zone names are unavailable")
+            return
+    try:
+        con.execute(f"""
+            CREATE OR REPLACE TABLE taxi_zones AS
+            SELECT CAST(LocationID AS USMALLINT) AS LocationID, Borough, Zone, service_zone
+            FROM read_csv('{path}', header = true, all_varchar = true)
+            ORDER BY LocationID;
+        """)
+        logger.info("Loaded taxi zones table")
+    except Exception as e:
+        logger.error(f"Failed to load taxi zones: {e}")
 
 #Provide basic descriptive statistics
+#One profiling scan per table (see data_profile.py); the summary is read off the profile
 def summarize_table(con, table_name):
     logger.info(f"--- Summary for {table_name} ---")
     print(f"--- Summary for {table_name} ---")
 
     try:
-        # Check if table exists and has data
-        count_result = con.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()
-        if count_result[0] == 0:
+        total = totals(profile_table(con, table_name))
+        trips = int(total.get(('all', 'row_count'), 0))
+        if trips == 0:
             logger.warning(f"{table_name}: No data loaded (all files may have failed)")
             logger.warning(f"{table_name}: No data loaded")
             print(f"{table_name}: No data loaded")
             return
 
-        if table_name == "yellow_tripdata":
-            pickup_col = "pickup_datetime"
-            dropoff_col = "dropoff_datetime"
-        else:  # green
-            pickup_col = "pickup_datetime" 
-            dropoff_col = "dropoff_datetime"
-
-        result = con.execute(f"""
-            SELECT
-                COUNT(*) AS total_trips,
-                SUM(passenger_count) AS total_passengers,
-                AVG(trip_distance) AS avg_trip_distance,
-                AVG(DATE_DIFF('minute', {pickup_col}, {dropoff_col})) AS avg_trip_time_minutes,
-                AVG(passenger_count) AS avg_passengers_per_trip,
-                AVG(total_amount) AS avg_total_amount,
-                MIN({pickup_col}) AS earliest_trip,
-                MAX({pickup_col}) AS latest_trip
-            FROM {table_name}
-            WHERE {pickup_col} IS NOT NULL 
-              AND {dropoff_col} IS NOT NULL;
-        """).fetchall()[0]
+        #Averages over the non-NULL values of each column, like AVG()
+        def average(column, null_column=None):
+            counted = trips - total.get((null_column or column, 'nulls'), 0)
+            return (total.get((column, 'sum')) or 0) / counted if counted else 0
 
+        duration_nulls = max(total.get(('pickup_datetime', 'nulls'), 0), total.get(('dropoff_datetime', 'nulls'), 0))
         summary_text = (
             f"{table_name} Summary:\n"
-            f"Total trips: {result[0]:,}\n"
-            f"Total passengers: {result[1] or 0:,}\n"
-            f"Average trip distance: {result[2]:.2f} miles\n"
-            f"Average trip time: {result[3]:.2f} minutes\n"
-            f"Average passengers per trip: {result[4]:.2f}\n"
-            f"Average total amount: ${result[5]:.2f}\n"
+            f"Total trips: {trips:,}\n"
+            f"Total passengers: {int(total.get(('passenger_count', 'sum')) or 0):,}\n"
+            f"Average trip distance: {average('trip_distance'):.2f} miles\n"
+            f"Average trip time: {(total.get(('duration_minutes', 'sum')) or 0) / max(trips - duration_nulls, 1):.2f} minutes\n"
+            f"Average passengers per trip: {average('passenger_count'):.2f}\n"
+            f"Average total amount: ${average('total_amount'):.2f}\n"
         )
 
         print(summary_text)
         logger.info(summary_text)
+
+        #Month-over-month changes, read from data_profile without another scan
+        detect_drift(con, table_name)
         
     except Exception as e:
         error_msg = f"Could not summarize {table_name}: {e}"
@@ -191,7 +483,14 @@ def summarize_table(con, table_name):
 
 
 if __name__ == "__main__":
-    con = load_parquet_files(2024, 2024)
+    parser = argparse.ArgumentParser(description="Load new or changed TLC months into DuckDB")
+    parser.add_argument('--start', type=int, default=2024, help="first year to load")
+    parser.add_argument('--end', type=int, default=2024, help="last year to load")
+    parser.add_argument('--base-url', default=BASE_URL, help="TLC file server (or a file:// directory)")
+    parser.add_argument('--revalidate', action=argparse.BooleanOptionalAction, default=True,
+                        help="HEAD cached months to detect upstream changes (--no-revalidate trusts the cache)")
+    args = parser.parse_args()
+    con = load_parquet_files(args.start, args.end, args.base_url, revalidate=args.revalidate)
     if con:
         logger.info("All data loaded successfully")
         summarize_table(con, "yellow_tripdata")
@@ -0,0 +1,281 @@
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+from graphlib import TopologicalSorter
+
+import analysis
+import clean
+import load
+import transform
+from cache import sha256_file
+from db_config import connect
+
+#Stage modules configure their own log files on import; the orchestrator logs everything here
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='pipeline.log',
+    force=True
+)
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Single-process pipeline: load -> clean -> transform (dbt) -> analysis
+# Stages run in dependency order over one shared DuckDB connection. Each stage's inputs are
+# fingerprinted (load_manifest checksums, cleaning rules, dbt model SQL, upstream
+# fingerprints) and recorded in stage_state when the stage succeeds; a stage whose
+# fingerprint is unchanged is skipped. Cleaning is incremental: only the source months whose
+# files changed are rewritten, and the dbt models then rebuild just those months.
+# The shared connection is closed while dbt runs (dbt opens the database file itself).
+#   python pipeline.py                 # no-op when nothing changed
+#   python pipeline.py --force clean   # rerun a stage (and everything after it)
+# ------------------------------
+
+#Stage graph: stage -> stages whose output it reads
+DEPENDS = {
+    'load': set(),
+    'clean': {'load'},
+    'transform': {'clean'},
+    'analysis': {'transform'},
+}
+
+#load always runs: its own manifest check skips unchanged months without reading them
+ALWAYS_RUN = {'load'}
+
+#Partitioned dedup is what makes per-month cleaning possible (see clean.dedup_partitioned)
+DEFAULT_DEDUP = 'partition'
+DEFAULT_BOUNDARY_HOURS = 6
+
+STATE_COLUMNS = """
+    stage VARCHAR PRIMARY KEY,
+    fingerprint VARCHAR,
+    inputs VARCHAR,
+    seconds DOUBLE,
+    finished_at TIMESTAMP
+"""
+
+DBT_INPUTS = [os.path.join('dbt', 'dbt_project.yml'), os.path.join('dbt', 'models'), os.path.join('dbt', 'macros')]
+EMISSIONS_CSV = os.path.join('data', 'vehicle_emissions.csv')
+
+
+#sha256 of a JSON-serializable value (keys sorted, so dict order does not matter)
+def digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+#sha256 of every file under the given files/directories, by relative path
+def tree_digest(paths):
+    files = {}
+    for path in paths:
+        if os.path.isfile(path):
+            files[path] = sha256_file(path)
+        for root, _, names in os.walk(path):
+            for name in names:
+                files[os.path.join(root, name)] = sha256_file(os.path.join(root, name))
+    return digest(files)
+
+#Loaded source files as {cab: {'YYYY-MM': checksum}}, read from load_manifest
+def manifest_checksums(con):
+    checksums = {}
+    for cab, ym, checksum in con.execute("""
+        SELECT cab_type, strftime(source_month, '%Y-%m'), checksum FROM load_manifest ORDER BY ALL;
+    """).fetchall():
+        checksums.setdefault(cab, {})[ym] = checksum
+    return checksums
+
+#Previous successful run of every stage: {stage: {'fingerprint', 'inputs'}}
+def read_state(con):
+    con.execute(f"CREATE TABLE IF NOT EXISTS stage_state ({STATE_COLUMNS});")
+    return {stage: {'fingerprint': fingerprint, 'inputs': json.loads(inputs)}
+            for stage, fingerprint, inputs in con.execute(
+                "SELECT stage, fingerprint, inputs FROM stage_state;"
+            ).fetchall()}
+
+def record_state(con, stage, fingerprint, inputs, seconds):
+    con.execute(
+        "INSERT OR REPLACE INTO stage_state VALUES (?, ?, ?, ?, current_timestamp);",
+        [stage, fingerprint, json.dumps(inputs, sort_keys=True, default=str), seconds]
+    )
+
+
+# === Stage inputs: everything a stage reads that can change its output ===
+
+def load_inputs(run):
+    return {
+        'manifest': manifest_checksums(run['con']),
+        'vehicle_emissions': sha256_file(EMISSIONS_CSV),
+    }
+
+def clean_inputs(run):
+    return {
+        'manifest': manifest_checksums(run['con']),
+        'rules': clean.RULES,
+        'columns': clean.TRIP_COLUMNS,
+        'years': [clean.MIN_YEAR, clean.MAX_YEAR],
+        'dedup': run['dedup'],
+        'boundary_hours': run['boundary_hours'],
+    }
+
+def transform_inputs(run):
+    return {
+        'clean': run['fingerprints']['clean'],
+        'vehicle_emissions': sha256_file(EMISSIONS_CSV),
+        'models': tree_digest(DBT_INPUTS),
+    }
+
+def analysis_inputs(run):
+    return {
+        'transform': run['fingerprints']['transform'],
+        'sample_rate': run['sample_rate'],
+    }
+
+
+# === Stage bodies ===
+
+def run_load(run, previous):
+    load.load_parquet_files(run['start_year'], run['end_year'], run['base_url'], revalidate=run['revalidate'], con=run['con'])
+
+#Months whose source file changed (or disappeared) since the last clean, per cab type;
+#None when the rules/settings changed or there is no previous clean, i.e. a full rebuild
+def changed_months(previous, inputs):
+    if previous is None or run_settings(previous['inputs']) != run_settings(inputs) or inputs['dedup'] != 'partition':
+        return None
+    months = {}
+    for cab in ('yellow', 'green'):
+        before, now = previous['inputs']['manifest'].get(cab, {}), inputs['manifest'].get(cab, {})
+        changed = sorted(ym for ym in set(before) | set(now) if before.get(ym) != now.get(ym))
+        if changed:
+            months[cab] = [datetime.date.fromisoformat(f"{ym}-01") for ym in changed]
+    return months
+
+def run_settings(inputs):
+    return {key: value for key, value in inputs.items() if key != 'manifest'}
+
+def run_clean(run, previous):
+    #A forced clean has no changed months to go by, so it rewrites every month
+    months = None if 'clean' in run['forced'] else changed_months(previous, run['inputs']['clean'])
+    if months is None:
+        logger.info("Cleaning every month (rules, settings or first run)")
+    else:
+        logger.info(f"Cleaning changed months only: {', '.join(f'{cab} {len(m)}' for cab, m in months.items())}")
+    results = clean.cleaning_trips(run['dedup'], run['boundary_hours'], con=run['con'], months=months)
+    if results is None:
+        raise RuntimeError("clean stage failed, see pipeline.log")
+    run['outcomes']['clean'] = {'rebuilt': months is None}
+
+def run_transform(run, previous):
+    #A full clean rebuild or changed model SQL invalidates rows the incremental models keep
+    models_changed = previous is not None and previous['inputs']['models'] != run['inputs']['transform']['models']
+    full_refresh = run['outcomes'].get('clean', {}).get('rebuilt', False) or models_changed
+    #dbt opens the database file itself, so the shared connection steps aside meanwhile
+    run['con'].close()
+    try:
+        if not transform.run_dbt(full_refresh=full_refresh):
+            raise RuntimeError("dbt run failed, see transform.log")
+    finally:
+        run['con'] = connect(stage='pipeline_after_dbt')
+
+def run_analysis(run, previous):
+    analysis.run_analysis(run['con'], run['sample_rate'], os.environ.get('PIPELINE_EXPORT_DIR'))
+
+STAGES = {
+    'load': (load_inputs, run_load),
+    'clean': (clean_inputs, run_clean),
+    'transform': (transform_inputs, run_transform),
+    'analysis': (analysis_inputs, run_analysis),
+}
+
+
+#A forced stage reruns along with everything downstream of it
+def downstream(stages):
+    forced = set(stages)
+    for stage in TopologicalSorter(DEPENDS).static_order():
+        if DEPENDS[stage] & forced:
+            forced.add(stage)
+    return forced
+
+# ------------------------------
+# Function: run_pipeline
+# Purpose: Run every stage whose input fingerprint changed, in dependency order, over one
+# shared connection (its query_log records are tagged 'load', 'clean', ... per stage, and
+# 'pipeline' for the bookkeeping in between). A failed stage stops the run; its stage_state is left as it was, so
+# the next run retries it. Returns {stage: 'ran' | 'skipped'}.
+# ------------------------------
+def run_pipeline(start_year=2024, end_year=2024, base_url=load.BASE_URL, dedup=DEFAULT_DEDUP,
+                 boundary_hours=DEFAULT_BOUNDARY_HOURS, sample_rate=None, force=(), revalidate=True):
+    run = {
+        'con': connect(stage='pipeline'),
+        'start_year': start_year,
+        'end_year': end_year,
+        'base_url': base_url,
+        'revalidate': revalidate,
+        'dedup': dedup,
+        'boundary_hours': boundary_hours,
+        'sample_rate': sample_rate,
+        'fingerprints': {},
+        'inputs': {},
+        'outcomes': {},
+    }
+    forced = downstream(force)
+    run['forced'] = forced
+    status = {}
+    started = time.perf_counter()
+    try:
+        state = read_state(run['con'])
+        for stage in TopologicalSorter(DEPENDS).static_order():
+            inputs_of, body = STAGES[stage]
+            previous = state.get(stage)
+
+            if stage not in ALWAYS_RUN:
+                inputs = inputs_of(run)
+                fingerprint = digest(inputs)
+                if previous and previous['fingerprint'] == fingerprint and stage not in forced:
+                    logger.info(f"Stage {stage}: inputs unchanged, skipped")
+                    run['fingerprints'][stage] = fingerprint
+                    status[stage] = 'skipped'
+                    continue
+                run['inputs'][stage] = inputs
+
+            logger.info(f"Stage {stage}: running")
+            stage_start = time.perf_counter()
+            #The shared connection's queries are logged under the stage that ran them
+            run['con'].set_stage(stage)
+            body(run, previous)
+            run['con'].set_stage()
+            seconds = round(time.perf_counter() - stage_start, 3)
+
+            #load's fingerprint describes what it produced (the manifest after the run)
+            if stage in ALWAYS_RUN:
+                inputs = inputs_of(run)
+                fingerprint = digest(inputs)
+            run['fingerprints'][stage] = fingerprint
+            record_state(run['con'], stage, fingerprint, inputs, seconds)
+            status[stage] = 'ran'
+            logger.info(f"Stage {stage}: finished in {seconds:.1f}s")
+    except Exception as e:
+        logger.error(f"Pipeline stopped: {e}")
+        print(f"Pipeline stopped: {e}")
+    finally:
+        run['con'].close()
+    logger.info(f"Pipeline finished in {time.perf_counter() - started:.1f}s: {status}")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run load, clean, dbt and analysis, skipping unchanged stages")
+    parser.add_argument('--start', type=int, default=2024, help="first year to load")
+    parser.add_argument('--end', type=int, default=2024, help="last year to load")
+    parser.add_argument('--base-url', default=load.BASE_URL, help="TLC file server (or a file:// directory)")
+    parser.add_argument('--dedup', choices=['partition', 'global'], default=DEFAULT_DEDUP)
+    parser.add_argument('--boundary-hours', type=int, default=DEFAULT_BOUNDARY_HOURS)
+    parser.add_argument('--sample-rate', type=float, default=None, help="quick-look analysis on a sample")
+    parser.add_argument('--force', nargs='*', default=[], choices=list(STAGES), help="rerun these stages")
+    parser.add_argument('--revalidate', action=argparse.BooleanOptionalAction, default=True,
+                        help="HEAD cached months to detect upstream changes (--no-revalidate trusts the cache)")
+    args = parser.parse_args()
+    status = run_pipeline(args.start, args.end, args.base_url, args.dedup, args.boundary_hours, args.sample_rate,
+                          args.force, args.revalidate)
+    print(", ".join(f"{stage}: {outcome}" for stage, outcome in status.items()))
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+#One id per pipeline run; set PIPELINE_RUN_ID so load/clean/transform/analysis share a report
+RUN_ID = os.environ.get('PIPELINE_RUN_ID') or datetime.now().strftime('%Y%m%d_%H%M%S')
+REPORT_DIR = 'reports'
+#Queries slower than this keep their full DuckDB JSON profile (operator tree)
+SLOW_QUERY_SECONDS = float(os.environ.get('PIPELINE_SLOW_QUERY_SECONDS', '1.0'))
+
+#Operators whose output is a single "rows affected" count; their child holds the real row flow
+SINK_OPERATORS = {'CREATE_TABLE_AS', 'INSERT', 'DELETE_OPERATOR', 'UPDATE', 'COPY_TO_FILE'}
+
+QUERY_LOG_COLUMNS = """
+    run_id VARCHAR,
+    stage VARCHAR,
+    seq INTEGER,
+    query VARCHAR,
+    started_at TIMESTAMP,
+    wall_seconds DOUBLE,
+    duckdb_seconds DOUBLE,
+    rows_in BIGINT,
+    rows_out BIGINT,
+    bytes_read BIGINT,
+    bytes_written BIGINT,
+    peak_memory BIGINT,
+    profile_path VARCHAR
+"""
+
+
+#Pull the per-query numbers out of a DuckDB JSON profile
+def profile_metrics(profile):
+    top = (profile.get('children') or [{}])[0]
+    rows_out = profile.get('rows_returned')
+    if top.get('operator_type') in SINK_OPERATORS and top.get('children'):
+        rows_out = top['children'][0].get('operator_cardinality')
+    return {
+        'duckdb_seconds': profile.get('latency'),
+        'rows_in': profile.get('cumulative_rows_scanned'),
+        'rows_out': rows_out,
+        'bytes_read': profile.get('total_bytes_read'),
+        'bytes_written': profile.get('total_bytes_written'),
+        'peak_memory': profile.get('system_peak_buffer_memory'),
+    }
+
+
+# ------------------------------
+# Function: write_stage_report
+# Purpose: Add one stage's query records to reports/run_<id>.json (one file per pipeline run)
+# ------------------------------
+def write_stage_report(stage, queries):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    report_path = os.path.join(REPORT_DIR, f"run_{RUN_ID}.json")
+    report = {'run_id': RUN_ID, 'stages': {}}
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+    report['stages'][stage] = {
+        'queries': len(queries),
+        'wall_seconds': round(sum(q.get('wall_seconds') or 0 for q in queries), 6),
+        'duckdb_seconds': round(sum(q.get('duckdb_seconds') or 0 for q in queries), 6),
+        'rows_in': sum(q.get('rows_in') or 0 for q in queries),
+        'bytes_read': sum(q.get('bytes_read') or 0 for q in queries),
+        'slowest': sorted(queries, key=lambda q: -(q.get('duckdb_seconds') or 0))[:5],
+        'query_log': queries,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=1, default=str)
+    logger.info(f"Run report for stage {stage} written to {report_path}")
+    return report_path
+
+
+# ------------------------------
+# Class: ProfiledConnection
+# Purpose: Wrap a DuckDB connection so every execute() and executemany() is timed and profiled
+# DuckDB writes a query's JSON profile once its result has been consumed, so each query
+# is finalized when the next one starts (or on close/write_report). An executemany() is one
+# query_log record for the whole batch, timed by wall clock. set_stage() re-tags a shared
+# connection, so each record keeps the stage it ran in. Anything else is passed
+# straight through, so fetchone()/fetchall()/fetchdf() work as before.
+# ------------------------------
+class ProfiledConnection:
+    def __init__(self, con, stage):
+        self.con = con
+        self.queries = []
+        self.pending = None
+        self.opened_as = stage
+        con.execute("PRAGMA enable_profiling = 'json';")
+        self.set_stage(stage)
+
+    #Attribute the queries from here on to `stage` (e.g. 'load', 'clean' on a pipeline
+    #connection); no stage goes back to the one the connection was opened with
+    def set_stage(self, stage=None):
+        self.finish_pending()
+        self.stage = stage or self.opened_as
+        self.profile_dir = os.path.join(REPORT_DIR, RUN_ID, self.stage)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.profile_path = os.path.join(self.profile_dir, 'last_query.json')
+        self.con.execute(f"PRAGMA profiling_output = '{self.profile_path}';")
+
+    def execute(self, query, parameters=None):
+        self.finish_pending()
+        if os.path.exists(self.profile_path):
+            os.remove(self.profile_path)
+        self.pending = {
+            'run_id': RUN_ID,
+            'stage': self.stage,
+            'seq': len(self.queries) + 1,
+            'query': " ".join(query.split()),
+            'started_at': datetime.now().isoformat(timespec='milliseconds'),
+        }
+        start = time.perf_counter()
+        if parameters is None:
+            self.con.execute(query)
+        else:
+            self.con.execute(query, parameters)
+        self.pending['wall_seconds'] = round(time.perf_counter() - start, 6)
+        return self
+
+    #DuckDB's profile would only cover the last parameter set, so a batch is timed as a whole
+    def executemany(self, query, parameters):
+        self.finish_pending()
+        parameters = list(parameters)
+        record = {
+            'run_id': RUN_ID,
+            'stage': self.stage,
+            'seq': len(self.queries) + 1,
+            'query': f"{' '.join(query.split())} -- executemany x{len(parameters)}",
+            'started_at': datetime.now().isoformat(timespec='milliseconds'),
+        }
+        start = time.perf_counter()
+        self.con.executemany(query, parameters)
+        record.update(dict.fromkeys(
+            ('rows_in', 'rows_out', 'bytes_read', 'bytes_written', 'peak_memory', 'profile_path')
+        ))
+        record['wall_seconds'] = record['duckdb_seconds'] = round(time.perf_counter() - start, 6)
+        self.queries.append(record)
+        return self
+
+    #Record the previous query once DuckDB has written its profile
+    def finish_pending(self):
+        if self.pending is None:
+            return
+        record, self.pending = self.pending, None
+        #DuckDB only writes the profile once the result is exhausted; drain whatever the
+        #caller left unread (usually nothing, or the tail after a fetchone())
+        try:
+            self.con.fetchall()
+        except Exception:
+            pass
+        record.update(dict.fromkeys(
+            ('duckdb_seconds', 'rows_in', 'rows_out', 'bytes_read', 'bytes_written', 'peak_memory', 'profile_path')
+        ))
+        try:
+            #Statements DuckDB does not profile (SET, BEGIN, ...) leave no file behind
+            with open(self.profile_path) as f:
+                profile = json.load(f)
+            record.update(profile_metrics(profile))
+            if (record['duckdb_seconds'] or 0) >= SLOW_QUERY_SECONDS:
+                slow_path = os.path.join(self.profile_dir, f"query_{record['seq']:04d}.json")
+                os.replace(self.profile_path, slow_path)
+                record['profile_path'] = slow_path
+                logger.info(f"Slow query #{record['seq']} ({record['duckdb_seconds']:.2f}s): {record['query'][:120]}")
+        except (OSError, ValueError):
+            pass
+        self.queries.append(record)
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    #Add each stage's queries to the run report and the query_log table
+    def write_report(self):
+        self.finish_pending()
+        self.con.execute("PRAGMA disable_profiling;")
+        stages = list(dict.fromkeys([self.stage] + [q['stage'] for q in self.queries]))
+        for stage in stages:
+            report_path = write_stage_report(stage, [q for q in self.queries if q['stage'] == stage])
+
+        if self.queries:
+            try:
+                self.con.execute(f"CREATE TABLE IF NOT EXISTS query_log ({QUERY_LOG_COLUMNS});")
+                self.con.execute(f"DELETE FROM query_log WHERE run_id = ? AND stage IN ({', '.join('?' for _ in stages)});",
+                                 [RUN_ID] + stages)
+                columns = [line.split()[0] for line in QUERY_LOG_COLUMNS.strip().splitlines()]
+                self.con.executemany(
+                    f"INSERT INTO query_log VALUES ({', '.join('?' for _ in columns)});",
+                    [[q.get(column) for column in columns] for q in self.queries]
+                )
+            except Exception as e:
+                #A read-only connection can still produce the JSON report
+                logger.warning(f"Could not write query_log table: {e}")
+        return report_path
+
+    def close(self):
+        self.write_report()
+        self.con.close()
@@ -0,0 +1,352 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from db_config import connect
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Read-only HTTP/JSON query service for dashboards
+# The service never opens emissions.duckdb: after each dbt run transform.py publishes the
+# small serving tables (co2_rollup_cube, trip_leaderboard) into a new snapshot file under
+# data/snapshots and points data/snapshots/CURRENT at it. The service keeps one read-only
+# connection to the current snapshot with a pool of cursors, and switches to a newer
+# snapshot between requests, so ingestion is never locked out and no restart is needed.
+#   python query_service.py --port 8765
+#   GET /breakdown/hour_of_day?cab_type=yellow&year=2024&month=3
+#   GET /leaderboard?metric=trip_distance&cab_type=green&grain=month&year=2024&bucket=7&k=5
+# ------------------------------
+
+SNAPSHOT_DIR = os.environ.get('PIPELINE_SNAPSHOT_DIR', os.path.join('data', 'snapshots'))
+CURRENT_FILE = 'CURRENT'
+SNAPSHOT_TABLES = ['co2_rollup_cube', 'trip_leaderboard']
+#Older snapshots are deleted on publish; open ones stay readable until their connection closes
+KEEP_SNAPSHOTS = 3
+POOL_SIZE = int(os.environ.get('PIPELINE_QUERY_POOL', '8'))
+#How often requests check CURRENT for a newer snapshot
+RELOAD_SECONDS = 2.0
+
+#Breakdown dimensions served from the cube
+BREAKDOWNS = ['pickup_year', 'month_of_year', 'week_of_year', 'day_of_week', 'hour_of_day']
+
+#Query-string filter -> (cube column, type)
+FILTERS = {
+    'cab_type': ('cab_type', str),
+    'year': ('pickup_year', int),
+    'month': ('month_of_year', int),
+    'week': ('week_of_year', int),
+    'day_of_week': ('day_of_week', int),
+    'hour': ('hour_of_day', int),
+}
+
+LEADERBOARD_METRICS = ['co2_emissions_kg', 'trip_distance', 'avg_mph', 'total_amount']
+LEADERBOARD_GRAINS = ['all', 'month', 'hour']
+
+
+# ------------------------------
+# Function: publish_snapshot
+# Purpose: Copy the serving tables from the pipeline database into a new snapshot file
+# and make it current (CURRENT is replaced atomically, so readers see the old or the new
+# snapshot, never a partial one). Returns the snapshot path, or None if nothing to publish.
+# ------------------------------
+def publish_snapshot(con, snapshot_dir=SNAPSHOT_DIR):
+    tables = [table for table in SNAPSHOT_TABLES if con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?;", [table]
+    ).fetchone()[0]]
+    if not tables:
+        logger.warning("No serving tables to publish (run transform.py)")
+        return None
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"snapshot_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.duckdb"
+    path = os.path.join(snapshot_dir, name)
+    con.execute(f"ATTACH '{path}' AS snapshot;")
+    try:
+        for table in tables:
+            #cab_type is an ENUM of the pipeline database; the snapshot stores it as text
+            con.execute(f"""
+                CREATE TABLE snapshot.{table} AS
+                SELECT * REPLACE (CAST(cab_type AS VARCHAR) AS cab_type) FROM {table};
+            """)
+    finally:
+        con.execute("DETACH snapshot;")
+
+    pointer = os.path.join(snapshot_dir, CURRENT_FILE)
+    with open(f"{pointer}.tmp", 'w') as f:
+        f.write(name)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    prune_snapshots(snapshot_dir, keep={name, current_snapshot(snapshot_dir)})
+    logger.info(f"Published snapshot {name} ({', '.join(tables)})")
+    return path
+
+
+#Delete all but the KEEP_SNAPSHOTS newest snapshots, newest by modification time (names
+#only have one-second resolution). Snapshots named in `keep`, such as the one CURRENT
+#points to, are never deleted and count towards the kept ones.
+def prune_snapshots(snapshot_dir, keep=()):
+    snapshots = []
+    for f in os.listdir(snapshot_dir):
+        if f.startswith('snapshot_') and f.endswith('.duckdb') and f not in keep:
+            with contextlib.suppress(FileNotFoundError):
+                snapshots.append((os.path.getmtime(os.path.join(snapshot_dir, f)), f))
+    kept = len([f for f in keep if f])
+    for _, old in sorted(snapshots, reverse=True)[max(KEEP_SNAPSHOTS - kept, 0):]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(snapshot_dir, old))
+
+#Name of the current snapshot file, or None before the first publish
+def current_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+# ------------------------------
+# Class: SnapshotPool
+# Purpose: One read-only connection to the current snapshot plus POOL_SIZE cursors.
+# A request borrows a cursor (waiting if all are busy) and returns it afterwards. When a
+# newer snapshot is published, a new connection and pool replace the old ones; the old
+# connection is closed once its last borrowed cursor comes back.
+# ------------------------------
+class SnapshotPool:
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, size=POOL_SIZE):
+        self.snapshot_dir = snapshot_dir
+        self.size = size
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.current = None
+        self.checked_at = 0.0
+        self.refresh()
+
+    @property
+    def name(self):
+        return self.current['name'] if self.current else None
+
+    #Open the current snapshot if it changed since the last check
+    def refresh(self):
+        name = current_snapshot(self.snapshot_dir)
+        if name is None or name == self.name:
+            return
+        con = connect(read_only=True, database=os.path.join(self.snapshot_dir, name))
+        cursors = queue.Queue()
+        for _ in range(self.size):
+            cursors.put(con.cursor())
+        snapshot = {'name': name, 'con': con, 'cursors': cursors, 'borrowed': 0, 'retired': False}
+        with self.lock:
+            old, self.current = self.current, snapshot
+            if old is not None:
+                old['retired'] = True
+                if old['borrowed'] == 0:
+                    self.release(old)
+        logger.info(f"Serving snapshot {name}")
+
+    #Check CURRENT at most every RELOAD_SECONDS, and from one request at a time
+    def maybe_refresh(self):
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_SECONDS or not self.reload_lock.acquire(blocking=False):
+            return
+        try:
+            self.checked_at = now
+            self.refresh()
+        finally:
+            self.reload_lock.release()
+
+    #Close a retired snapshot's cursors and connection (called with the lock held)
+    def release(self, snapshot):
+        while not snapshot['cursors'].empty():
+            snapshot['cursors'].get_nowait().close()
+        snapshot['con'].close()
+
+    @contextlib.contextmanager
+    def cursor(self):
+        self.maybe_refresh()
+        with self.lock:
+            snapshot = self.current
+            if snapshot is None:
+                raise LookupError(f"No snapshot published in {self.snapshot_dir} yet")
+            snapshot['borrowed'] += 1
+        cursor = snapshot['cursors'].get()
+        try:
+            yield snapshot['name'], cursor
+        finally:
+            with self.lock:
+                snapshot['cursors'].put(cursor)
+                snapshot['borrowed'] -= 1
+                if snapshot['retired'] and snapshot['borrowed'] == 0:
+                    self.release(snapshot)
+
+    def close(self):
+        with self.lock:
+            if self.current is not None:
+                self.current['retired'] = True
+                if self.current['borrowed'] == 0:
+                    self.release(self.current)
+            self.current = None
+
+
+#Parse the filter parameters of a request into a WHERE clause and its parameters
+def filter_clause(params):
+    conditions, values = [], []
+    for key, (column, kind) in FILTERS.items():
+        if key in params:
+            try:
+                values.append(kind(params[key]))
+            except ValueError:
+                raise ValueError(f"Invalid {key}: {params[key]!r}")
+            conditions.append(f"{column} = ?")
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), values
+
+
+#CO2 per cab type and bucket of one dimension, re-derived from the cube's additive sums
+def breakdown(cursor, dimension, params):
+    if dimension not in BREAKDOWNS:
+        raise ValueError(f"Unknown breakdown {dimension!r}, expected one of {BREAKDOWNS}")
+    where, values = filter_clause(params)
+    return cursor.execute(f"""
+        SELECT
+            cab_type,
+            {dimension} AS bucket,
+            CAST(SUM(trips) AS BIGINT) AS trips,
+            ROUND(SUM(co2_sum), 2) AS total_co2_kg,
+            ROUND(SUM(co2_sum) / SUM(trips), 4) AS avg_co2_per_trip,
+            ROUND(SUM(distance_sum) / SUM(trips), 3) AS avg_distance,
+            ROUND(SUM(mph_sum) / SUM(trips), 3) AS avg_mph
+        FROM co2_rollup_cube
+        {where}
+        GROUP BY cab_type, {dimension}
+        ORDER BY cab_type, bucket;
+    """, values)
+
+
+#Top-K trips by a metric from trip_leaderboard
+def leaderboard(cursor, params):
+    metric = params.get('metric', 'co2_emissions_kg')
+    grain = params.get('grain', 'all')
+    if metric not in LEADERBOARD_METRICS:
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {LEADERBOARD_METRICS}")
+    if grain not in LEADERBOARD_GRAINS:
+        raise ValueError(f"Unknown grain {grain!r}, expected one of {LEADERBOARD_GRAINS}")
+    conditions, values = ["metric = ?", "grain = ?"], [metric, grain]
+    if grain == 'month' and 'bucket' in params and 'year' not in params:
+        raise ValueError("grain=month with a bucket needs a year")
+    for key, column, kind in (('cab_type', 'cab_type', str), ('year', 'pickup_year', int), ('bucket', 'bucket', int),
+                              ('k', 'rank', int)):
+        if key in params:
+            try:
+                values.append(kind(params[key]))
+            except ValueError:
+                raise ValueError(f"Invalid {key}: {params[key]!r}")
+            conditions.append(f"{column} <= ?" if key == 'k' else f"{column} = ?")
+    return cursor.execute(f"""
+        SELECT * EXCLUDE (built_at) FROM trip_leaderboard
+        WHERE {' AND '.join(conditions)}
+        ORDER BY cab_type, pickup_year, bucket, rank;
+    """, values)
+
+
+#Dashboards open many connections at once; the socketserver default backlog of 5 drops them
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    pool = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        start = time.perf_counter()
+        try:
+            with self.pool.cursor() as (snapshot, cursor):
+                if parts == ['health']:
+                    body = {'snapshot': snapshot}
+                elif len(parts) == 2 and parts[0] == 'breakdown':
+                    body = rows(breakdown(cursor, parts[1], params))
+                elif parts == ['leaderboard']:
+                    body = rows(leaderboard(cursor, params))
+                else:
+                    return self.respond(404, {'error': f"Unknown endpoint {url.path}"})
+            body['snapshot'] = snapshot
+            body['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self.respond(200, body)
+        except ValueError as e:
+            self.respond(400, {'error': str(e)})
+        except LookupError as e:
+            self.respond(503, {'error': str(e)})
+        except Exception as e:
+            logger.error(f"Query failed for {self.path}: {e}")
+            self.respond(500, {'error': str(e)})
+
+    def respond(self, status, body):
+        payload = json.dumps(body, default=json_value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+#DECIMAL columns (fares, distances) go out as JSON numbers, timestamps as ISO-like text
+def json_value(value):
+    return float(value) if isinstance(value, Decimal) else str(value)
+
+#Result rows of a cursor as a list of {column: value}
+def rows(cursor):
+    columns = [column[0] for column in cursor.description]
+    return {'columns': columns, 'rows': [dict(zip(columns, row)) for row in cursor.fetchall()]}
+
+
+# ------------------------------
+# Function: serve
+# Purpose: Serve the current snapshot over HTTP until interrupted
+# ------------------------------
+def serve(host='127.0.0.1', port=8765, snapshot_dir=SNAPSHOT_DIR, pool_size=POOL_SIZE):
+    pool = SnapshotPool(snapshot_dir, pool_size)
+    handler = type('PooledQueryHandler', (QueryHandler,), {'pool': pool})
+    server = QueryServer((host, port), handler)
+    logger.info(f"Query service listening on http://{host}:{port} (snapshot {pool.name})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='query_service.log'
+    )
+    parser = argparse.ArgumentParser(description="Read-only HTTP/JSON query service over the published snapshots")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE)
+    parser.add_argument('--publish', action='store_true', help="publish a snapshot from the pipeline database first")
+    args = parser.parse_args()
+    if args.publish:
+        con = connect()
+        publish_snapshot(con)
+        con.close()
+    serve(args.host, args.port, SNAPSHOT_DIR, args.pool_size)
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime
+
+from cache import ParquetCache, sha256_file
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIR = "data/result_cache"
+#Default disk budget for cached query results (512 MB)
+RESULT_CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+#One row per table: a new version every time dbt (or a shard merge) rewrites it
+VERSIONS_TABLE = 'table_versions'
+VERSIONS_COLUMNS = """
+    table_name VARCHAR PRIMARY KEY,
+    version VARCHAR,
+    updated_at TIMESTAMP
+"""
+
+
+#Whitespace and a trailing semicolon do not change a query's result
+def normalize_sql(sql):
+    return " ".join(sql.split()).rstrip(';').strip()
+
+# ------------------------------
+# Class: ResultCache
+# Purpose: Persist analysis query results as parquet, keyed by the normalized SQL.
+# Each entry records the data version of the tables the query reads, looked up in
+# table_versions (metadata only, the tables themselves are never scanned for it); a rebuilt
+# table invalidates exactly the entries that read it. A table with no recorded version
+# (built before versioning) is never answered from the cache. Storage, integrity checks and LRU eviction come from
+# ParquetCache (the data version is kept in its etag slot).
+# ------------------------------
+class ResultCache:
+    def __init__(self, root=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.files = ParquetCache(root, max_bytes)
+        self.versions = {}
+        self.invalidations = 0
+
+    #Version token of one table, looked up once per cache instance (i.e. per run); None if unversioned
+    def table_version(self, con, table):
+        if table not in self.versions:
+            row = None
+            if con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?;",
+                           [VERSIONS_TABLE]).fetchone()[0]:
+                row = con.execute(f"SELECT version FROM {VERSIONS_TABLE} WHERE table_name = ?;", [table]).fetchone()
+            if row is None:
+                logger.info(f"Result cache: {table} has no recorded version, its queries are not cached")
+            self.versions[table] = f"{table}:{row[0]}" if row else None
+        return self.versions[table]
+
+    def data_version(self, con, tables):
+        versions = [self.table_version(con, table) for table in sorted(tables)]
+        return None if None in versions else "|".join(versions)
+
+    # ------------------------------
+    # Function: execute
+    # Purpose: Run `sql` (which reads `tables`) through the cache and return the connection
+    # positioned on the result, so fetchall()/fetchdf() work as with con.execute()
+    # ------------------------------
+    def execute(self, con, sql, tables):
+        sql = normalize_sql(sql)
+        key = f"query:{hashlib.sha256(sql.encode()).hexdigest()}"
+        version = self.data_version(con, tables)
+        if version is None:
+            return con.execute(sql)
+
+        entry = self.files.index.get(key)
+        if entry is not None and entry['etag'] != version:
+            self.files.forget(key)
+            self.invalidations += 1
+        entry = self.files.lookup(key)
+
+        if entry is None:
+            tmp = os.path.join(self.files.tmp_dir, f"{uuid.uuid4().hex}.parquet")
+            con.execute(f"COPY ({sql}) TO '{tmp}' (FORMAT parquet);")
+            entry = self.files.store(key, tmp, sha256_file(tmp), etag=version)
+            self.files.enforce_budget()
+        self.files.save()
+        return con.execute(f"SELECT * FROM read_parquet('{entry['path']}');")
+
+    def log_stats(self):
+        self.files.log_stats()
+        logger.info(f"Result cache: {self.invalidations} entries invalidated by new data")
+
+
+#Give `table` a new version after writing it outside dbt (e.g. a shard merge)
+def record_table_version(con, table):
+    con.execute(f"CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} ({VERSIONS_COLUMNS});")
+    con.execute(f"INSERT OR REPLACE INTO {VERSIONS_TABLE} VALUES (?, ?, current_timestamp);",
+                [table, f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"])
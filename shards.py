@@ -0,0 +1,419 @@
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import time
+import uuid
+
+import duckdb
+import jinja2
+
+import clean
+import load
+import transform
+from cache import CACHE_DIR, ParquetCache
+from db_config import MEMORY_LIMIT, TEMP_DIRECTORY, THREADS, connect
+from result_cache import record_table_version
+
+#Stage modules configure their own log files on import; every shard worker logs here
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(process)d - %(message)s',
+    filename='shards.log',
+    force=True
+)
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Sharded clean + transform by cab type and source month
+# One shard is one TLC file. A worker process ingests it (load.py's typed select and column
+# mapping), cleans it (clean.py's rules and per-month dedup) and runs the dbt staging and
+# all_data_transformed SQL on it (rendered from dbt/models), in its own in-memory DuckDB,
+# and writes the clean, staged and transformed rows as Parquet (and its clean_stats counts
+# in the done marker). merge then swaps the finished shards into the pipeline database and
+# dbt rebuilds the marts from them.
+# Everything a worker needs lives under one shard directory, so workers on several nodes
+# can share it (paths in plan.json are relative to it):
+#   <shard_dir>/plan.json                             tasks: cab, month, checksum, input file
+#   <shard_dir>/inputs/vehicle_emissions.csv
+#   <shard_dir>/raw/<cab>_<YYYY-MM>.parquet           TLC file (hard link into the cache)
+#   <shard_dir>/clean/<cab>_<YYYY-MM>.parquet
+#   <shard_dir>/staging/<cab>_<YYYY-MM>.parquet       rows of the {cab}_data staging model
+#   <shard_dir>/transformed/<cab>_<YYYY-MM>.parquet
+#   <shard_dir>/_locks/<cab>_<YYYY-MM>.lock           claimed by a worker (O_EXCL create)
+#   <shard_dir>/_done/<cab>_<YYYY-MM>.json            finished, with the input checksum and clean stats
+#   python shards.py run --workers 8                  plan, work locally, merge
+#   python shards.py work --shard-dir /shared/shards  on each additional node
+# Dedup is per source month (clean.dedup_partitioned without the month-boundary pass).
+# ------------------------------
+
+SHARD_DIR = os.environ.get('PIPELINE_SHARD_DIR', os.path.join('data', 'shards'))
+#A lock older than this is assumed to belong to a crashed worker and is taken over
+LOCK_TIMEOUT_SECONDS = 3600
+MODELS_DIR = os.path.join('dbt', 'models')
+#The dbt models built from the merged shards (the staging tables are merged from the shards)
+MART_MODELS = 'co2_rollup_cube trip_leaderboard zone_od_hourly'
+
+MERGE_COLUMNS = """
+    cab_type VARCHAR,
+    source_month DATE,
+    checksum VARCHAR,
+    merged_at TIMESTAMP,
+    PRIMARY KEY (cab_type, source_month)
+"""
+
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+
+def shard_key(task):
+    return f"{task['cab']}_{task['month']}"
+
+#Parse a DuckDB memory setting like '4510MB' or '10GB' into bytes
+def memory_bytes(limit):
+    limit = limit.strip().upper().replace('IB', 'B')
+    for unit, size in UNITS.items():
+        if limit.endswith(unit):
+            return int(float(limit[:-len(unit)]) * size)
+    return int(limit)
+
+#Each of `workers` processes gets an even share of the memory limit and threads
+def worker_settings(workers):
+    return {
+        'memory_limit': f"{memory_bytes(MEMORY_LIMIT) // workers // 1024 ** 2}MB",
+        'threads': max(1, THREADS // workers),
+        'preserve_insertion_order': False,
+    }
+
+def table_exists(con, table):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?;", [table]
+    ).fetchone()[0] > 0
+
+def write_json(path, value):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(value, f, indent=1)
+    os.replace(tmp, path)
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ------------------------------
+# Function: plan
+# Purpose: Write plan.json with one task per loaded month (from load_manifest), linking each
+# month's cached TLC file and the emission factors CSV into the shard directory
+# ------------------------------
+def plan(con, shard_dir=SHARD_DIR, cache_dir=CACHE_DIR):
+    for sub in ('inputs', 'raw', 'clean', 'staging', 'transformed', '_locks', '_done'):
+        os.makedirs(os.path.join(shard_dir, sub), exist_ok=True)
+    shutil.copyfile(os.path.join('data', 'vehicle_emissions.csv'), os.path.join(shard_dir, 'inputs', 'vehicle_emissions.csv'))
+
+    cache = ParquetCache(cache_dir)
+    tasks = []
+    for cab, month, checksum in con.execute("""
+        SELECT cab_type, strftime(source_month, '%Y-%m'), checksum FROM load_manifest ORDER BY ALL;
+    """).fetchall():
+        source = cache.object_path(checksum)
+        if not os.path.exists(source):
+            logger.warning(f"Shard {cab} {month}: {source} is no longer cached, rerun load.py")
+            continue
+        task = {'cab': cab, 'month': month, 'checksum': checksum}
+        task['input'] = os.path.join('raw', f"{shard_key(task)}.parquet")
+        target = os.path.join(shard_dir, task['input'])
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+        task['bytes'] = os.path.getsize(target)
+        tasks.append(task)
+
+    write_json(os.path.join(shard_dir, 'plan.json'), {'tasks': tasks})
+    logger.info(f"Planned {len(tasks)} shards in {shard_dir}")
+    return tasks
+
+
+#A task is finished once its done marker records the checksum it was planned with
+#(markers written before shards kept their staging rows and clean stats are redone)
+def is_done(shard_dir, task):
+    done = read_json(os.path.join(shard_dir, '_done', f"{shard_key(task)}.json"))
+    return done is not None and done.get('checksum') == task['checksum'] and 'clean_stats' in done
+
+#Move a lock file to a unique path (an atomic rename), so only this exact file is then
+#inspected and removed, never a lock another worker created in its place meanwhile
+def set_aside(lock):
+    moved = f"{lock}.{uuid.uuid4().hex}.old"
+    try:
+        os.rename(lock, moved)
+    except FileNotFoundError:
+        return None
+    return moved
+
+#Put a lock that was set aside by mistake back, unless a new one was created since
+def restore(moved, lock):
+    try:
+        os.link(moved, lock)
+    except FileExistsError:
+        pass
+    os.remove(moved)
+
+#Claim a task with an exclusive lock file (atomic on local disks and NFS) holding a unique
+#token; stale locks are taken over. Returns (lock, token), or None if the task is held.
+def claim(shard_dir, task):
+    lock = os.path.join(shard_dir, '_locks', f"{shard_key(task)}.lock")
+    token = uuid.uuid4().hex
+    for _ in range(2):
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) < LOCK_TIMEOUT_SECONDS:
+                    return None
+            except FileNotFoundError:
+                continue
+            moved = set_aside(lock)
+            if moved is None:
+                continue
+            #Another worker may have replaced the stale lock between the check and the rename
+            if time.time() - os.path.getmtime(moved) < LOCK_TIMEOUT_SECONDS:
+                restore(moved, lock)
+                return None
+            logger.warning(f"Shard {shard_key(task)}: taking over a stale lock")
+            os.remove(moved)
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{socket.gethostname()} {os.getpid()} {time.time()} {token}")
+        return lock, token
+    return None
+
+#Remove our lock; after a stale takeover the lock file belongs to another worker and stays
+def release(lock, token):
+    moved = set_aside(lock)
+    if moved is None:
+        return
+    with open(moved) as f:
+        owner = f.read().split()
+    if owner and owner[-1] == token:
+        os.remove(moved)
+    else:
+        logger.warning(f"Lock {lock} was taken over by another worker, leaving it in place")
+        restore(moved, lock)
+
+
+#Render a dbt model's SQL for a worker: refs are the worker's tables, nothing is incremental
+def render_model(path, relations):
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(MODELS_DIR))
+    env.globals.update(
+        config=lambda **kwargs: '',
+        ref=lambda name: relations[name],
+        source=lambda source_name, name: relations[name],
+        clean_trips=lambda cab: relations[f"{cab}_tripdata_clean"],
+        is_incremental=lambda: False,
+        var=lambda name, default=None: default,
+    )
+    return env.get_template(path).render()
+
+#Copy a query's result to a Parquet file, atomically
+def copy_to(con, sql, path):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    con.execute(f"COPY ({sql}) TO '{tmp}' (FORMAT parquet);")
+    os.replace(tmp, path)
+
+
+# ------------------------------
+# Function: run_shard
+# Purpose: Ingest, clean and transform one cab type/month in a private in-memory database
+# and write <shard_dir>/clean, staging and transformed Parquet files for it. The done
+# marker carries the month's clean_stats counts ({rule: rows}) for merge.
+# ------------------------------
+def run_shard(shard_dir, task, settings):
+    start = time.perf_counter()
+    cab, month = task['cab'], task['month']
+    temp_directory = os.path.join(TEMP_DIRECTORY, f"shard_{os.getpid()}")
+    con = duckdb.connect(config=dict(settings, temp_directory=temp_directory))
+    try:
+        con.execute(load.CAB_TYPE_ENUM)
+        for c in ('yellow', 'green'):
+            con.execute(f"CREATE TABLE {c}_tripdata (\n{load.TRIP_COLUMNS}\n);")
+
+        #Same typed select and historical column mapping as load.py
+        files = [{'path': os.path.join(shard_dir, task['input']), 'ym': month}]
+        raw_rows = load.ingest_files(con, cab, files, load.source_columns(cab, load.file_columns(con, files)))
+
+        #Same rules and per-month dedup as clean.py; the other cab type's clean table stays empty
+        for c in ('yellow', 'green'):
+            months = [datetime.date.fromisoformat(f"{month}-01")] if c == cab else []
+            stats, _ = clean.dedup_partitioned(con, f"{c}_tripdata", f"{c}_tripdata_clean", months)
+            if c == cab:
+                clean_stats = stats[months[0]]
+
+        #dbt staging and all_data_transformed SQL, rendered against this worker's tables
+        relations = {
+            'vehicle_emissions': f"read_csv_auto('{os.path.join(shard_dir, 'inputs', 'vehicle_emissions.csv')}')",
+            'yellow_tripdata_clean': 'yellow_tripdata_clean',
+            'green_tripdata_clean': 'green_tripdata_clean',
+            'emission_factors': 'emission_factors',
+            'yellow_data': 'yellow_data',
+            'green_data': 'green_data',
+        }
+        for model in ('emission_factors', 'yellow_data', 'green_data'):
+            con.execute(f"CREATE TABLE {model} AS {render_model(f'staging/{model}.sql', relations)};")
+
+        name = f"{shard_key(task)}.parquet"
+        copy_to(con, f"SELECT * FROM {cab}_tripdata_clean", os.path.join(shard_dir, 'clean', name))
+        copy_to(con, f"SELECT * FROM {cab}_data", os.path.join(shard_dir, 'staging', name))
+        copy_to(con, render_model('marts/all_data_transformed.sql', relations), os.path.join(shard_dir, 'transformed', name))
+        counts = con.execute(f"""
+            SELECT (SELECT COUNT(*) FROM {cab}_tripdata_clean), (SELECT COUNT(*) FROM {cab}_data);
+        """).fetchone()
+    finally:
+        con.close()
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+    done = {
+        'checksum': task['checksum'],
+        'raw_rows': raw_rows,
+        'clean_rows': counts[0],
+        'transformed_rows': counts[1],
+        'clean_stats': {rule: int(count) for rule, count in clean_stats.items()},
+        'seconds': round(time.perf_counter() - start, 3),
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+    }
+    write_json(os.path.join(shard_dir, '_done', f"{shard_key(task)}.json"), done)
+    logger.info(f"Shard {cab} {month}: {raw_rows:,} raw, {counts[0]:,} clean, {counts[1]:,} transformed rows in {done['seconds']:.1f}s")
+    return done
+
+#Claim and run one task unless it is finished or another worker holds it
+def process_task(shard_dir, task, settings):
+    if is_done(shard_dir, task):
+        return 'done'
+    claimed = claim(shard_dir, task)
+    if claimed is None:
+        return 'busy'
+    try:
+        run_shard(shard_dir, task, settings)
+        return 'ran'
+    except Exception as e:
+        logger.error(f"Shard {shard_key(task)} failed: {e}")
+        return 'failed'
+    finally:
+        release(*claimed)
+
+def process_task_star(args):
+    return process_task(*args)
+
+# ------------------------------
+# Function: work
+# Purpose: Local work-queue scheduler: `workers` processes take the planned tasks largest
+# first (so the long shards do not end up last) until every task is done or claimed
+# elsewhere. Returns {'ran': n, 'done': n, 'busy': n, 'failed': n}.
+# ------------------------------
+def work(shard_dir=SHARD_DIR, workers=None):
+    workers = workers or os.cpu_count() or 1
+    tasks = sorted(read_json(os.path.join(shard_dir, 'plan.json'))['tasks'], key=lambda task: -task['bytes'])
+    settings = worker_settings(workers)
+    logger.info(f"Running {len(tasks)} shards on {workers} workers ({settings['threads']} threads, {settings['memory_limit']} each)")
+
+    outcomes = {'ran': 0, 'done': 0, 'busy': 0, 'failed': 0}
+    #spawn: workers start clean instead of inheriting the parent's DuckDB and logging state
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for outcome in pool.imap_unordered(process_task_star, [(shard_dir, task, settings) for task in tasks]):
+            outcomes[outcome] += 1
+    logger.info(f"Shard work finished: {outcomes}")
+    return outcomes
+
+
+# ------------------------------
+# Function: merge
+# Purpose: Swap every finished shard not merged yet into {cab}_tripdata_clean, the
+# {cab}_data staging tables and all_data_transformed (delete + insert per cab type and
+# source month) and replace its months' clean_stats rows, all in one transaction, then
+# let dbt rebuild the marts incrementally from the new rows
+# ------------------------------
+def merge(con, shard_dir=SHARD_DIR):
+    con.execute(f"CREATE TABLE IF NOT EXISTS shard_merges ({MERGE_COLUMNS});")
+    merged = {(cab, month): checksum for cab, month, checksum in con.execute(
+        "SELECT cab_type, strftime(source_month, '%Y-%m'), checksum FROM shard_merges;"
+    ).fetchall()}
+    tasks = [task for task in read_json(os.path.join(shard_dir, 'plan.json'))['tasks']
+             if is_done(shard_dir, task) and merged.get((task['cab'], task['month'])) != task['checksum']]
+    if not tasks:
+        logger.info("No new shards to merge")
+        return 0
+
+    con.execute(load.CAB_TYPE_ENUM)
+    tables = {'clean': '{cab}_tripdata_clean', 'staging': '{cab}_data', 'transformed': 'all_data_transformed'}
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        for layer, table_name in tables.items():
+            for cab in sorted({task['cab'] for task in tasks}):
+                cab_tasks = [task for task in tasks if task['cab'] == cab]
+                table = table_name.format(cab=cab)
+                files = ", ".join(f"'{os.path.join(shard_dir, layer, shard_key(task) + '.parquet')}'" for task in cab_tasks)
+                months = ", ".join(f"DATE '{task['month']}-01'" for task in cab_tasks)
+                #Merged rows count as transformed now (the same transaction time as their clean_stats
+                #rows), so the incremental marts pick them up and the staging models do not redo them
+                select = f"SELECT * REPLACE (current_timestamp::TIMESTAMP AS transformed_at) FROM read_parquet([{files}])" \
+                    if layer != 'clean' else f"SELECT * FROM read_parquet([{files}])"
+                if table_exists(con, table):
+                    cab_filter = f"cab_type = '{cab}' AND " if layer == 'transformed' else ""
+                    con.execute(f"DELETE FROM {table} WHERE {cab_filter}source_month IN ({months});")
+                    con.execute(f"INSERT INTO {table} BY NAME {select};")
+                else:
+                    con.execute(f"CREATE TABLE {table} AS {select};")
+                record_table_version(con, table)
+
+        #The same per-month rule counts clean.py records, from the shards' done markers
+        if clean.prepare_stats(con):
+            logger.warning("clean_stats had the old layout and was recreated; rerun clean.py for the other months")
+        for cab in sorted({task['cab'] for task in tasks}):
+            clean.write_stats(con, cab, {
+                f"{task['month']}-01": read_json(os.path.join(shard_dir, '_done', f"{shard_key(task)}.json"))['clean_stats']
+                for task in tasks if task['cab'] == cab
+            })
+        record_table_version(con, 'clean_stats')
+        for task in tasks:
+            con.execute(
+                "INSERT OR REPLACE INTO shard_merges VALUES (?, CAST(? AS DATE), ?, current_timestamp);",
+                [task['cab'], f"{task['month']}-01", task['checksum']]
+            )
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    logger.info(f"Merged {len(tasks)} shards into the clean, staging and transformed tables and clean_stats")
+    return len(tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded clean + transform by cab type and source month")
+    parser.add_argument('command', choices=['plan', 'work', 'merge', 'run'])
+    parser.add_argument('--shard-dir', default=SHARD_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command in ('plan', 'run'):
+        con = connect(read_only=True)
+        plan(con, args.shard_dir)
+        con.close()
+    if args.command in ('work', 'run'):
+        outcomes = work(args.shard_dir, args.workers)
+        print(", ".join(f"{outcome}: {count}" for outcome, count in outcomes.items()))
+    if args.command in ('merge', 'run'):
+        con = connect(stage='shard_merge')
+        merged = merge(con, args.shard_dir)
+        con.close()
+        #The marts read all_data_transformed incrementally, so only the merged months are rebuilt
+        if merged:
+            transform.run_dbt(select=MART_MODELS)
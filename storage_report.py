@@ -0,0 +1,106 @@
+import duckdb
+import logging
+import os
+import tempfile
+import time
+
+from db_config import DATABASE, connect
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='storage_report.log'
+)
+logger = logging.getLogger(__name__)
+
+#Column types as they arrive in the TLC parquet files, before load.py narrows them
+SOURCE_TYPES = {
+    'cab_type': 'VARCHAR',
+    'VendorID': 'BIGINT',
+    'pickup_datetime': 'TIMESTAMP',
+    'dropoff_datetime': 'TIMESTAMP',
+    'passenger_count': 'DOUBLE',
+    'trip_distance': 'DOUBLE',
+    'total_amount': 'DOUBLE',
+    'PULocationID': 'INTEGER',
+    'DOLocationID': 'INTEGER',
+}
+
+#A typical downstream scan: group by cab type and aggregate the narrowed columns
+SCAN_QUERY = """
+    SELECT cab_type, COUNT(*), SUM(passenger_count), AVG(trip_distance), SUM(total_amount), MAX(VendorID)
+    FROM {table}
+    GROUP BY cab_type;
+"""
+
+#Copy both trip tables into a scratch database, either as stored or widened back to source types
+def build_copy(con, path, widen):
+    con.execute(f"ATTACH '{path}' AS scratch;")
+    con.execute("CREATE TYPE scratch.cab_type_enum AS ENUM ('yellow', 'green');")
+    columns = ", ".join(
+        f"CAST({column} AS {data_type}) AS {column}" if widen else column
+        for column, data_type in SOURCE_TYPES.items()
+    )
+    con.execute(f"""
+        CREATE TABLE scratch.trips AS
+        SELECT {columns} FROM (
+            SELECT CAST('yellow' AS scratch.cab_type_enum) AS cab_type, * FROM src.yellow_tripdata
+            UNION ALL
+            SELECT CAST('green' AS scratch.cab_type_enum) AS cab_type, * FROM src.green_tripdata
+        );
+    """)
+    con.execute("DETACH scratch;")
+    return os.path.getsize(path)
+
+#Best-of-N wall time of SCAN_QUERY against a scratch database
+def time_scan(path, repeats=3):
+    scan = duckdb.connect(path, read_only=True)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        scan.execute(SCAN_QUERY.format(table='trips')).fetchall()
+        timings.append(time.perf_counter() - start)
+    scan.close()
+    return min(timings)
+
+# ------------------------------
+# Function: storage_report
+# Purpose: Compare database size and scan time of the trip data in its original source
+# types against the compact types load.py stores (UTINYINT, DECIMAL(9,2), cab_type ENUM)
+# ------------------------------
+def storage_report():
+    try:
+        #Scratch copies are written from an in-memory session so emissions.duckdb stays read-only
+        con = connect(database=':memory:')
+        con.execute(f"ATTACH '{DATABASE}' AS src (READ_ONLY);")
+        logger.info("Connected to DuckDB")
+        results = {}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, widen in (('source types', True), ('compact types', False)):
+                path = os.path.join(tmp, f"{label.replace(' ', '_')}.duckdb")
+                size = build_copy(con, path, widen)
+                results[label] = (size, time_scan(path))
+
+        rows = con.execute("SELECT (SELECT COUNT(*) FROM src.yellow_tripdata) + (SELECT COUNT(*) FROM src.green_tripdata)").fetchone()[0]
+        con.close()
+
+        (wide_size, wide_time), (compact_size, compact_time) = results['source types'], results['compact types']
+        report = (
+            f"Storage report for {rows:,} trips\n"
+            f"Source types:  {wide_size / 1024 ** 2:>10,.1f} MB, scan {wide_time * 1000:>8,.1f} ms\n"
+            f"Compact types: {compact_size / 1024 ** 2:>10,.1f} MB, scan {compact_time * 1000:>8,.1f} ms\n"
+            f"Saved {(1 - compact_size / wide_size) * 100:.1f}% disk, "
+            f"scan speedup {wide_time / compact_time:.2f}x\n"
+        )
+        print(report)
+        logger.info(report)
+        return results
+
+    except Exception as e:
+        logger.error(f"Storage report failed: {e}")
+        print(f"Storage report failed: {e}")
+
+
+if __name__ == "__main__":
+    storage_report()
@@ -0,0 +1,117 @@
+import argparse
+import logging
+import os
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+SYNTH_DIR = "data/synthetic"
+
+#Default rates of the dirty rows clean.py has to remove
+DEFAULT_RATES = {
+    'duplicate_rate': 0.01,
+    'zero_passenger_rate': 0.02,
+    'absurd_distance_rate': 0.005,
+    'long_trip_rate': 0.001,
+}
+
+#Deterministic uniform [0, 1) per row and stream, so output does not depend on thread scheduling
+def uniform(stream, seed):
+    return f"((hash(i, {seed}, {stream}) % 1000003) / 1000003.0)"
+
+# ------------------------------
+# Function: generate_month
+# Purpose: Write one synthetic TLC month as {cab}_tripdata_YYYY-MM.parquet with the raw
+# columns load.py reads (tpep_/lpep_ datetimes, VendorID, passenger_count, trip_distance,
+# total_amount, PULocationID, DOLocationID). Pickups follow a daily curve peaking in the
+# evening, distances follow trip duration at city speeds, fares follow distance, and zone
+# IDs are skewed towards a few busy zones. A configurable share of rows is
+# made dirty (zero passengers, absurd distances, >24h trips) or duplicated.
+# ------------------------------
+def generate_month(con, cab, year, month, rows, out_dir=SYNTH_DIR, seed=42, **rates):
+    rates = {**DEFAULT_RATES, **rates}
+    prefix = 'tpep' if cab == 'yellow' else 'lpep'
+    month_seed = seed * 1_000_000 + year * 100 + month + (0 if cab == 'yellow' else 500_000)
+    u = lambda stream: uniform(stream, month_seed)
+    path = os.path.join(out_dir, f"{cab}_tripdata_{year}-{month:02d}.parquet")
+
+    con.execute(f"""
+        COPY (
+            WITH trips AS (
+                SELECT
+                    i,
+                    CAST(1 + floor({u(1)} * 2) AS INTEGER) AS VendorID,
+                    --Day uniform over the month, hour skewed towards the evening peak
+                    make_timestamp({year}, {month}, 1, 0, 0, 0)
+                        + to_days(CAST(floor({u(2)} * day(last_day(make_date({year}, {month}, 1)))) AS INTEGER))
+                        + to_seconds(CAST(floor(86400 * (1 - power({u(3)}, 1.6))) AS BIGINT)) AS pickup,
+                    --Duration in seconds: mostly 5-40 minutes, a few >24h
+                    CASE WHEN {u(4)} < {rates['long_trip_rate']}
+                         THEN 86400 + CAST({u(5)} * 86400 AS BIGINT)
+                         ELSE CAST(180 + 2400 * power({u(5)}, 2) AS BIGINT) END AS duration_s,
+                    CASE WHEN {u(6)} < {rates['zero_passenger_rate']} THEN 0
+                         ELSE CAST(1 + floor(power({u(7)}, 3) * 5) AS BIGINT) END AS passenger_count,
+                    {u(8)} AS distance_draw,
+                    {u(9)} AS fare_draw,
+                    --Zones 1-263 (264/265 are TLC's unknown zones), a few busy ones dominating
+                    CAST(1 + floor(power({u(10)}, 2) * 263) AS INTEGER) AS PULocationID,
+                    CAST(1 + floor(power({u(11)}, 2) * 263) AS INTEGER) AS DOLocationID
+                FROM range({int(rows)}) t(i)
+            ),
+            shaped AS (
+                SELECT
+                    VendorID,
+                    pickup AS {prefix}_pickup_datetime,
+                    pickup + to_seconds(duration_s) AS {prefix}_dropoff_datetime,
+                    passenger_count{'' if cab == 'yellow' else '::DOUBLE'} AS passenger_count,
+                    CASE WHEN distance_draw < {rates['absurd_distance_rate']} / 2 THEN 0.0
+                         WHEN distance_draw < {rates['absurd_distance_rate']} THEN round(100 + distance_draw * 1e6, 2)
+                         ELSE round(least(duration_s, 7200) / 3600.0 * (6 + 18 * distance_draw), 2) END AS trip_distance,
+                    round(3.0 + 2.5 * least(duration_s, 7200) / 3600.0 * 12 + 8 * fare_draw, 2) AS total_amount,
+                    PULocationID,
+                    DOLocationID
+                FROM trips
+            )
+            SELECT * FROM shaped
+            UNION ALL
+            SELECT * FROM shaped USING SAMPLE {rates['duplicate_rate'] * 100}% (bernoulli, {month_seed % 2_147_483_647})
+        ) TO '{path}' (FORMAT parquet);
+    """)
+    return path
+
+# ------------------------------
+# Function: generate
+# Purpose: Write yellow and green months for a year range into out_dir, ready for
+# load.load_parquet_files(..., base_url='file://<abs out_dir>')
+# ------------------------------
+def generate(start_year=2024, end_year=2024, rows_per_month=100_000, out_dir=SYNTH_DIR, seed=42, **rates):
+    os.makedirs(out_dir, exist_ok=True)
+    con = duckdb.connect()
+    paths = []
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            for cab in ('yellow', 'green'):
+                paths.append(generate_month(con, cab, year, month, rows_per_month, out_dir, seed, **rates))
+    con.close()
+    logger.info(f"Generated {len(paths)} synthetic months ({rows_per_month:,} rows each) in {out_dir}")
+    return paths
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='synth.log'
+    )
+    parser = argparse.ArgumentParser(description="Write synthetic yellow/green TLC parquet months")
+    parser.add_argument('--start-year', type=int, default=2024)
+    parser.add_argument('--end-year', type=int, default=2024)
+    parser.add_argument('--rows-per-month', type=int, default=100_000)
+    parser.add_argument('--out-dir', default=SYNTH_DIR)
+    parser.add_argument('--seed', type=int, default=42)
+    for name, value in DEFAULT_RATES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=value)
+    args = vars(parser.parse_args())
+    generate(args.pop('start_year'), args.pop('end_year'), args.pop('rows_per_month'),
+             args.pop('out_dir'), args.pop('seed'), **args)
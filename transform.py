@@ -1,4 +1,91 @@
-import duckdb
+import json
 import logging
+import os
+import subprocess
 
-#USING DBT FOR TRANSFORMATIONS
\ No newline at end of file
+import trip_store
+from db_config import connect, dbt_env
+from profiling import RUN_ID, write_stage_report
+from query_service import publish_snapshot
+
+#USING DBT FOR TRANSFORMATIONS
+#The models live in dbt/models; this script runs them with the shared DuckDB profile
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='transform.log'
+)
+logger = logging.getLogger(__name__)
+
+#Add per-model timings from dbt's run_results.json to the pipeline run report
+def record_dbt_timings(path=os.path.join('dbt', 'target', 'run_results.json')):
+    try:
+        with open(path) as f:
+            results = json.load(f)['results']
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"No dbt run results to report: {e}")
+        return
+    queries = [{
+        'run_id': RUN_ID,
+        'stage': 'transform',
+        'seq': seq,
+        'query': result['unique_id'],
+        'started_at': next((t['started_at'] for t in result['timing'] if t['name'] == 'execute'), None),
+        'wall_seconds': result['execution_time'],
+        'status': result['status'],
+    } for seq, result in enumerate(results, start=1)]
+    write_stage_report('transform', queries)
+
+#Publish the freshly built cube and leaderboard to the read-only query service
+def publish_serving_snapshot():
+    con = connect(stage='publish')
+    try:
+        publish_snapshot(con)
+    finally:
+        con.close()
+
+#Copy the pickup months dbt just rebuilt into the Parquet trip store
+def export_trip_store():
+    con = connect(stage='trip_store')
+    try:
+        replaced = trip_store.export_transformed(con)
+        logger.info(f"Exported {replaced} transformed partitions to {trip_store.TRIP_STORE}")
+    finally:
+        con.close()
+
+# ------------------------------
+# Function: run_dbt
+# Purpose: Run a dbt command against dbt/ with the same memory/thread/spill settings as
+# the Python stages (exported through the PIPELINE_* environment variables)
+# Models are incremental and only rebuild source months reloaded since their last run;
+# full_refresh=True rebuilds them from scratch (e.g. after changing clean.py's rules)
+# ------------------------------
+def run_dbt(command='run', select=None, full_refresh=False):
+    args = ['dbt', command, '--project-dir', 'dbt', '--profiles-dir', 'dbt']
+    if select:
+        args += ['--select', select]
+    if full_refresh:
+        args.append('--full-refresh')
+    logger.info(f"Running: {' '.join(args)}")
+    try:
+        result = subprocess.run(args, env=dbt_env(), capture_output=True, text=True)
+        logger.info(result.stdout)
+        if result.returncode != 0:
+            logger.error(f"dbt {command} failed:\n{result.stderr}")
+            print(f"dbt {command} failed, see transform.log")
+            return False
+        record_dbt_timings()
+        if command == 'run' and trip_store.enabled():
+            export_trip_store()
+        if command == 'run':
+            publish_serving_snapshot()
+        return True
+    except FileNotFoundError:
+        logger.error("dbt is not installed (pip install dbt-duckdb)")
+        print("dbt is not installed (pip install dbt-duckdb)")
+        return False
+
+
+if __name__ == "__main__":
+    run_dbt()
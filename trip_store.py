@@ -0,0 +1,171 @@
+import datetime
+import glob
+import logging
+import os
+import shutil
+import uuid
+
+from db_config import TRIP_STORE
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Optional Hive-partitioned Parquet store for cleaned and transformed trips
+# Enabled by setting PIPELINE_TRIP_STORE to a directory (local or shared), laid out as
+#   <store>/clean/cab_type=yellow/year=2024/month=3/trips_<uuid>.parquet
+#   <store>/transformed/cab_type=green/year=2024/month=3/trips_<uuid>.parquet
+# year/month are the pickup month. Files inside a partition are sorted by pickup_datetime,
+# so row-group min/max statistics on pickup time let DuckDB skip most of a file too.
+# ------------------------------
+
+PARTITION_COLUMNS = ('cab_type', 'year', 'month')
+HIVE_TYPES = "{'cab_type': VARCHAR, 'year': INTEGER, 'month': INTEGER}"
+ROW_GROUP_SIZE = 122880
+
+STATE_COLUMNS = """
+    layer VARCHAR PRIMARY KEY,
+    exported_at TIMESTAMP
+"""
+
+
+def enabled():
+    return bool(TRIP_STORE)
+
+#Glob for one layer, narrowed to one cab type's directory when given (partition pruning by path)
+def layer_path(layer, cab=None):
+    root = os.path.join(TRIP_STORE, layer)
+    return os.path.join(root, f"cab_type={cab}", '**', '*.parquet') if cab else os.path.join(root, '**', '*.parquet')
+
+#FROM-clause relation that reads a layer in place; filters on cab_type/year/month prune whole files.
+#`row_numbers` adds the filename and file_row_number columns (to tell blocks of rows apart).
+def relation(layer, cab=None, row_numbers=False):
+    extra = ", filename = true, file_row_number = true" if row_numbers else ""
+    return f"read_parquet('{layer_path(layer, cab)}', hive_partitioning = true, hive_types = {HIVE_TYPES}{extra})"
+
+#Hive directory of one partition, relative to the layer
+def partition_dir(cab, year, month):
+    return os.path.join(f"cab_type={cab}", f"year={year}", f"month={month}")
+
+#Swap one partition directory for `new` (None removes it): the old directory is renamed
+#aside, the new one renamed in, then the old one deleted. Each step is a single rename, so
+#a reader sees the old files or the new ones, never a mix or a partly deleted directory.
+def swap_partition(target, new, aside):
+    if os.path.exists(target):
+        os.replace(target, aside)
+    if new is not None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(new, target)
+    shutil.rmtree(aside, ignore_errors=True)
+
+# ------------------------------
+# Function: write_partitions
+# Purpose: Write the rows of `select_sql` (which must have cab_type, year and month columns)
+# to a layer. Files are first written to a staging directory, then each partition they
+# cover is swapped in for the old one (see swap_partition). `partitions` lists
+# (cab_type, year, month) partitions that are being rewritten; those the select has no
+# rows for any more are removed.
+# ------------------------------
+def write_partitions(con, layer, select_sql, partitions=()):
+    staging = os.path.join(TRIP_STORE, '_staging', f"{layer}_{uuid.uuid4().hex}")
+    os.makedirs(os.path.dirname(staging), exist_ok=True)
+    con.execute(f"""
+        COPY ({select_sql} ORDER BY cab_type, year, month, pickup_datetime)
+        TO '{staging}' (
+            FORMAT parquet,
+            PARTITION_BY ({', '.join(PARTITION_COLUMNS)}),
+            ROW_GROUP_SIZE {ROW_GROUP_SIZE},
+            FILENAME_PATTERN 'trips_{{uuid}}'
+        );
+    """)
+
+    written = set()
+    for cab_dir in sorted(os.listdir(staging)) if os.path.isdir(staging) else []:
+        for year_dir in sorted(os.listdir(os.path.join(staging, cab_dir))):
+            for month_dir in sorted(os.listdir(os.path.join(staging, cab_dir, year_dir))):
+                written.add(os.path.join(cab_dir, year_dir, month_dir))
+    emptied = {partition_dir(*partition) for partition in partitions} - written
+
+    aside = f"{staging}_old"
+    for partition in sorted(written | emptied):
+        new = os.path.join(staging, partition) if partition in written else None
+        swap_partition(os.path.join(TRIP_STORE, layer, partition), new, aside)
+    shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"Trip store {layer}: replaced {len(written)} partitions, removed {len(emptied)}")
+    return len(written)
+
+# ------------------------------
+# Function: export_clean
+# Purpose: Rewrite the pickup-month partitions of one cab type's cleaned trips that the
+# source months cleaned since the last export touch (clean_stats.cleaned_at, which an
+# incremental clean only moves for the months it rewrote). A touched partition is one
+# the new rows fall in or one the store already holds rows of those months in; it is
+# rebuilt from every clean row of its pickup month. The newest cleaned_at exported is kept
+# in trip_store_state; the first export (or one into an empty store) writes them all.
+# ------------------------------
+def export_clean(con, cab):
+    con.execute(f"CREATE TABLE IF NOT EXISTS trip_store_state ({STATE_COLUMNS});")
+    state = f"clean_{cab}"
+    last = con.execute("SELECT MAX(exported_at) FROM trip_store_state WHERE layer = ?;", [state]).fetchone()[0]
+    if not glob.glob(layer_path('clean', cab), recursive=True):
+        last = None
+
+    changed = [month for (month,) in con.execute(
+        "SELECT DISTINCT source_month FROM clean_stats WHERE cab_type = ? AND cleaned_at > ?;",
+        [cab, last or datetime.datetime(1970, 1, 1)]
+    ).fetchall()]
+    month_list = ", ".join(f"DATE '{month}'" for month in changed) or "NULL"
+
+    #Partitions already holding rows of the changed months, or of months no longer cleaned at all
+    partitions = []
+    if last is not None:
+        partitions = con.execute(f"""
+            SELECT DISTINCT cab_type, year, month
+            FROM {relation('clean', cab)}
+            WHERE source_month IN ({month_list})
+               OR source_month NOT IN (SELECT source_month FROM clean_stats WHERE cab_type = ?);
+        """, [cab]).fetchall()
+    stored = ", ".join(f"({year}, {month})" for _, year, month in partitions) or "(NULL, NULL)"
+
+    replaced = write_partitions(con, 'clean', f"""
+        WITH trips AS (
+            SELECT *, '{cab}' AS cab_type, year(pickup_datetime) AS year, month(pickup_datetime) AS month
+            FROM {cab}_tripdata_clean
+        ),
+        touched AS (
+            SELECT DISTINCT year, month FROM trips WHERE source_month IN ({month_list})
+            UNION
+            SELECT * FROM (VALUES {stored}) AS p(year, month)
+        )
+        SELECT * FROM trips SEMI JOIN touched USING (year, month)
+    """, partitions)
+    con.execute(
+        "INSERT OR REPLACE INTO trip_store_state VALUES (?, (SELECT MAX(cleaned_at) FROM clean_stats WHERE cab_type = ?));",
+        [state, cab]
+    )
+    return replaced
+
+# ------------------------------
+# Function: export_transformed
+# Purpose: Write the pickup-month partitions of all_data_transformed that dbt has
+# (re)built since the last export; untouched partitions are left as they are
+# ------------------------------
+def export_transformed(con):
+    con.execute(f"CREATE TABLE IF NOT EXISTS trip_store_state ({STATE_COLUMNS});")
+    last = con.execute("SELECT MAX(exported_at) FROM trip_store_state WHERE layer = 'transformed';").fetchone()[0]
+    since = f"TIMESTAMP '{last}'" if last else "TIMESTAMP '1970-01-01'"
+
+    replaced = write_partitions(con, 'transformed', f"""
+        WITH trips AS (
+            SELECT * EXCLUDE (cab_type), CAST(cab_type AS VARCHAR) AS cab_type,
+                   year(pickup_datetime) AS year, month(pickup_datetime) AS month
+            FROM all_data_transformed
+        ),
+        changed AS (
+            SELECT DISTINCT cab_type, year, month FROM trips WHERE transformed_at > {since}
+        )
+        SELECT * FROM trips SEMI JOIN changed USING (cab_type, year, month)
+    """)
+    con.execute(
+        "INSERT OR REPLACE INTO trip_store_state VALUES ('transformed', (SELECT MAX(transformed_at) FROM all_data_transformed));"
+    )
+    return replaced